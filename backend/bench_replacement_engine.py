@@ -0,0 +1,96 @@
+"""
+Benchmark: per-field replace_nth_occurrence loop vs. compiled single-pass replacement
+
+Run from the backend directory (with the same .env as the app):
+    python bench_replacement_engine.py
+
+Sample run (Python 3.11):
+    placeholders   doc size  legacy (ms)  compiled (ms)  speedup
+              10       11KB          0.3            0.4     0.9x
+              50       56KB          7.9            1.6     5.0x
+             100      113KB         30.4            3.1     9.7x
+             200      227KB        118.2            6.9    17.1x
+             500      568KB        888.5           19.8    44.8x
+"""
+import random
+import time
+
+from docx_engine.compiled_template import CompiledTemplate, PlaceholderMatcher
+
+
+def replace_nth_occurrence(text: str, placeholder: str, replacement: str, n: int) -> str:
+    """Previous implementation: split/join the whole text once per field"""
+    parts = text.split(placeholder)
+    if len(parts) <= n + 1:
+        return text
+    before = placeholder.join(parts[:n+1])
+    after = placeholder.join(parts[n+1:])
+    return before + replacement + after
+
+
+def build_template(placeholder_count: int, paragraphs_per_placeholder: int = 3):
+    """Synthetic agreement: filler paragraphs with each placeholder used twice"""
+    random.seed(placeholder_count)
+    placeholders = [f"[FIELD_{i:04d}]" for i in range(placeholder_count)]
+    filler = "The parties agree to the terms set out in this section and the schedules attached hereto. "
+
+    paragraphs = []
+    for placeholder in placeholders * 2:
+        for _ in range(paragraphs_per_placeholder - 1):
+            paragraphs.append(filler * 2)
+        paragraphs.append(f"{filler}Value: {placeholder}. {filler}")
+    random.shuffle(paragraphs)
+
+    fields = [
+        {"placeholder": placeholder, "occurrence_index": occurrence, "value": f"value {i}"}
+        for i, placeholder in enumerate(placeholders)
+        for occurrence in (0, 1)
+    ]
+    return paragraphs, fields
+
+
+def bench_legacy(html: str, paragraphs, fields):
+    # Preview: one split/join of the full HTML per field
+    for field in fields:
+        html = replace_nth_occurrence(html, field["placeholder"], field["value"], field["occurrence_index"])
+    # Completed document: every field tested against every paragraph
+    for text in paragraphs:
+        for field in fields:
+            if field["placeholder"] in text:
+                text = replace_nth_occurrence(text, field["placeholder"], field["value"], field["occurrence_index"])
+
+
+def bench_compiled(html: str, paragraphs, fields):
+    replacements = {(f["placeholder"], f["occurrence_index"]): f["value"] for f in fields}
+    matcher = PlaceholderMatcher(f["placeholder"] for f in fields)
+    # Preview: one scan + one stitch over the full HTML
+    CompiledTemplate(html, matcher).render(replacements)
+    # Completed document: one scan per paragraph, occurrence indices counted document-wide
+    counters = {}
+    for text in paragraphs:
+        CompiledTemplate(text, matcher, counters).render(replacements)
+
+
+def timed(fn, *args, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+print("=" * 80)
+print("REPLACEMENT ENGINE BENCHMARK")
+print("=" * 80)
+print(f"{'placeholders':>12} {'doc size':>10} {'legacy (ms)':>12} {'compiled (ms)':>14} {'speedup':>8}")
+
+for placeholder_count in (10, 50, 100, 200, 500):
+    paragraphs, fields = build_template(placeholder_count)
+    html = "".join(f"<p>{text}</p>" for text in paragraphs)
+
+    legacy = timed(bench_legacy, html, paragraphs, fields)
+    compiled = timed(bench_compiled, html, paragraphs, fields)
+
+    print(f"{placeholder_count:>12} {len(html) // 1024:>8}KB {legacy * 1000:>12.1f} "
+          f"{compiled * 1000:>14.1f} {legacy / compiled:>7.1f}x")
@@ -13,15 +13,54 @@ class Settings(BaseSettings):
     # Supabase Configuration
     SUPABASE_URL: str
     SUPABASE_KEY: str
+    DB_HTTP2: bool = True
+    DB_TIMEOUT_SECONDS: float = 10.0
+    DB_POOL_MAX_CONNECTIONS: int = 100
+    DB_POOL_MAX_KEEPALIVE: int = 20
+    DB_POOL_KEEPALIVE_EXPIRY_SECONDS: float = 30.0
+    FIELD_INSERT_CHUNK_SIZE: int = 500  # Max rows per bulk insert into fields
+    MESSAGE_WRITE_BATCH_SIZE: int = 100  # Conversation messages per write-behind batch
+    MESSAGE_WRITE_INTERVAL_SECONDS: float = 0.2  # Max time a message waits before it is written
+    MESSAGE_WRITE_MAX_RETRIES: int = 5  # Failed flushes of a batch before its bad rows are isolated and dropped
+    MESSAGE_WRITE_MAX_PENDING: int = 10000  # Messages queued at most (further messages are not persisted)
 
     # Google Gemini AI Configuration
     GEMINI_API_KEY: str
+    LLM_TIMEOUT_SECONDS: float = 30.0  # Per-call deadline for chat LLM calls
+    PLACEHOLDER_EXTRACTION_TIMEOUT_SECONDS: float = 120.0  # Whole-document analysis takes longer
+    LLM_MAX_CONCURRENCY: int = 64  # Max in-flight Gemini calls per worker
+    PRECOMPUTE_QUESTIONS: bool = True  # Generate all first-attempt questions in one batch at ingest
+
+    # Caching Configuration
+    TEMPLATE_CACHE_MAX_ENTRIES: int = 256  # In-memory tier of the template fingerprint cache
+    PREVIEW_CACHE_MAX_BYTES: int = 64 * 1024 * 1024  # Base + rendered preview HTML kept per worker
+    CONVERSATION_CACHE_BACKEND: str = "memory"  # "memory" (per worker) or "redis" (shared by all workers)
+    REDIS_URL: str = "redis://localhost:6379/0"
+    CONVERSATION_CACHE_MAX_ENTRIES: int = 10000
+    CONVERSATION_CACHE_MAX_BYTES: int = 128 * 1024 * 1024
+    CONVERSATION_CACHE_TTL_SECONDS: float = 1800.0  # Expire conversations idle for 30 minutes
+    CONVERSATION_CACHE_SHARDS: int = 16  # Lock stripes
+    CONVERSATION_CACHE_SWEEP_SECONDS: float = 60.0  # Background expiry sweep interval
+
+    # Conversation Memory Configuration
+    MEMORY_TOKEN_BUDGET: int = 1000  # Recent turns kept verbatim in prompts; older turns are summarized
+
+    # Document Processing Job Queue
+    JOB_WORKER_CONCURRENCY: int = 2  # Processing tasks run at once per worker (the rest wait in the queue)
+    JOB_POLL_INTERVAL_SECONDS: float = 1.0  # How often idle workers look for tasks enqueued elsewhere
+    JOB_LEASE_SECONDS: int = 300  # A task whose worker stops renewing its lease is picked up again
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_RETRY_BASE_SECONDS: float = 5.0  # Retry backoff: base * 2^(attempt - 1)
+
+    # Docx Processing Configuration
+    DOCX_POOL_WORKERS: int = 0  # Processes for docx parsing/rendering (0 = one per CPU core)
 
     # Application Configuration
     APP_NAME: str = "LegalDoc Filler Backend"
     APP_VERSION: str = "1.0.0"
     DEBUG: bool = False  # Default to False for production, override with env var
     ALLOWED_ORIGINS: str = "http://localhost:3000"
+    SSE_KEEPALIVE_SECONDS: float = 15.0  # Comment ping interval on idle event streams
 
     # File Upload Configuration
     MAX_FILE_SIZE_MB: int = 10
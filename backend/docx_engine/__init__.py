@@ -0,0 +1,8 @@
+"""
+Pure .docx/HTML processing with no application dependencies.
+
+Kept outside the services package so docx process pool workers import only this
+package and the docx libraries (not the Gemini client, database or service singletons).
+Spawned workers also re-import the launching script, so the server is started with
+uvicorn rather than from a script that builds the app (see README).
+"""
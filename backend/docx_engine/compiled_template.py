@@ -0,0 +1,152 @@
+"""
+Compiled template representation: placeholder occurrences resolved to offsets once,
+so rendering is a single linear pass that stitches static segments and values together
+"""
+from typing import List, Dict, Iterable, Iterator, Optional, Tuple, Union
+import re
+
+
+# (placeholder, occurrence_index) -> replacement text. An occurrence_index of None
+# fills every occurrence of the placeholder that has no entry of its own
+Replacements = Dict[Tuple[str, Optional[int]], str]
+
+
+def _trie_to_pattern(node: Dict[str, dict]) -> str:
+    """Emit a regex for a character trie; optional tails are greedy, so the longest placeholder wins"""
+    branches = [re.escape(char) + _trie_to_pattern(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ""
+    body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    if "" in node:
+        # A placeholder ends here but longer ones continue: try the longer match first
+        return "(?:" + body + ")?"
+    return body
+
+
+class PlaceholderMatcher:
+    """
+    Multi-pattern matcher over a set of placeholders.
+
+    The placeholders are folded into a character trie and emitted as one regex, so a
+    single scan finds every occurrence (leftmost-longest, non-overlapping) and each
+    position only follows the trie branch for the next character, Aho-Corasick style,
+    instead of testing every placeholder in turn.
+    """
+
+    __slots__ = ("placeholders", "pattern")
+
+    def __init__(self, placeholders: Iterable[str]):
+        self.placeholders = {placeholder for placeholder in placeholders if placeholder}
+        trie: Dict[str, dict] = {}
+        for placeholder in self.placeholders:
+            node = trie
+            for char in placeholder:
+                node = node.setdefault(char, {})
+            node[""] = {}
+        self.pattern = re.compile(_trie_to_pattern(trie)) if trie else None
+
+    def finditer(self, text: str) -> Iterator[Tuple[int, int, str]]:
+        """Yield (start, end, placeholder) for every occurrence in text"""
+        if self.pattern is None:
+            return
+        for match in self.pattern.finditer(text):
+            yield match.start(), match.end(), match.group(0)
+
+
+class CompiledTemplate:
+    """
+    A source string (plain text, HTML or a single docx paragraph) with every
+    placeholder occurrence recorded as a slot: (placeholder, occurrence_index, start, end).
+
+    Occurrence indices are counted in document order. Pass a shared `counters` dict to
+    continue counting across several sources (e.g. consecutive docx paragraphs).
+    Overlapping matches are resolved in favour of the earliest, then longest, placeholder.
+    """
+
+    __slots__ = ("source", "slots", "placeholders")
+
+    def __init__(self, source: str, placeholders: Union[PlaceholderMatcher, Iterable[str]],
+                 counters: Optional[Dict[str, int]] = None):
+        self.source = source
+        self.slots: List[Tuple[str, int, int, int]] = []
+
+        if counters is None:
+            counters = {}
+        matcher = placeholders if isinstance(placeholders, PlaceholderMatcher) else PlaceholderMatcher(placeholders)
+        self.placeholders = matcher.placeholders
+
+        # One scan over the source locates every placeholder occurrence
+        for start, end, placeholder in matcher.finditer(source):
+            occurrence_index = counters.get(placeholder, 0)
+            counters[placeholder] = occurrence_index + 1
+            self.slots.append((placeholder, occurrence_index, start, end))
+
+    def render(self, replacements: Replacements) -> str:
+        """Substitute slots that have a replacement; others keep their original text"""
+        parts = []
+        position = 0
+        for placeholder, occurrence_index, start, end in self.slots:
+            replacement = replacements.get((placeholder, occurrence_index))
+            if replacement is None:
+                replacement = replacements.get((placeholder, None))
+            if replacement is None:
+                continue
+            parts.append(self.source[position:start])
+            parts.append(replacement)
+            position = end
+
+        if not parts:
+            return self.source
+        parts.append(self.source[position:])
+        return "".join(parts)
+
+
+def iter_docx_paragraphs(doc):
+    """
+    Yield a python-docx document's paragraphs in the same order extract_text_from_docx reads them
+    (body paragraphs, then table cells). Merged cells are yielded once.
+    """
+    seen = set()
+    for paragraph in doc.paragraphs:
+        yield paragraph
+    for table in doc.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                for paragraph in cell.paragraphs:
+                    if paragraph._p in seen:
+                        continue
+                    seen.add(paragraph._p)
+                    yield paragraph
+
+
+class CompiledDocx:
+    """
+    Placeholder offsets for a loaded python-docx document, recorded per paragraph
+    as (paragraph position, CompiledTemplate of the paragraph text).
+    Occurrence indices are counted across the whole document.
+    """
+
+    __slots__ = ("paragraphs",)
+
+    def __init__(self, doc, placeholders: Iterable[str]):
+        matcher = PlaceholderMatcher(placeholders)
+        counters: Dict[str, int] = {}
+        self.paragraphs: List[Tuple[int, CompiledTemplate]] = []
+
+        for position, paragraph in enumerate(iter_docx_paragraphs(doc)):
+            compiled = CompiledTemplate(paragraph.text, matcher, counters)
+            if compiled.slots:
+                self.paragraphs.append((position, compiled))
+
+    def render(self, doc, replacements: Replacements):
+        """Rewrite, in place, only the paragraphs of `doc` that contain a replaced placeholder"""
+        if not self.paragraphs:
+            return
+        targets = dict(self.paragraphs)
+        for position, paragraph in enumerate(iter_docx_paragraphs(doc)):
+            compiled = targets.get(position)
+            if compiled is None:
+                continue
+            text = compiled.render(replacements)
+            if text != compiled.source:
+                paragraph.text = text
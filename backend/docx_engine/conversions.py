@@ -0,0 +1,89 @@
+"""
+Conversions executed in docx process pool workers (services/docx_pool.py).
+
+Module-level functions of bytes and plain data, so they pickle cheaply; nothing here
+touches the database or the event loop.
+"""
+from typing import Iterable, Tuple
+from docx_engine.compiled_template import CompiledDocx, Replacements
+import io
+import os
+
+
+def extract_text(file_data: bytes) -> str:
+    """Text of a .docx: non-empty body paragraphs, then non-empty table cells, one per line"""
+    from docx import Document
+
+    doc = Document(io.BytesIO(file_data))
+    full_text = []
+
+    # Extract text from paragraphs
+    for paragraph in doc.paragraphs:
+        if paragraph.text.strip():
+            full_text.append(paragraph.text)
+
+    # Extract text from tables
+    for table in doc.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                if cell.text.strip():
+                    full_text.append(cell.text)
+
+    return '\n'.join(full_text)
+
+
+def convert_to_html(file_data: bytes) -> str:
+    """Preview base HTML of a .docx (Mammoth)"""
+    import mammoth
+
+    return mammoth.convert_to_html(io.BytesIO(file_data)).value
+
+
+def convert_to_formatted_html(file_data: bytes) -> str:
+    """Formatting-preserving HTML of a .docx (docx-parser-converter)"""
+    from docx_parser_converter.docx_to_html.docx_to_html_converter import DocxToHtmlConverter
+
+    return DocxToHtmlConverter(file_data, use_default_values=True).convert_to_html()
+
+
+def ingest_docx(file_data: bytes) -> Tuple[str, str]:
+    """Everything derived from an upload, in one worker call: (text, preview base HTML)"""
+    return extract_text(file_data), convert_to_html(file_data)
+
+
+def render_completed_docx(file_data: bytes, placeholders: Iterable[str], replacements: Replacements) -> bytes:
+    """Fill placeholders in a .docx (occurrence-aware) and return the saved document"""
+    from docx import Document
+
+    doc = Document(io.BytesIO(file_data))
+
+    # Resolve placeholder offsets once, then rewrite only affected paragraphs
+    compiled = CompiledDocx(doc, placeholders)
+    compiled.render(doc, replacements)
+
+    output = io.BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+
+# Set in each worker by warm_up(): shared by the pool's workers for the start-up handshake
+_startup_barrier = None
+
+
+def warm_up(startup_barrier=None):
+    """Pool initializer: import the conversion libraries once per worker process"""
+    global _startup_barrier
+    import docx  # noqa: F401
+    import mammoth  # noqa: F401
+    from docx_parser_converter.docx_to_html import docx_to_html_converter  # noqa: F401
+    _startup_barrier = startup_barrier
+
+
+def ping() -> int:
+    """
+    Return the worker's pid once every worker of the pool is running a ping. A worker can
+    hold only one ping at a time, so a full round of pings reaches every worker.
+    """
+    if _startup_barrier is not None:
+        _startup_barrier.wait()
+    return os.getpid()
@@ -3,6 +3,14 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from routers import documents_router, chat_router
 from config import settings
+from utils.database import db
+from utils.metrics import metrics
+from utils.message_writer import message_writer
+from services.preview_cache import preview_cache
+from services.template_cache import template_cache
+from services.conversation_cache import conversation_cache
+from services.job_queue import job_queue
+from services.docx_pool import docx_pool
 import logging
 
 # Configure logging
@@ -61,6 +69,17 @@ async def health_check():
     }
 
 
+@app.get("/metrics")
+async def get_metrics():
+    return {
+        **metrics.snapshot(),
+        "preview_cache": preview_cache.stats(),
+        "template_cache": template_cache.stats(),
+        "conversation_cache": await conversation_cache.stats(),
+        "job_queue": job_queue.stats(),
+    }
+
+
 # Include routers
 app.include_router(documents_router)
 app.include_router(chat_router)
@@ -72,19 +91,32 @@ async def startup_event():
     logger.info(f"Starting {settings.APP_NAME} v{settings.APP_VERSION}")
     logger.info(f"Debug mode: {settings.DEBUG}")
     logger.info(f"Allowed origins: {settings.allowed_origins_list}")
+    await docx_pool.start()
+    conversation_cache.start()
+    message_writer.start()
+    job_queue.start()
 
 
 # Shutdown event
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info(f"Shutting down {settings.APP_NAME}")
+    # Hand running processing tasks back to the queue before the connection pool goes away
+    await job_queue.close()
+    await conversation_cache.close()
+    # Write out queued conversation messages before the connection pool goes away
+    await message_writer.close()
+    await db.close()
+    await docx_pool.close()
 
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(
-        "main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=settings.DEBUG
-    )
+    # Hand over to `python -m uvicorn` instead of calling uvicorn.run() here: docx pool workers
+    # are spawned and re-import the launching script, which for this file would load the whole
+    # app (routers, database and Gemini clients) in every worker
+    import os
+    import sys
+    args = [sys.executable, "-m", "uvicorn", "main:app", "--host", "0.0.0.0", "--port", "8000"]
+    if settings.DEBUG:
+        args.append("--reload")
+    os.execv(sys.executable, args)
@@ -16,6 +16,7 @@ from .schemas import (
     StatusResponse,
     FieldsResponse,
     PreviewResponse,
+    PreviewDeltaResponse,
     FieldSubmitRequest,
     FieldSubmitResponse,
     NextQuestionResponse,
@@ -41,6 +42,7 @@ __all__ = [
     "StatusResponse",
     "FieldsResponse",
     "PreviewResponse",
+    "PreviewDeltaResponse",
     "FieldSubmitRequest",
     "FieldSubmitResponse",
     "NextQuestionResponse",
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from pydantic import Field as PydanticField
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
 from enum import Enum
 
@@ -74,6 +74,7 @@ class Document(DocumentBase):
     completed_at: Optional[datetime] = None
     file_path: Optional[str] = None
     original_content: Optional[str] = None
+    version: int = 0
 
     class Config:
         from_attributes = True
@@ -129,6 +130,14 @@ class FieldsResponse(BaseModel):
 class PreviewResponse(BaseModel):
     content: str
     fields: List[Field]
+    version: Optional[int] = None  # Document version the preview was rendered for
+
+
+class PreviewDeltaResponse(BaseModel):
+    version: Optional[int] = None
+    full: bool  # True when the client's version is too old and content holds the whole preview
+    content: Optional[str] = None
+    patches: Dict[str, str] = {}  # field id -> replacement HTML for its data-field-id spans
 
 
 class FieldSubmitRequest(BaseModel):
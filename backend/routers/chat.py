@@ -1,29 +1,29 @@
 from fastapi import APIRouter, HTTPException
 from models import NextQuestionResponse
 from utils.database import db
+from utils.message_writer import message_writer
+from utils.sse import format_sse, sse_response
 from services.document_service import document_service
 from services.conversation_service import conversation_service
+import asyncio
 
 router = APIRouter(prefix="/api/chat", tags=["chat"])
 
 
-@router.get("/{document_id}/next", response_model=NextQuestionResponse)
-async def get_next_question(document_id: str):
-    """Get the next question for the user to answer with conversational memory"""
-    document = db.get_document(document_id)
+async def _load_question_context(document_id: str):
+    """Fetch the document, its next pending field and conversation memory (concurrently)"""
+    document, next_field, memory = await asyncio.gather(
+        db.get_document(document_id),
+        db.get_next_pending_field(document_id),
+        conversation_service.load_memory_from_db(db, document_id)
+    )
 
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
 
-    # Get the first pending field
-    next_field = db.get_next_pending_field(document_id)
-
     if not next_field:
         raise HTTPException(status_code=404, detail="No pending fields found")
 
-    # Load conversation memory from database
-    memory = conversation_service.load_memory_from_db(db, document_id)
-
     # Get context for better question generation
     document_content = document.get("original_content", "")
     context = document_service.get_context_for_field(
@@ -31,25 +31,35 @@ async def get_next_question(document_id: str):
         next_field["placeholder"]
     )
 
-    # Get validation attempts for retry logic
-    validation_attempts = next_field.get("validation_attempts", 0) + 1
+    return next_field, memory, context
 
-    # Generate conversational question using conversation service with memory
-    question = conversation_service.generate_field_question(
-        field_name=next_field["name"],
-        field_type=next_field["type"],
-        placeholder=next_field["placeholder"],
-        context=context,
-        memory=memory,
-        attempt=validation_attempts
-    )
 
-    # Add AI message to memory
-    from langchain.schema import AIMessage
-    ai_msg = AIMessage(content=question)
-    memory.chat_memory.add_message(ai_msg)
-    # Save immediately with field_id
-    conversation_service.save_single_message_to_db(db, document_id, ai_msg, "ai", next_field["id"])
+@router.get("/{document_id}/next", response_model=NextQuestionResponse)
+async def get_next_question(document_id: str):
+    """Get the next question for the user to answer with conversational memory"""
+    next_field, memory, context = await _load_question_context(document_id)
+
+    # Serve the question precomputed at ingest when there is one; retries are generated live
+    question = conversation_service.get_banked_question(next_field)
+
+    if question is None:
+        # Get validation attempts for retry logic
+        validation_attempts = next_field.get("validation_attempts", 0) + 1
+
+        # Generate conversational question using conversation service with memory
+        question = await conversation_service.generate_field_question(
+            field_name=next_field["name"],
+            field_type=next_field["type"],
+            placeholder=next_field["placeholder"],
+            context=context,
+            memory=memory,
+            attempt=validation_attempts
+        )
+
+    # Add AI message to memory and save immediately with field_id
+    await conversation_service.save_single_message_to_db(
+        db, document_id, question, "ai", next_field["id"], memory=memory
+    )
 
     return NextQuestionResponse(
         question=question,
@@ -57,15 +67,60 @@ async def get_next_question(document_id: str):
     )
 
 
+@router.get("/{document_id}/next/stream")
+async def stream_next_question(document_id: str):
+    """
+    Stream the next question over server-sent events as Gemini generates it.
+
+    Events: `field` ({fieldId}) first, then `token` ({text}) per chunk, then `done`
+    ({question, fieldId}) once the full question has been saved to conversation memory.
+    A question precomputed at ingest is sent as a single `token` event.
+    """
+    next_field, memory, context = await _load_question_context(document_id)
+    validation_attempts = next_field.get("validation_attempts", 0) + 1
+    banked_question = conversation_service.get_banked_question(next_field)
+
+    async def event_stream():
+        yield format_sse("field", {"fieldId": next_field["id"]})
+
+        if banked_question is not None:
+            chunks = [banked_question]
+            yield format_sse("token", {"text": banked_question})
+        else:
+            chunks = []
+            async for chunk in conversation_service.stream_field_question(
+                field_name=next_field["name"],
+                field_type=next_field["type"],
+                placeholder=next_field["placeholder"],
+                context=context,
+                memory=memory,
+                attempt=validation_attempts
+            ):
+                chunks.append(chunk)
+                yield format_sse("token", {"text": chunk})
+
+        # Persist the complete message once streaming has finished
+        question = "".join(chunks).strip()
+        await conversation_service.save_single_message_to_db(
+            db, document_id, question, "ai", next_field["id"], memory=memory
+        )
+
+        yield format_sse("done", {"question": question, "fieldId": next_field["id"]})
+
+    return sse_response(event_stream())
+
+
 @router.get("/{document_id}/history")
 async def get_chat_history(document_id: str):
     """Get all chat messages for a document"""
-    document = db.get_document(document_id)
+    document = await db.get_document(document_id)
 
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
 
-    messages = db.get_chat_messages(document_id)
+    # Write out queued messages first so the history includes them
+    await message_writer.flush()
+    messages = await db.get_chat_messages(document_id)
 
     return {
         "messages": messages
@@ -1,33 +1,38 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request, Response
 from fastapi.responses import StreamingResponse
 from models import (
     UploadResponse,
     StatusResponse,
     FieldsResponse,
     PreviewResponse,
+    PreviewDeltaResponse,
     FieldSubmitRequest,
     FieldSubmitResponse,
     SummaryResponse,
     DocumentStatus,
 )
 from utils.database import db
+from utils.event_bus import event_bus
+from utils.sse import format_sse, sse_response
+from utils.http_cache import document_etag, is_not_modified, not_modified_response, set_etag
+from utils.metrics import metrics
 from services.document_service import document_service
-from services.gemini_service import gemini_service
+from services.job_queue import job_queue
 from config import settings
 import io
+import asyncio
 import logging
-from datetime import datetime
+from typing import Optional
 
 logger = logging.getLogger(__name__)
 
+TERMINAL_STATUSES = {"completed", "error"}
+
 router = APIRouter(prefix="/api", tags=["documents"])
 
 
 @router.post("/upload", response_model=UploadResponse)
-async def upload_document(
-    background_tasks: BackgroundTasks,
-    file: UploadFile = File(...)
-):
+async def upload_document(file: UploadFile = File(...)):
     """Upload a document and start processing"""
     # Validate file
     if not file.filename.endswith('.docx'):
@@ -44,28 +49,21 @@ async def upload_document(
         )
 
     try:
-        # Extract text first to validate it's a valid docx
-        text_content = document_service.extract_text_from_docx(file_data)
-
-        # Create document record
-        document = db.create_document(
-            filename=file.filename,
-            file_path="",  # Will be updated after upload
-            original_content=text_content
-        )
-
+        # Parse once (validates the docx), store the file and create the document record
+        document = await document_service.ingest_document(file.filename, file_data)
         document_id = document["id"]
+        print(f"✓ Created document record {document_id}")
 
-        # Upload to storage
-        file_path = await document_service.upload_original_document(document_id, file_data)
-        print(f"✓ Uploaded document to storage: {file_path}")
-
-        # Update document with file path in database
-        db.client.table("documents").update({"file_path": file_path}).eq("id", document_id).execute()
-        print(f"✓ Updated document record with file_path")
-
-        # Process document in the background
-        background_tasks.add_task(document_service.process_document, document_id, file_data)
+        # Queue processing (runs on the job queue's worker pool, survives restarts)
+        try:
+            await job_queue.enqueue(document_id, "process_document")
+        except Exception:
+            # Without a task the document would stay "processing" forever
+            try:
+                await db.update_document_status(document_id, "error")
+            except Exception as status_error:
+                print(f"⚠ Failed to mark document {document_id} as errored: {status_error}")
+            raise
 
         return UploadResponse(
             document_id=document_id,
@@ -78,46 +76,94 @@ async def upload_document(
 
 
 @router.get("/documents/{document_id}/status", response_model=StatusResponse)
-async def get_document_status(document_id: str):
-    """Get the processing status of a document"""
-    document = db.get_document(document_id)
+async def get_document_status(document_id: str, request: Request, response: Response):
+    """Get the processing status of a document (supports If-None-Match)"""
+    document = await db.get_document(document_id)
 
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
 
-    fields = db.get_fields(document_id)
-    total_fields = len(fields)
+    etag = document_etag("status", document)
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+    set_etag(response, etag)
+
+    fields = await db.get_fields(document_id)
     completed_fields = sum(1 for f in fields if f["status"] == "filled")
 
-    progress = 0
-    if total_fields > 0:
-        progress = int((completed_fields / total_fields) * 100)
-
-    status_messages = {
-        "uploading": "Uploading document...",
-        "processing": "Extracting text and identifying placeholders...",
-        "ready": "Document is ready for filling",
-        "filling": f"Filling in progress ({completed_fields}/{total_fields} fields completed)",
-        "completed": "All fields completed!",
-        "error": "An error occurred during processing"
-    }
+    return StatusResponse(**document_service.build_status(document["status"], completed_fields, len(fields)))
 
-    return StatusResponse(
-        status=document["status"],
-        progress=progress,
-        message=status_messages.get(document["status"], "Processing...")
-    )
+
+@router.get("/documents/{document_id}/events")
+async def stream_document_events(document_id: str, request: Request):
+    """
+    Server-sent events stream of status transitions and fill progress.
+    Sends the current status first, then every change until the document is completed or fails.
+    """
+    document = await db.get_document(document_id)
+
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    async def read_status() -> Optional[dict]:
+        current, fields = await asyncio.gather(db.get_document(document_id), db.get_fields(document_id))
+        if not current:
+            return None
+        completed_fields = sum(1 for f in fields if f["status"] == "filled")
+        return document_service.build_status(current["status"], completed_fields, len(fields))
+
+    async def event_stream():
+        # Subscribe first, then read the snapshot: a transition published in between is
+        # either already in the snapshot or waiting in the queue
+        queue = event_bus.subscribe(document_id)
+        try:
+            snapshot = await read_status()
+            if snapshot is None:
+                return
+            yield format_sse("status", snapshot)
+            if snapshot["status"] in TERMINAL_STATUSES:
+                return
+
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=settings.SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    # Transitions made by another process aren't published here: re-check on idle
+                    current = await read_status()
+                    if current is not None and current != snapshot:
+                        snapshot = current
+                        yield format_sse("status", snapshot)
+                        if snapshot["status"] in TERMINAL_STATUSES:
+                            return
+                    else:
+                        yield ": keep-alive\n\n"
+                    continue
+
+                yield format_sse(message["event"], message["data"])
+                if message["event"] == "status":
+                    snapshot = message["data"]
+                    if snapshot["status"] in TERMINAL_STATUSES:
+                        return
+        finally:
+            event_bus.unsubscribe(document_id, queue)
+
+    return sse_response(event_stream())
 
 
 @router.get("/documents/{document_id}/fields", response_model=FieldsResponse)
-async def get_document_fields(document_id: str):
-    """Get all fields for a document"""
-    document = db.get_document(document_id)
+async def get_document_fields(document_id: str, request: Request, response: Response):
+    """Get all fields for a document (supports If-None-Match)"""
+    document = await db.get_document(document_id)
 
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
 
-    fields = db.get_fields(document_id)
+    etag = document_etag("fields", document, document["filename"])
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+    set_etag(response, etag)
+
+    fields = await db.get_fields(document_id)
 
     return FieldsResponse(
         fields=fields,
@@ -126,26 +172,43 @@ async def get_document_fields(document_id: str):
 
 
 @router.get("/documents/{document_id}/preview", response_model=PreviewResponse)
-async def get_document_preview(document_id: str):
-    """Get document preview with current field values"""
-    document = db.get_document(document_id)
+async def get_document_preview(document_id: str, request: Request, response: Response):
+    """Get document preview with current field values (supports If-None-Match)"""
+    document = await db.get_document(document_id)
 
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
 
-    content = document_service.get_document_preview(document_id)
-    fields = db.get_fields(document_id)
+    etag = document_etag("preview", document, document.get("file_path"))
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+    set_etag(response, etag)
+
+    content, fields = await document_service.get_document_preview(document_id, document)
 
     return PreviewResponse(
         content=content,
-        fields=fields
+        fields=fields,
+        version=document.get("version")
     )
 
 
+@router.get("/documents/{document_id}/preview/delta", response_model=PreviewDeltaResponse)
+async def get_document_preview_delta(document_id: str, since: int):
+    """Get only the preview spans that changed since the client's last known version"""
+    document = await db.get_document(document_id)
+
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    delta = await document_service.get_preview_delta(document_id, since, document)
+    return PreviewDeltaResponse(**delta)
+
+
 @router.get("/documents/{document_id}/preview-completed")
 async def get_completed_document_preview(document_id: str):
     """Get HTML preview of the completed document"""
-    document = db.get_document(document_id)
+    document = await db.get_document(document_id)
 
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
@@ -154,50 +217,93 @@ async def get_completed_document_preview(document_id: str):
         raise HTTPException(status_code=400, detail="Document is not completed yet")
 
     try:
-        content = document_service.get_completed_document_preview(document_id)
+        content = await document_service.get_completed_document_preview(document_id)
         return {"content": content}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _generate_next_question(document: dict, next_field: dict, memory) -> str:
+    """Generate the question that introduces a field (used for the speculative prefetch and its fallback)"""
+    from services.conversation_service import conversation_service
+
+    banked_question = conversation_service.get_banked_question(next_field)
+    if banked_question is not None:
+        return banked_question
+
+    context = document_service.get_context_for_field(
+        document.get("original_content", ""),
+        next_field["placeholder"]
+    )
+
+    return await conversation_service.generate_field_question(
+        field_name=next_field["name"],
+        field_type=next_field["type"],
+        placeholder=next_field["placeholder"],
+        context=context,
+        memory=memory,
+        attempt=next_field.get("validation_attempts", 0) + 1
+    )
+
+
+async def _cancel_prefetch(prefetch: Optional[asyncio.Task]):
+    """Cancel a speculative question generation that is no longer needed"""
+    if prefetch is None:
+        return
+    prefetch.cancel()
+    try:
+        await prefetch
+    except (asyncio.CancelledError, Exception):
+        pass
+
+
 @router.post("/documents/{document_id}/fields", response_model=FieldSubmitResponse)
 async def submit_field_value(document_id: str, request: FieldSubmitRequest):
     """Submit a value for a field with intelligent extraction and validation"""
     from services.conversation_service import conversation_service
-    from langchain.schema import HumanMessage, AIMessage
 
-    document = db.get_document(document_id)
+    # Fetch document, field, the field that will come next and conversation memory concurrently
+    document, field, candidate_field, memory = await asyncio.gather(
+        db.get_document(document_id),
+        db.get_field(request.fieldId),
+        db.get_next_pending_field(document_id, exclude_field_id=request.fieldId),
+        conversation_service.load_memory_from_db(db, document_id)
+    )
 
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
 
-    # Get the field
-    field = db.get_field(request.fieldId)
-
     if not field:
         raise HTTPException(status_code=404, detail="Field not found")
 
-    # Load conversation memory
-    memory = conversation_service.load_memory_from_db(db, document_id)
+    # Add user's response to memory and save immediately
+    await conversation_service.save_single_message_to_db(db, document_id, request.value, "human", memory=memory)
 
-    # Add user's response to memory
-    user_msg = HumanMessage(content=request.value)
-    memory.chat_memory.add_message(user_msg)
-    # Save immediately
-    conversation_service.save_single_message_to_db(db, document_id, user_msg, "human")
+    # Speculatively generate the next field's question while the answer is being validated,
+    # so the happy path costs one LLM round trip instead of two in series
+    # (not needed when the question was precomputed at ingest)
+    prefetch = None
+    if candidate_field and not conversation_service.has_banked_question(candidate_field):
+        prefetch = asyncio.create_task(_generate_next_question(document, candidate_field, memory))
 
     # Extract and validate value from natural language response
-    is_valid, extracted_value, error_message = conversation_service.extract_and_validate_value(
-        user_response=request.value,
-        field_name=field["name"],
-        field_type=field["type"],
-        placeholder=field["placeholder"],
-        memory=memory
-    )
+    try:
+        is_valid, extracted_value, error_message = await conversation_service.extract_and_validate_value(
+            user_response=request.value,
+            field_name=field["name"],
+            field_type=field["type"],
+            placeholder=field["placeholder"],
+            memory=memory
+        )
+    except BaseException:
+        await _cancel_prefetch(prefetch)
+        raise
 
     if not is_valid:
+        await _cancel_prefetch(prefetch)
+
         # Generate friendly clarification question
-        clarification = conversation_service.generate_clarification_question(
+        clarification = await conversation_service.generate_clarification_question(
             field_name=field["name"],
             field_type=field["type"],
             error_message=error_message,
@@ -205,17 +311,14 @@ async def submit_field_value(document_id: str, request: FieldSubmitRequest):
             memory=memory
         )
 
-        # Add clarification to memory
-        clarification_msg = AIMessage(content=clarification)
-        memory.chat_memory.add_message(clarification_msg)
-        # Save immediately with field_id
-        conversation_service.save_single_message_to_db(db, document_id, clarification_msg, "ai", field["id"])
+        # Add clarification to memory and save immediately with field_id
+        await conversation_service.save_single_message_to_db(
+            db, document_id, clarification, "ai", field["id"], memory=memory
+        )
 
         # Update validation attempts
         validation_attempts = field.get("validation_attempts", 0) + 1
-        db.client.table("fields").update({
-            "validation_attempts": validation_attempts
-        }).eq("id", request.fieldId).execute()
+        await db.update_field_validation_attempts(request.fieldId, validation_attempts)
 
         # Return clarification as next question (same field)
         return FieldSubmitResponse(
@@ -224,54 +327,45 @@ async def submit_field_value(document_id: str, request: FieldSubmitRequest):
             nextFieldId=request.fieldId
         )
 
-    # Value is valid - update the field
-    db.update_field_value(request.fieldId, extracted_value)
-
-    # Reset validation attempts
-    db.client.table("fields").update({
-        "validation_attempts": 0
-    }).eq("id", request.fieldId).execute()
-
-    # Get the updated field with normalized value to return to frontend
-    updated_field_response = db.client.table("fields").select("*").eq("id", request.fieldId).single().execute()
+    # Value is valid - record it, reset attempts, advance document status and
+    # fetch the next pending field in a single round trip
+    try:
+        submission = await db.submit_field_value(document_id, request.fieldId, extracted_value)
+    except BaseException:
+        await _cancel_prefetch(prefetch)
+        raise
     updated_field = {
-        "id": updated_field_response.data["id"],
-        "value": updated_field_response.data["value"],
+        "id": submission["field"]["id"],
+        "value": submission["field"]["value"],
         "status": "filled"
     }
+    next_field = submission["next_field"]
+    document_service.publish_status(
+        document_id,
+        submission["document_status"],
+        submission["filled_fields"],
+        submission["total_fields"]
+    )
 
-    # Update document status to filling if it was ready
-    if document["status"] == "ready":
-        db.update_document_status(document_id, "filling")
-
-    # Get next pending field
-    next_field = db.get_next_pending_field(document_id)
+    next_question = None
+    if prefetch is not None:
+        if next_field and next_field["id"] == candidate_field["id"]:
+            next_question = await prefetch
+            metrics.increment("submit.prefetch.hit")
+        else:
+            # Fields changed underneath us (e.g. a concurrent submit) - discard the guess
+            await _cancel_prefetch(prefetch)
+            metrics.increment("submit.prefetch.miss")
 
     if next_field:
-        # Generate question for next field
-        document_content = document.get("original_content", "")
-        context = document_service.get_context_for_field(
-            document_content,
-            next_field["placeholder"]
-        )
+        if next_question is None:
+            next_question = await _generate_next_question(document, next_field, memory)
 
-        validation_attempts = next_field.get("validation_attempts", 0) + 1
-
-        next_question = conversation_service.generate_field_question(
-            field_name=next_field["name"],
-            field_type=next_field["type"],
-            placeholder=next_field["placeholder"],
-            context=context,
-            memory=memory,
-            attempt=validation_attempts
+        # Add to memory and save immediately with field_id
+        await conversation_service.save_single_message_to_db(
+            db, document_id, next_question, "ai", next_field["id"], memory=memory
         )
 
-        # Add to memory
-        next_question_msg = AIMessage(content=next_question)
-        memory.chat_memory.add_message(next_question_msg)
-        # Save immediately with field_id
-        conversation_service.save_single_message_to_db(db, document_id, next_question_msg, "ai", next_field["id"])
-
         return FieldSubmitResponse(
             success=True,
             nextQuestion=next_question,
@@ -279,16 +373,14 @@ async def submit_field_value(document_id: str, request: FieldSubmitRequest):
             updatedField=updated_field
         )
     else:
-        # All fields completed - update status and save completed document
-        db.update_document_status(document_id, "completed")
-        
+        # All fields completed (status already set by submit_field_value) - save completed document
         # Generate and save completed document to storage
         try:
-            original_file_data = db.download_file(
+            original_file_data = await db.download_file(
                 document_service.bucket_original,
                 f"{document_id}/original.docx"
             )
-            completed_doc = document_service.generate_completed_document(
+            completed_doc = await document_service.generate_completed_document(
                 document_id,
                 original_file_data
             )
@@ -307,10 +399,21 @@ async def submit_field_value(document_id: str, request: FieldSubmitRequest):
 
 
 @router.get("/documents/{document_id}/summary", response_model=SummaryResponse)
-async def get_document_summary(document_id: str):
-    """Get completion summary for a document"""
+async def get_document_summary(document_id: str, request: Request, response: Response):
+    """Get completion summary for a document (supports If-None-Match)"""
+    document = await db.get_document(document_id)
+
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    # Summaries of unfinished documents say "In progress"; only completed ones depend on completed_at
+    etag = document_etag("summary", document, document["filename"], document.get("completed_at"))
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+    set_etag(response, etag)
+
     try:
-        summary = document_service.get_completion_summary(document_id)
+        summary = await document_service.get_completion_summary(document_id, document)
         return SummaryResponse(**summary)
     except Exception as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -319,7 +422,7 @@ async def get_document_summary(document_id: str):
 @router.get("/documents/{document_id}/download")
 async def download_document(document_id: str):
     """Download the completed document"""
-    document = db.get_document(document_id)
+    document = await db.get_document(document_id)
 
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
@@ -329,7 +432,7 @@ async def download_document(document_id: str):
         
         # Try to get completed document from storage first
         try:
-            completed_doc = db.download_file(
+            completed_doc = await db.download_file(
                 document_service.bucket_completed,
                 completed_file_path
             )
@@ -337,11 +440,11 @@ async def download_document(document_id: str):
         except Exception:
             # Completed document not found in storage, generate it on-demand
             print(f"⚠ Completed document not in storage for {document_id}, generating on-demand...")
-            original_file_data = db.download_file(
+            original_file_data = await db.download_file(
                 document_service.bucket_original,
                 f"{document_id}/original.docx"
             )
-            completed_doc = document_service.generate_completed_document(
+            completed_doc = await document_service.generate_completed_document(
                 document_id,
                 original_file_data
             )
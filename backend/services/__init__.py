@@ -1,4 +1,12 @@
+from .llm_client import llm_client, LLMClient
 from .gemini_service import gemini_service, GeminiService
 from .document_service import document_service, DocumentService
 
-__all__ = ["gemini_service", "GeminiService", "document_service", "DocumentService"]
+__all__ = [
+    "llm_client",
+    "LLMClient",
+    "gemini_service",
+    "GeminiService",
+    "document_service",
+    "DocumentService",
+]
@@ -0,0 +1,402 @@
+"""
+Conversation memory caches: a bounded, sharded in-process LRU and a shared Redis backend
+"""
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from config import settings
+from services.conversation_memory import ConversationMemory
+import asyncio
+import json
+import threading
+import time
+import uuid
+
+
+class ConversationCacheBackend(ABC):
+    """
+    Interface of the conversation cache used by ConversationService.
+
+    `memory` arguments are the caller's live ConversationMemory, already updated; backends
+    that share state across workers persist the change, in-process backends just keep it.
+    """
+
+    @abstractmethod
+    async def get(self, document_id: str) -> Optional[ConversationMemory]:
+        """Return the cached memory, or None on a miss"""
+
+    @abstractmethod
+    async def put(self, document_id: str, memory: ConversationMemory):
+        """Store a whole memory (after loading it from the database)"""
+
+    @abstractmethod
+    async def append(self, document_id: str, memory: ConversationMemory,
+                     role: str, content: str, created_at: str):
+        """Record one message that was just added to `memory`"""
+
+    @abstractmethod
+    async def save_summary(self, document_id: str, memory: ConversationMemory):
+        """Record an updated rolling summary of `memory`"""
+
+    @abstractmethod
+    async def invalidate(self, document_id: str):
+        """Drop a document's cached memory"""
+
+    @abstractmethod
+    async def claim_fold(self, document_id: str, memory: ConversationMemory) -> bool:
+        """
+        Claim the right to fold `memory`'s overflowing turns into its summary. False if a fold
+        is already running, or if `memory` was read before the latest one finished.
+        """
+
+    @abstractmethod
+    async def release_fold(self, document_id: str):
+        """Release a claim taken with claim_fold (the fold finished or failed)"""
+
+    def start(self):
+        """Start background work (called from the app's startup event)"""
+
+    async def close(self):
+        """Stop background work and release connections (called from the app's shutdown event)"""
+
+    @abstractmethod
+    async def stats(self) -> Dict[str, Any]:
+        """Cache counters for monitoring"""
+
+
+class _Shard:
+    """One LRU partition with its own lock (entries: document_id -> (memory, size, expires_at))"""
+
+    __slots__ = ("lock", "entries", "bytes", "hits", "misses", "evictions", "expirations")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+
+class InProcessConversationCache(ConversationCacheBackend):
+    """
+    In-process cache of ConversationMemory objects keyed by document id (one per worker).
+
+    - Lock striping: keys are spread over `shards` partitions, each with its own lock
+    - O(1) get/put; least recently used entries are evicted when a shard exceeds its
+      share of `max_entries` or `max_bytes`
+    - Entries expire `ttl_seconds` after their last write; expired entries are dropped
+      lazily on lookup and by a periodic background sweep (no full scan per lookup)
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: float, shards: int = 16,
+                 sweep_interval_seconds: float = 60.0):
+        self.ttl_seconds = ttl_seconds
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self._shards: List[_Shard] = [_Shard() for _ in range(max(1, shards))]
+        self._max_entries_per_shard = max(1, max_entries // len(self._shards))
+        self._max_bytes_per_shard = max(1, max_bytes // len(self._shards))
+        self._sweeper: Optional[asyncio.Task] = None
+
+    def _shard(self, document_id: str) -> _Shard:
+        return self._shards[hash(document_id) % len(self._shards)]
+
+    async def get(self, document_id: str) -> Optional[ConversationMemory]:
+        """Return the cached memory, or None if absent or expired"""
+        shard = self._shard(document_id)
+        with shard.lock:
+            entry = shard.entries.get(document_id)
+            if entry is None:
+                shard.misses += 1
+                return None
+
+            memory, size, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del shard.entries[document_id]
+                shard.bytes -= size
+                shard.expirations += 1
+                shard.misses += 1
+                return None
+
+            shard.entries.move_to_end(document_id)
+            shard.hits += 1
+            return memory
+
+    async def put(self, document_id: str, memory: ConversationMemory):
+        """Insert or refresh an entry (re-measuring its size), evicting least recently used entries"""
+        size = memory.size
+        expires_at = time.monotonic() + self.ttl_seconds
+        shard = self._shard(document_id)
+        with shard.lock:
+            previous = shard.entries.pop(document_id, None)
+            if previous is not None:
+                shard.bytes -= previous[1]
+            shard.entries[document_id] = (memory, size, expires_at)
+            shard.bytes += size
+
+            while len(shard.entries) > 1 and (
+                len(shard.entries) > self._max_entries_per_shard or shard.bytes > self._max_bytes_per_shard
+            ):
+                _, (_, evicted_size, _) = shard.entries.popitem(last=False)
+                shard.bytes -= evicted_size
+                shard.evictions += 1
+
+    async def append(self, document_id: str, memory: ConversationMemory,
+                     role: str, content: str, created_at: str):
+        """The cached object is `memory` itself; re-put it to refresh its expiry and size"""
+        await self.put(document_id, memory)
+
+    async def save_summary(self, document_id: str, memory: ConversationMemory):
+        await self.put(document_id, memory)
+
+    async def invalidate(self, document_id: str):
+        """Drop a document's cached memory"""
+        shard = self._shard(document_id)
+        with shard.lock:
+            entry = shard.entries.pop(document_id, None)
+            if entry is not None:
+                shard.bytes -= entry[1]
+
+    async def claim_fold(self, document_id: str, memory: ConversationMemory) -> bool:
+        """The worker's only copy of the memory carries the guard (its folding flag)"""
+        return True
+
+    async def release_fold(self, document_id: str):
+        pass
+
+    def sweep(self) -> int:
+        """Remove expired entries from every shard; returns how many were dropped"""
+        removed = 0
+        now = time.monotonic()
+        for shard in self._shards:
+            with shard.lock:
+                # Gets reorder entries without extending their expiry, so every entry is checked
+                expired = [key for key, (_, _, expires_at) in shard.entries.items() if now >= expires_at]
+                for key in expired:
+                    _, size, _ = shard.entries.pop(key)
+                    shard.bytes -= size
+                shard.expirations += len(expired)
+                removed += len(expired)
+        return removed
+
+    async def _sweep_periodically(self, interval_seconds: float):
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"⚠ Conversation cache sweep failed: {e}")
+
+    def start(self):
+        """Start the background expiry sweep"""
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_periodically(self.sweep_interval_seconds))
+
+    async def close(self):
+        """Stop the background expiry sweep"""
+        if self._sweeper is None:
+            return
+        self._sweeper.cancel()
+        try:
+            await self._sweeper
+        except asyncio.CancelledError:
+            pass
+        self._sweeper = None
+
+    async def stats(self) -> Dict[str, Any]:
+        """Cache counters for monitoring (summed over shards)"""
+        totals = {"backend": "memory", "size": 0, "bytes": 0, "hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+        for shard in self._shards:
+            with shard.lock:
+                totals["size"] += len(shard.entries)
+                totals["bytes"] += shard.bytes
+                totals["hits"] += shard.hits
+                totals["misses"] += shard.misses
+                totals["evictions"] += shard.evictions
+                totals["expirations"] += shard.expirations
+        return totals
+
+
+class RedisConversationCache(ConversationCacheBackend):
+    """
+    Conversation cache shared by all workers through Redis (or anything speaking its protocol).
+
+    Per document: a hash `conversation:{id}:meta` holding the rolling summary and a list
+    `conversation:{id}:messages` of JSON [role, content, created_at] records. New messages
+    are appended atomically (RPUSH + LTRIM to the memory's capacity in one MULTI/EXEC),
+    so workers never overwrite each other's turns. Redis expires both keys after
+    `ttl_seconds` without writes. Redis errors are logged and treated as misses.
+
+    Every get() builds a fresh memory, so a summary fold in progress is marked by a
+    `conversation:{id}:fold` key (SET NX, expiring after `fold_lock_seconds` in case
+    its worker dies) that the other workers see.
+    """
+
+    def __init__(self, url: str, ttl_seconds: float, token_budget: int, fold_lock_seconds: float = 60.0,
+                 client=None):
+        """`client`: an already configured redis.asyncio client (decode_responses=True), e.g. in tests"""
+        self.ttl_seconds = int(ttl_seconds)
+        self.token_budget = token_budget
+        self.fold_lock_seconds = max(1, int(fold_lock_seconds))
+        # Values of this process's fold keys, so a claim that expired and was taken over isn't released
+        self._fold_tokens: Dict[str, str] = {}
+        if client is None:
+            import redis.asyncio as redis
+
+            client = redis.from_url(url, decode_responses=True)
+        self._client = client
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @staticmethod
+    def _keys(document_id: str):
+        return f"conversation:{document_id}:meta", f"conversation:{document_id}:messages"
+
+    @staticmethod
+    def _fold_key(document_id: str) -> str:
+        return f"conversation:{document_id}:fold"
+
+    async def get(self, document_id: str) -> Optional[ConversationMemory]:
+        meta_key, messages_key = self._keys(document_id)
+        try:
+            async with self._client.pipeline(transaction=True) as pipe:
+                pipe.hgetall(meta_key)
+                pipe.lrange(messages_key, 0, -1)
+                meta, records = await pipe.execute()
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠ Redis conversation cache lookup failed: {e}")
+            return None
+
+        # The meta hash marks a complete entry (a bare message list may be a partial leftover)
+        if not meta:
+            self.misses += 1
+            return None
+
+        memory = ConversationMemory(self.token_budget)
+        memory.restore(meta.get("summary", ""), meta.get("summary_until"), (json.loads(record) for record in records))
+        self.hits += 1
+        return memory
+
+    async def put(self, document_id: str, memory: ConversationMemory):
+        meta_key, messages_key = self._keys(document_id)
+        try:
+            async with self._client.pipeline(transaction=True) as pipe:
+                pipe.delete(messages_key)
+                pipe.hset(meta_key, mapping={"summary": memory.summary, "summary_until": memory.summary_until or ""})
+                records = [json.dumps([m.role, m.content, m.created_at]) for m in memory.messages]
+                if records:
+                    pipe.rpush(messages_key, *records)
+                pipe.expire(meta_key, self.ttl_seconds)
+                pipe.expire(messages_key, self.ttl_seconds)
+                await pipe.execute()
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠ Redis conversation cache write failed: {e}")
+
+    async def append(self, document_id: str, memory: ConversationMemory,
+                     role: str, content: str, created_at: str):
+        meta_key, messages_key = self._keys(document_id)
+        try:
+            async with self._client.pipeline(transaction=True) as pipe:
+                pipe.rpush(messages_key, json.dumps([role, content, created_at]))
+                pipe.ltrim(messages_key, -memory.capacity, -1)
+                pipe.expire(meta_key, self.ttl_seconds)
+                pipe.expire(messages_key, self.ttl_seconds)
+                await pipe.execute()
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠ Redis conversation cache append failed: {e}")
+
+    async def save_summary(self, document_id: str, memory: ConversationMemory):
+        meta_key, _ = self._keys(document_id)
+        try:
+            # Folded messages stay in the list; readers skip those covered by summary_until
+            async with self._client.pipeline(transaction=True) as pipe:
+                pipe.hset(meta_key, mapping={"summary": memory.summary, "summary_until": memory.summary_until or ""})
+                pipe.expire(meta_key, self.ttl_seconds)
+                await pipe.execute()
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠ Redis conversation summary write failed: {e}")
+
+    async def invalidate(self, document_id: str):
+        try:
+            await self._client.delete(*self._keys(document_id))
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠ Redis conversation cache invalidation failed: {e}")
+
+    async def claim_fold(self, document_id: str, memory: ConversationMemory) -> bool:
+        meta_key, _ = self._keys(document_id)
+        token = uuid.uuid4().hex
+        try:
+            if not await self._client.set(self._fold_key(document_id), token, nx=True, ex=self.fold_lock_seconds):
+                return False
+            self._fold_tokens[document_id] = token
+            summary_until = await self._client.hget(meta_key, "summary_until")
+        except Exception as e:
+            # Without Redis, fall back to the worker's own guard rather than skipping the fold
+            self.errors += 1
+            print(f"⚠ Redis conversation fold claim failed: {e}")
+            return True
+
+        # Another worker folded since this memory was read: its turns are already summarized
+        if summary_until and summary_until != (memory.summary_until or ""):
+            await self.release_fold(document_id)
+            return False
+        return True
+
+    async def release_fold(self, document_id: str):
+        token = self._fold_tokens.pop(document_id, None)
+        if token is None:
+            return
+        fold_key = self._fold_key(document_id)
+        try:
+            # Delete the key only if it is still ours (WATCH makes the check and delete atomic)
+            async with self._client.pipeline(transaction=True) as pipe:
+                await pipe.watch(fold_key)
+                if await pipe.get(fold_key) == token:
+                    pipe.multi()
+                    pipe.delete(fold_key)
+                    await pipe.execute()
+                else:
+                    await pipe.unwatch()
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠ Redis conversation fold release failed: {e}")
+
+    async def close(self):
+        await self._client.aclose()
+
+    async def stats(self) -> Dict[str, Any]:
+        return {"backend": "redis", "hits": self.hits, "misses": self.misses, "errors": self.errors}
+
+
+def create_conversation_cache() -> ConversationCacheBackend:
+    """Build the backend selected by CONVERSATION_CACHE_BACKEND ("memory" or "redis")"""
+    backend = settings.CONVERSATION_CACHE_BACKEND.lower()
+    if backend == "redis":
+        return RedisConversationCache(
+            url=settings.REDIS_URL,
+            ttl_seconds=settings.CONVERSATION_CACHE_TTL_SECONDS,
+            token_budget=settings.MEMORY_TOKEN_BUDGET,
+            # A fold is one LLM call and one database insert
+            fold_lock_seconds=settings.LLM_TIMEOUT_SECONDS + settings.DB_TIMEOUT_SECONDS,
+        )
+    if backend != "memory":
+        raise ValueError(f"Unknown CONVERSATION_CACHE_BACKEND: {settings.CONVERSATION_CACHE_BACKEND}")
+
+    return InProcessConversationCache(
+        max_entries=settings.CONVERSATION_CACHE_MAX_ENTRIES,
+        max_bytes=settings.CONVERSATION_CACHE_MAX_BYTES,
+        ttl_seconds=settings.CONVERSATION_CACHE_TTL_SECONDS,
+        shards=settings.CONVERSATION_CACHE_SHARDS,
+        sweep_interval_seconds=settings.CONVERSATION_CACHE_SWEEP_SECONDS,
+    )
+
+
+# Singleton instance
+conversation_cache = create_conversation_cache()
@@ -0,0 +1,178 @@
+"""
+Token-budgeted conversation memory with a rolling summary
+"""
+from collections import deque
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Deque, Iterable, List, Optional, Tuple
+
+
+ROLE_LABELS = {"human": "User", "ai": "Assistant"}
+
+# Rough fixed cost of a Message record and its strings' headers, for cache size accounting
+MESSAGE_OVERHEAD_BYTES = 200
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Parse an ISO timestamp (client-generated or from Postgres) as naive UTC"""
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+class Message:
+    """One conversation turn, rendered once when it is created"""
+
+    __slots__ = ("seq", "role", "content", "created_at", "line", "cost")
+
+    def __init__(self, seq: int, role: str, content: str, created_at: str):
+        self.seq = seq
+        self.role = role  # "human" or "ai" (same as conversation_memory.message_type)
+        self.content = content
+        self.created_at = created_at
+        self.line = f"{ROLE_LABELS.get(role, 'Assistant')}: {content}"
+        self.cost = estimate_tokens(self.line)
+
+
+class ConversationMemory:
+    """
+    Conversation history for prompt building.
+
+    The most recent turns are rendered verbatim as long as they fit in `token_budget`;
+    older turns are folded into `summary` by ConversationService off the request path.
+    Until a fold completes, turns that no longer fit are simply left out of prompts.
+
+    Messages live in a ring buffer of `capacity` records (oldest dropped first), and the
+    verbatim window is kept as a pre-joined, append-only buffer, so building a prompt
+    doesn't re-walk the history.
+    """
+
+    __slots__ = (
+        "token_budget", "summary", "summary_until", "folding",
+        "_messages", "_next_seq", "_start", "_window_tokens", "_buffer", "_history", "_message_bytes",
+    )
+
+    def __init__(self, token_budget: int, capacity: int = 64):
+        self.token_budget = token_budget
+        self.summary = ""
+        # Created_at of the newest message folded into the summary (ISO format)
+        self.summary_until: Optional[str] = None
+        self.folding = False
+
+        self._messages: Deque[Message] = deque(maxlen=capacity)
+        self._next_seq = 0
+        self._start = 0  # Index of the oldest message in the verbatim window
+        self._window_tokens = 0
+        self._buffer = ""  # Lines of the verbatim window joined by newlines
+        self._history: Optional[str] = None  # Cached history_string()
+        self._message_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    @property
+    def capacity(self) -> int:
+        return self._messages.maxlen
+
+    @property
+    def size(self) -> int:
+        """Approximate bytes held, for cache size bounds"""
+        return self._message_bytes + 2 * (len(self.summary) + len(self._buffer))
+
+    @staticmethod
+    def _message_size(message: Message) -> int:
+        return len(message.content) + len(message.line) + MESSAGE_OVERHEAD_BYTES
+
+    @property
+    def messages(self) -> List[Message]:
+        """Messages not yet folded into the summary, oldest first"""
+        return list(self._messages)
+
+    def add_message(self, role: str, content: str, created_at: Optional[str] = None):
+        """Append a message (created_at defaults to now, matching what is persisted)"""
+        message = Message(self._next_seq, role, content, created_at or datetime.utcnow().isoformat())
+        self._next_seq += 1
+
+        if len(self._messages) == self._messages.maxlen:
+            self._drop_oldest()
+        self._messages.append(message)
+        self._message_bytes += self._message_size(message)
+
+        self._buffer = f"{self._buffer}\n{message.line}" if self._buffer else message.line
+        self._window_tokens += message.cost
+        self._trim_window()
+        self._history = None
+
+    def restore(self, summary: str, summary_until: Optional[str],
+                messages: Iterable[Tuple[str, str, str]]):
+        """
+        Fill an empty memory from storage: the rolling summary plus (role, content, created_at)
+        messages in chronological order. Messages already covered by the summary are skipped.
+        """
+        self.summary = summary or ""
+        self.summary_until = summary_until or None
+        cutoff = parse_timestamp(self.summary_until) if self.summary_until else None
+
+        for role, content, created_at in messages:
+            if cutoff and parse_timestamp(created_at) <= cutoff:
+                continue
+            self.add_message(role, content, created_at)
+
+    def _drop_oldest(self):
+        """Remove the oldest message, keeping the window bookkeeping consistent"""
+        oldest = self._messages.popleft()
+        self._message_bytes -= self._message_size(oldest)
+        if self._start > 0:
+            self._start -= 1
+        else:
+            # It was still in the window
+            self._buffer = self._buffer[len(oldest.line) + 1:]
+            self._window_tokens -= oldest.cost
+
+    def _trim_window(self):
+        """Drop the oldest lines from the verbatim window until it fits the budget (newest always stays)"""
+        while self._window_tokens > self.token_budget and self._start < len(self._messages) - 1:
+            message = self._messages[self._start]
+            self._buffer = self._buffer[len(message.line) + 1:]
+            self._window_tokens -= message.cost
+            self._start += 1
+
+    def needs_fold(self) -> bool:
+        """Whether some messages no longer fit in the budget and should be summarized"""
+        return not self.folding and self._start > 0
+
+    def overflow(self) -> Tuple[List[str], Optional[str], int]:
+        """
+        Rendered messages that fall outside the budget, the created_at of the newest one
+        and its sequence number (pass to apply_summary)
+        """
+        if self._start == 0:
+            return [], None, -1
+        folded = list(islice(self._messages, self._start))
+        return [message.line for message in folded], folded[-1].created_at, folded[-1].seq
+
+    def apply_summary(self, summary: str, through_seq: int, summary_until: Optional[str]):
+        """Replace messages up to `through_seq` (all outside the window) with an updated summary"""
+        self.summary = summary
+        self.summary_until = summary_until
+        while self._start > 0 and self._messages[0].seq <= through_seq:
+            self._message_bytes -= self._message_size(self._messages.popleft())
+            self._start -= 1
+        self._history = None
+
+    def history_string(self) -> str:
+        """Summary of earlier turns followed by the recent turns that fit in the budget"""
+        if self._history is None:
+            parts = []
+            if self.summary:
+                parts.append(f"Summary of earlier conversation: {self.summary}")
+            if self._buffer:
+                parts.append(self._buffer)
+            self._history = "\n".join(parts) if parts else "No previous conversation."
+        return self._history
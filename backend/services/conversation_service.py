@@ -1,117 +1,126 @@
 """
-Conversation service using Google GenAI directly with LangChain memory
+Conversation service using Google GenAI (async) with token-budgeted memory
 """
-from typing import List, Dict, Any, Optional, Tuple
-from langchain.memory import ConversationBufferMemory
-from langchain.schema import HumanMessage, AIMessage
+from typing import AsyncIterator, Dict, Optional, Set, Tuple
 from config import settings
-import json
+from services.llm_client import llm_client
+from services.conversation_memory import ConversationMemory
+from services.conversation_cache import conversation_cache
+from utils.message_writer import message_writer
+from services.fast_extraction import fast_extract
+from services.extraction_prompt import build_extraction_prompt
+from utils.metrics import metrics
 import re
-from datetime import datetime, timedelta
+from datetime import datetime
 import google.generativeai as genai
-import threading
+import asyncio
 
 
 class ConversationService:
     """Manages conversational flow with memory"""
 
-    # In-memory cache for conversation memories
-    # Format: {document_id: {"memory": ConversationBufferMemory, "timestamp": datetime}}
-    _memory_cache: Dict[str, Dict[str, Any]] = {}
-    _cache_lock = threading.Lock()
-    _cache_ttl_minutes = 30  # Cache expires after 30 minutes
-    _sliding_window_size = 20  # Load only last 20 messages for context
+    _sliding_window_size = 20  # Load at most the last 20 messages (the token budget trims further)
+    _background_tasks: Set[asyncio.Task] = set()  # Summary folds in flight
 
     def __init__(self):
-        # Use Google GenAI directly
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-
         # Light model for conversation generation (cheaper, faster)
-        self.conversation_model = genai.GenerativeModel('gemini-2.5-flash-lite')
+        self.conversation_model = 'gemini-2.5-flash-lite'
         self.conversation_config = genai.types.GenerationConfig(
             temperature=0.7,  # More creative for friendly questions
         )
 
         # Pro model for extraction (more accurate, critical task)
-        self.extraction_model = genai.GenerativeModel('gemini-2.5-flash')
+        self.extraction_model = 'gemini-2.5-flash'
         self.extraction_config = genai.types.GenerationConfig(
             temperature=0.1,  # Very precise for extraction
         )
 
-    def create_memory(self, document_id: str) -> ConversationBufferMemory:
+    def create_memory(self, document_id: str) -> ConversationMemory:
         """Create a new conversation memory instance"""
-        memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True,
-            input_key="input",
-            output_key="output"
-        )
-        return memory
+        return ConversationMemory(settings.MEMORY_TOKEN_BUDGET)
 
-    def _get_cached_memory(self, document_id: str) -> Optional[ConversationBufferMemory]:
+    async def _get_cached_memory(self, document_id: str) -> Optional[ConversationMemory]:
         """Retrieve memory from cache if it exists and hasn't expired"""
-        with self._cache_lock:
-            # Clean up expired entries
-            self._cleanup_expired_cache()
-
-            if document_id in self._memory_cache:
-                cache_entry = self._memory_cache[document_id]
-                expiry_time = cache_entry["timestamp"] + timedelta(minutes=self._cache_ttl_minutes)
-
-                if datetime.now() < expiry_time:
-                    return cache_entry["memory"]
-                else:
-                    # Expired, remove from cache
-                    del self._memory_cache[document_id]
-
-        return None
-
-    def _cache_memory(self, document_id: str, memory: ConversationBufferMemory):
-        """Store memory in cache with current timestamp"""
-        with self._cache_lock:
-            self._memory_cache[document_id] = {
-                "memory": memory,
-                "timestamp": datetime.now()
-            }
-
-    def _cleanup_expired_cache(self):
-        """Remove expired cache entries (called with lock held)"""
-        now = datetime.now()
-        expired_keys = [
-            doc_id for doc_id, entry in self._memory_cache.items()
-            if now >= entry["timestamp"] + timedelta(minutes=self._cache_ttl_minutes)
-        ]
-        for key in expired_keys:
-            del self._memory_cache[key]
-
-    def clear_cache(self, document_id: str):
+        return await conversation_cache.get(document_id)
+
+    async def _cache_memory(self, document_id: str, memory: ConversationMemory):
+        """Store memory in cache (refreshes its expiry and size)"""
+        await conversation_cache.put(document_id, memory)
+
+    async def clear_cache(self, document_id: str):
         """Clear cache for a specific document (e.g., when document is completed)"""
-        with self._cache_lock:
-            if document_id in self._memory_cache:
-                del self._memory_cache[document_id]
+        await conversation_cache.invalidate(document_id)
 
-    def _build_chat_history_string(self, memory: ConversationBufferMemory) -> str:
-        """Convert LangChain memory to string format for Gemini"""
-        if not memory or not memory.chat_memory.messages:
+    def _build_chat_history_string(self, memory: ConversationMemory) -> str:
+        """Render memory (rolling summary + recent turns within the token budget) for Gemini"""
+        if not memory:
             return "No previous conversation."
+        return memory.history_string()
+
+    def _schedule_summary(self, db, document_id: str, memory: ConversationMemory):
+        """Fold turns that no longer fit in the token budget into the summary, off the request path"""
+        if not memory.needs_fold():
+            return
+        memory.folding = True
+        task = asyncio.create_task(self._fold_into_summary(db, document_id, memory))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _fold_into_summary(self, db, document_id: str, memory: ConversationMemory):
+        """Update the rolling summary with the overflowing turns and persist it as a 'system' record"""
+        claimed = False
+        try:
+            # With a shared cache, every worker builds its own copy of the memory: only one folds
+            claimed = await conversation_cache.claim_fold(document_id, memory)
+            if not claimed:
+                return
+
+            folded, summary_until, through_seq = memory.overflow()
+            if not folded:
+                return
+
+            turns = "\n".join(folded)
+            prompt = f"""You maintain a running summary of a conversation in which an assistant helps a user fill in a legal document.
+
+Current summary:
+{memory.summary or "(empty)"}
+
+New conversation turns to add:
+{turns}
 
-        history = []
-        for msg in memory.chat_memory.messages:
-            role = "User" if isinstance(msg, HumanMessage) else "Assistant"
-            history.append(f"{role}: {msg.content}")
+Write the updated summary in at most 5 sentences. Keep every value the user provided, any corrections
+they made and anything they asked to be handled a certain way. Return ONLY the summary."""
 
-        return "\n".join(history)
+            summary = await llm_client.generate(
+                self.conversation_model,
+                prompt,
+                generation_config=self.extraction_config
+            )
+            memory.apply_summary(summary, through_seq, summary_until)
+            await conversation_cache.save_summary(document_id, memory)
+
+            await db.insert_conversation_message(
+                document_id, "system", summary, metadata={"summary_until": summary_until}
+            )
+            metrics.increment("memory.summary_folds")
 
-    def generate_field_question(
+        except Exception as e:
+            print(f"⚠ Failed to update conversation summary: {e}")
+        finally:
+            memory.folding = False
+            if claimed:
+                await conversation_cache.release_fold(document_id)
+
+    def _build_field_question_prompt(
         self,
         field_name: str,
         field_type: str,
         placeholder: str,
         context: str,
-        memory: ConversationBufferMemory,
+        memory: ConversationMemory,
         attempt: int = 1
     ) -> str:
-        """Generate a conversational question for a field"""
+        """Build the question-generation prompt for a field"""
 
         type_instructions = {
             "text": "any text value",
@@ -133,7 +142,7 @@ class ConversationService:
 
         chat_history = self._build_chat_history_string(memory)
 
-        prompt = f"""You are a helpful legal document assistant helping users fill in document fields.
+        return f"""You are a helpful legal document assistant helping users fill in document fields.
 
 Your task is to ask for the field "{field_name}" (placeholder: {placeholder}) in a natural, conversational way.
 
@@ -154,148 +163,104 @@ Guidelines:
 
 Generate ONLY the question to ask the user, nothing else."""
 
+    def has_banked_question(self, field: Dict) -> bool:
+        """Whether the field can be asked with the question precomputed at ingest"""
+        return field.get("validation_attempts", 0) == 0 and bool(field.get("question"))
+
+    def get_banked_question(self, field: Dict) -> Optional[str]:
+        """Return the question precomputed at ingest, if the field is on its first attempt"""
+        if not self.has_banked_question(field):
+            return None
+        metrics.increment("questions.banked")
+        return field["question"]
+
+    async def generate_field_question(
+        self,
+        field_name: str,
+        field_type: str,
+        placeholder: str,
+        context: str,
+        memory: ConversationMemory,
+        attempt: int = 1
+    ) -> str:
+        """Generate a conversational question for a field"""
+        prompt = self._build_field_question_prompt(field_name, field_type, placeholder, context, memory, attempt)
+
         try:
             # Use light model for question generation
-            response = self.conversation_model.generate_content(
+            return await llm_client.generate(
+                self.conversation_model,
                 prompt,
                 generation_config=self.conversation_config
             )
-            return response.text.strip()
         except Exception as e:
             print(f"Error generating question: {e}")
             return f"What is the {field_name}?"
 
-    def extract_and_validate_value(
+    async def stream_field_question(
+        self,
+        field_name: str,
+        field_type: str,
+        placeholder: str,
+        context: str,
+        memory: ConversationMemory,
+        attempt: int = 1
+    ) -> AsyncIterator[str]:
+        """
+        Stream a conversational question for a field chunk by chunk.
+        Falls back to a simple question if generation fails before any text was produced.
+        """
+        prompt = self._build_field_question_prompt(field_name, field_type, placeholder, context, memory, attempt)
+
+        produced = False
+        try:
+            async for chunk in llm_client.stream(
+                self.conversation_model,
+                prompt,
+                generation_config=self.conversation_config
+            ):
+                produced = True
+                yield chunk
+        except Exception as e:
+            print(f"Error streaming question: {e}")
+            if not produced:
+                yield f"What is the {field_name}?"
+
+    async def extract_and_validate_value(
         self,
         user_response: str,
         field_name: str,
         field_type: str,
         placeholder: str,
-        memory: ConversationBufferMemory
+        memory: ConversationMemory
     ) -> Tuple[bool, Optional[str], Optional[str]]:
         """
-        Extract value from user response and validate against field type
+        Extract value from user response and validate against field type.
+        Clean, unambiguous answers are normalized locally without calling Gemini.
         """
-
+        fast_value = fast_extract(user_response, field_type, field_name)
+        if fast_value is not None:
+            is_valid, error = self._validate_field_value(fast_value, field_type)
+            if is_valid:
+                metrics.increment("extraction.local")
+                return True, fast_value, None
+
+        metrics.increment("extraction.llm")
         chat_history = self._build_chat_history_string(memory)
 
-        prompt = f"""You are an intelligent field extraction and validation system for legal documents.
-
-Field to extract: {field_name}
-Field Type: {field_type}
-Placeholder: {placeholder}
-
-Previous conversation:
-{chat_history}
-
-User's response: "{user_response}"
-
----
-
-EXTRACTION AND VALIDATION RULES BY FIELD TYPE:
-
-## AMOUNTS (Purchase Amount, Valuation Cap, currency fields):
-- Convert shorthand: "500k" → "$500,000", "10m" → "$10,000,000", "2.5M" → "$2,500,000"
-- Convert words: "one million" → "$1,000,000", "five hundred thousand" → "$500,000"
-- Convert currency notations: "₹5 lakh" → INVALID: Please provide the amount in USD
-- Default currency is USD unless user specifies otherwise
-- Remove extra spaces, periods (except decimal), commas in input
-- Final format MUST be: $X,XXX,XXX (comma-separated with dollar sign)
-- If meaning is unclear (e.g., "about 200k", "roughly 1M"), return: INVALID: Please provide the exact amount (e.g., Is it exactly $200,000?)
-
-## DATES:
-- Convert natural language:
-  * "second week of June" → "June 10, 2025" (use Monday of that week, or ask if year unclear)
-  * "mid-July" → "July 15, 2025"
-  * "early March" → "March 1, 2025"
-  * "end of December" → "December 31, 2025"
-- Normalize formats: "10th June", "June 10 2025", "10/06/25", "6-10-25" → "June 10, 2025"
-- Strict output format: Month DD, YYYY (e.g., "January 15, 2025")
-- If vague ("sometime in October", "Q2 2025"), return: INVALID: Please provide a specific date
-
-## JURISDICTION / STATE OF INCORPORATION:
-- Correct misspellings: "Texes" → "Texas, USA", "Californya" → "California, USA"
-- Add default country: "Delaware" → "Delaware, USA"
-- If ambiguous location, return: INVALID: Do you mean [Location], USA or [Location] (the country)?
-  Example: "Georgia" → INVALID: Do you mean Georgia, USA or Georgia (the country)?
-- Output format: [State/Province], [Country]
-
-## ADDRESSES:
-- Expand abbreviations: "sf" → "San Francisco", "NYC" → "New York City"
-- Fix capitalization: "123 main st" → "123 Main St"
-- Remove emojis or irrelevant text
-- Ensure complete format: Street, City, State/Province, Country, ZIP
-- If missing key parts (city, state, zip), return: INVALID: Please provide the complete address including [missing part]
-
-## COMPANY NAME:
-- Capitalize properly: "acme inc" → "Acme Inc.", "google llc" → "Google LLC"
-- Fix spacing: "Test  Company" → "Test Company"
-- If user provides only partial name (e.g., "Acme"), return: INVALID: Is the legal entity name "Acme, Inc.", "Acme LLC", or something else?
-- Keep legal suffixes: Inc., LLC, Corp., Ltd., etc.
-
-## INVESTOR NAME:
-- Capitalize properly: "john smith" → "John Smith"
-- Remove unnecessary punctuation and emojis
-- If company investor, apply company name rules
-- Format: First Last for individuals, Legal Name for entities
-
-## EMAIL:
-- Extract email address
-- Validate format (must have @ and domain)
-- Convert to lowercase: "John@Example.COM" → "john@example.com"
-
-## PHONE:
-- Extract digits and formatting
-- Accept various formats: (555) 123-4567, 555-123-4567, 5551234567
-- Preserve formatting user provides
-- Must have at least 10 digits
-
-## TEXT / GENERAL:
-- Extract relevant information
-- Fix capitalization if appropriate
-- Remove extra spaces and line breaks
-- Minimum 2 characters
-
----
-
-SPECIAL BEHAVIOR RULES:
-
-1. Extract from full sentences:
-   User: "We invested around 500k last year" → Extract: "$500,000"
-
-2. Auto-fix spelling (unless ambiguous):
-   User: "Californya" → Extract: "California, USA"
-
-3. If multiple interpretations possible, ALWAYS ask for clarification:
-   User: "200k" for a date field → INVALID: Did you mean $200,000 or a date?
-
-4. NEVER return both clarification AND value - it's one or the other
-
-5. Detect refusals and deferrals - return INVALID:
-   - "I don't know" → INVALID: Please provide the {field_name} when you have it
-   - "Skip this" → INVALID: This field is required, please provide the {field_name}
-   - "TBD" / "N/A" / "Unknown" → INVALID: Please provide an actual value for {field_name}
-   - "I'll get back to you" → INVALID: Please provide the {field_name} to continue
-
-6. Extract ONLY the relevant variable from the response, ignore surrounding text
-
----
-
-OUTPUT INSTRUCTIONS:
-
-Return ONLY one of these two formats:
-1. The extracted and normalized value (following field type rules above)
-2. INVALID: <your clarification question to the user>
-
-Do NOT include explanations, do NOT return both value and question."""
+        # Only the rule sections relevant to this field type are sent
+        prompt, tokens_saved = build_extraction_prompt(
+            field_name, field_type, placeholder, chat_history, user_response
+        )
+        metrics.observe("extraction.prompt_tokens_saved", tokens_saved)
 
         try:
             # Use PRO model for critical extraction task (more accurate)
-            response = self.extraction_model.generate_content(
+            extracted = await llm_client.generate(
+                self.extraction_model,
                 prompt,
                 generation_config=self.extraction_config
             )
-            extracted = response.text.strip()
 
             # Check if extraction failed
             if extracted.startswith("INVALID:"):
@@ -310,6 +275,9 @@ Do NOT include explanations, do NOT return both value and question."""
 
             return True, extracted, None
 
+        except asyncio.TimeoutError:
+            print(f"Timed out extracting value for {field_name}")
+            return False, None, "That took longer than expected to process. Please try again."
         except Exception as e:
             print(f"Error extracting value: {e}")
             return False, None, f"Failed to process response: {str(e)}"
@@ -366,13 +334,13 @@ Do NOT include explanations, do NOT return both value and question."""
 
         return True, None
 
-    def generate_clarification_question(
+    async def generate_clarification_question(
         self,
         field_name: str,
         field_type: str,
         error_message: str,
         user_response: str,
-        memory: ConversationBufferMemory
+        memory: ConversationMemory
     ) -> str:
         """Generate a friendly clarification question when extraction fails"""
 
@@ -396,60 +364,60 @@ Be warm and encouraging. Don't be robotic. Generate ONLY the clarification messa
 
         try:
             # Use light model for clarification messages
-            response = self.conversation_model.generate_content(
+            return await llm_client.generate(
+                self.conversation_model,
                 prompt,
                 generation_config=self.conversation_config
             )
-            return response.text.strip()
         except Exception as e:
             print(f"Error generating clarification: {e}")
             return f"I need {field_type} for {field_name}. {error_message} Please try again."
 
-    def save_single_message_to_db(self, db, document_id: str, message, message_type: str, field_id: Optional[str] = None):
+    async def save_single_message_to_db(self, db, document_id: str, content: str, message_type: str,
+                                        field_id: Optional[str] = None,
+                                        memory: Optional[ConversationMemory] = None):
         """
-        Save a single message to Supabase and update cache
+        Save a single message to Supabase and append it to the conversation memory
+        (the one passed in, otherwise the cached one)
 
         Performance optimizations:
-        - Updates cache immediately (fast in-memory operation)
-        - Saves to DB for persistence (1 query instead of 2)
+        - Updates memory immediately; the message is rendered into its history buffer once,
+          so prompts built afterwards reuse the string instead of re-rendering the history
+        - Persists through the write-behind queue (batched inserts, no DB round trip per message)
         - Removed duplicate check (relies on application logic)
+        - Turns pushed out of the token budget are summarized in the background
         """
         try:
-            # Update cache immediately
-            cached_memory = self._get_cached_memory(document_id)
-            if cached_memory:
-                # Add message to cached memory
-                if message_type == "human":
-                    cached_memory.chat_memory.add_message(HumanMessage(content=message.content))
-                elif message_type == "ai":
-                    cached_memory.chat_memory.add_message(AIMessage(content=message.content))
-                # Update cache timestamp
-                self._cache_memory(document_id, cached_memory)
-
-            # Insert new message to DB for persistence
-            db.client.table("conversation_memory").insert({
-                "document_id": document_id,
-                "session_id": document_id,
-                "message_type": message_type,
-                "content": message.content,
-                "field_id": field_id,
-                "metadata": {}
-            }).execute()
+            created_at = datetime.utcnow().isoformat()
+
+            # Update memory immediately
+            if memory is None:
+                memory = await self._get_cached_memory(document_id)
+            if memory is not None:
+                memory.add_message(message_type, content, created_at)
+                # Record the message in the cache (refreshes its expiry)
+                await conversation_cache.append(document_id, memory, message_type, content, created_at)
+                self._schedule_summary(db, document_id, memory)
+
+            # Queue the insert; the write-behind writer batches it off the request path
+            message_writer.enqueue(db.build_conversation_message(
+                document_id, message_type, content, field_id, created_at=created_at
+            ))
 
         except Exception as e:
             print(f"Error saving message to DB: {e}")
 
-    def load_memory_from_db(self, db, document_id: str) -> ConversationBufferMemory:
+    async def load_memory_from_db(self, db, document_id: str) -> ConversationMemory:
         """
         Load conversation memory from Supabase with caching and sliding window
 
         Performance optimizations:
         - Checks cache first (0 DB queries on cache hit)
-        - Uses sliding window (last 20 messages only)
+        - Loads the latest rolling summary plus the last 20 messages, concurrently
         - Caches result for subsequent requests
         """
         # Check cache first
-        cached_memory = self._get_cached_memory(document_id)
+        cached_memory = await self._get_cached_memory(document_id)
         if cached_memory:
             return cached_memory
 
@@ -457,28 +425,33 @@ Be warm and encouraging. Don't be robotic. Generate ONLY the clarification messa
         memory = self.create_memory(document_id)
 
         try:
-            # Load only the last N messages (sliding window)
-            response = db.client.table("conversation_memory")\
-                .select("*")\
-                .eq("document_id", document_id)\
-                .order("created_at", desc=True)\
-                .limit(self._sliding_window_size)\
-                .execute()
-
-            # Reverse to get chronological order
-            records = reversed(response.data)
-
-            for record in records:
-                if record["message_type"] == "human":
-                    memory.chat_memory.add_message(HumanMessage(content=record["content"]))
-                elif record["message_type"] == "ai":
-                    memory.chat_memory.add_message(AIMessage(content=record["content"]))
+            # Make sure queued messages are visible before reading them back
+            await message_writer.flush()
+
+            records, summary_record = await asyncio.gather(
+                db.get_recent_conversation_messages(document_id, self._sliding_window_size),
+                db.get_latest_conversation_summary(document_id)
+            )
+
+            summary, summary_until = "", None
+            if summary_record:
+                summary = summary_record["content"]
+                summary_until = (summary_record.get("metadata") or {}).get("summary_until")
+
+            # Reverse to get chronological order (messages folded into the summary are skipped)
+            memory.restore(summary, summary_until, (
+                (record["message_type"], record["content"], record["created_at"])
+                for record in reversed(records)
+                if record["message_type"] in ("human", "ai")
+            ))
+
+            self._schedule_summary(db, document_id, memory)
 
         except Exception as e:
             print(f"Error loading memory from DB: {e}")
 
         # Cache the loaded memory
-        self._cache_memory(document_id, memory)
+        await self._cache_memory(document_id, memory)
 
         return memory
 
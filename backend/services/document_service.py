@@ -1,13 +1,19 @@
-from docx import Document
-from docx.shared import RGBColor
-from typing import List, Dict, Optional, Tuple
-import io
+from typing import Callable, List, Dict, Optional, Tuple
+from collections import Counter
+import asyncio
+import uuid
 from datetime import datetime
+from config import settings
 from utils.database import db
+from utils.event_bus import event_bus
 from services.gemini_service import gemini_service
+from docx_engine.compiled_template import CompiledTemplate, Replacements
+from docx_engine.conversions import (
+    extract_text, convert_to_html, convert_to_formatted_html, ingest_docx, render_completed_docx
+)
+from services.docx_pool import docx_pool
+from services.preview_cache import preview_cache, PreviewEntry
 import re
-import mammoth
-from docx_parser_converter.docx_to_html.docx_to_html_converter import DocxToHtmlConverter
 
 
 class DocumentService:
@@ -15,77 +21,125 @@ class DocumentService:
         self.bucket_original = "original-documents"
         self.bucket_completed = "completed-documents"
 
-    def replace_nth_occurrence(self, text: str, placeholder: str, replacement: str, n: int) -> str:
-        """
-        Replace only the Nth occurrence of a placeholder in text.
-        n is 0-indexed (0 = first occurrence, 1 = second occurrence, etc.)
+    def build_status(self, status: str, completed_fields: int, total_fields: int) -> Dict[str, any]:
+        """Status payload shared by the status endpoint and the SSE event stream"""
+        progress = 0
+        if total_fields > 0:
+            progress = int((completed_fields / total_fields) * 100)
+
+        status_messages = {
+            "uploading": "Uploading document...",
+            "processing": "Extracting text and identifying placeholders...",
+            "ready": "Document is ready for filling",
+            "filling": f"Filling in progress ({completed_fields}/{total_fields} fields completed)",
+            "completed": "All fields completed!",
+            "error": "An error occurred during processing"
+        }
+
+        return {
+            "status": status,
+            "progress": progress,
+            "message": status_messages.get(status, "Processing...")
+        }
+
+    def publish_status(self, document_id: str, status: str, completed_fields: int = 0, total_fields: int = 0):
+        """Push a status/progress event to SSE subscribers of the document"""
+        event_bus.publish(document_id, "status", self.build_status(status, completed_fields, total_fields))
+
+    def build_replacements(self, fields: List[Dict], text_of: Callable[[Dict], Optional[str]]) -> Replacements:
         """
-        # Split the text by the placeholder
-        parts = text.split(placeholder)
+        Map each field's slot to its text (fields whose text is None are left out).
 
-        # If we don't have enough occurrences, return unchanged
-        if len(parts) <= n + 1:
-            return text
+        A placeholder with a single field fills all of its occurrences: the regex fallback
+        extraction, and often the model, emit one field per distinct placeholder. When a
+        placeholder has several fields, each fills its own occurrence_index.
+        """
+        fields_per_placeholder = Counter(field["placeholder"] for field in fields)
+        replacements: Replacements = {}
+        for field in fields:
+            text = text_of(field)
+            if text is None:
+                continue
+            placeholder = field["placeholder"]
+            occurrence_index = field.get("occurrence_index", 0) if fields_per_placeholder[placeholder] > 1 else None
+            replacements[(placeholder, occurrence_index)] = text
+        return replacements
+
+    def build_value_replacements(self, fields: List[Dict]) -> Replacements:
+        """Map each filled field's slot to its value"""
+        return self.build_replacements(fields, lambda field: field.get("value") or None)
+
+    def build_preview_spans(self, fields: List[Dict]) -> Dict[str, str]:
+        """Map every field id to a styled span (filled value or highlighted pending placeholder)"""
+        spans = {}
+        for field in fields:
+            value = field.get("value")
+            if value:
+                # Wrap filled values in a span for styling
+                spans[field["id"]] = f'<span class="filled-field" data-field-id="{field["id"]}" style="background-color: #d1fae5; color: #047857; padding: 2px 6px; border-radius: 4px; font-weight: 500;">{value}</span>'
+            else:
+                # Wrap pending placeholders in a span for styling
+                spans[field["id"]] = f'<span class="pending-field" data-field-id="{field["id"]}" style="background-color: #fef3c7; color: #92400e; padding: 2px 6px; border-radius: 4px; font-weight: 500; border: 1px solid #fbbf24;">{field["placeholder"]}</span>'
+        return spans
 
-        # Join: take all parts before n, add replacement, then all parts after n
-        before = placeholder.join(parts[:n+1])
-        after = placeholder.join(parts[n+1:])
-        return before + replacement + after
+    async def extract_text_from_docx(self, file_data: bytes) -> str:
+        """Extract text content from a .docx file (in the docx process pool)"""
+        try:
+            return await docx_pool.run(extract_text, file_data)
+        except Exception as e:
+            raise Exception(f"Failed to extract text from document: {str(e)}")
 
-    def extract_text_from_docx(self, file_data: bytes) -> str:
-        """Extract text content from a .docx file"""
+    async def ingest_document(self, filename: str, file_data: bytes) -> Dict[str, any]:
+        """
+        Parse an upload once and store it: the text and preview base HTML are produced in a
+        single docx pool call, the file is stored under a pre-generated id, and the document
+        row is created with all of them in one write. Raises if the file isn't a valid .docx.
+        """
         try:
-            doc = Document(io.BytesIO(file_data))
-            full_text = []
-
-            # Extract text from paragraphs
-            for paragraph in doc.paragraphs:
-                if paragraph.text.strip():
-                    full_text.append(paragraph.text)
-
-            # Extract text from tables
-            for table in doc.tables:
-                for row in table.rows:
-                    for cell in row.cells:
-                        if cell.text.strip():
-                            full_text.append(cell.text)
-
-            return '\n'.join(full_text)
+            text_content, preview_html = await docx_pool.run(ingest_docx, file_data)
         except Exception as e:
             raise Exception(f"Failed to extract text from document: {str(e)}")
 
-    async def process_document(self, document_id: str, file_data: bytes) -> Dict[str, any]:
+        document_id = str(uuid.uuid4())
+        file_path = await self.upload_original_document(document_id, file_data)
+        print(f"✓ Uploaded document to storage: {file_path}")
+
+        return await db.create_document(
+            filename=filename,
+            file_path=file_path,
+            original_content=text_content,
+            preview_html=preview_html,
+            document_id=document_id
+        )
+
+    async def process_document(self, document_id: str, text_content: str,
+                               mark_error: bool = True) -> Dict[str, any]:
         """
-        Process a document: extract text, identify placeholders, create fields.
-        This is the main processing pipeline.
+        Process a document: identify placeholders in its text, create fields.
+        This is the main processing pipeline (the text was extracted at upload).
+        With mark_error=False a failure leaves the document "processing" (a retry follows).
         """
         try:
             # Update status to processing
-            db.update_document_status(document_id, "processing")
+            await db.update_document_status(document_id, "processing")
+            self.publish_status(document_id, "processing")
 
-            # Step 1: Extract text content
-            text_content = self.extract_text_from_docx(file_data)
-            db.update_document_content(document_id, text_content)
-
-            # Step 2: Use Gemini to identify placeholders
-            placeholders = gemini_service.extract_placeholders(text_content)
+            # Step 1: Use Gemini to identify placeholders
+            placeholders = await gemini_service.extract_placeholders(text_content)
 
             if not placeholders:
                 raise Exception("No placeholders found in the document")
 
-            # Step 3: Create field records in database
-            for field_data in placeholders:
-                db.create_field(
-                    document_id=document_id,
-                    name=field_data["name"],
-                    placeholder=field_data["placeholder"],
-                    field_type=field_data.get("type", "text"),
-                    order=field_data["order"],
-                    occurrence_index=field_data.get("occurrence_index", 0)
-                )
+            # Step 2: Precompute first-attempt questions in one batched call (question bank)
+            if settings.PRECOMPUTE_QUESTIONS:
+                await self.attach_question_bank(text_content, placeholders)
+
+            # Step 3: Create field records in database (bulk insert)
+            await db.create_fields(document_id, placeholders)
 
             # Step 4: Update document status to ready
-            db.update_document_status(document_id, "ready")
+            await db.update_document_status(document_id, "ready")
+            self.publish_status(document_id, "ready", 0, len(placeholders))
 
             return {
                 "success": True,
@@ -94,91 +148,191 @@ class DocumentService:
             }
 
         except Exception as e:
-            db.update_document_status(document_id, "error")
+            if mark_error:
+                await db.update_document_status(document_id, "error")
+                self.publish_status(document_id, "error")
             raise Exception(f"Document processing failed: {str(e)}")
 
-    def get_document_preview(self, document_id: str) -> str:
+    async def run_processing_task(self, task: Dict) -> Dict[str, any]:
+        """
+        Job queue handler for "process_document" tasks: run the processing pipeline on the
+        text stored at upload. Failures are left to the job queue, which retries them and
+        calls mark_processing_failed after the last attempt.
+        """
+        document_id = task["document_id"]
+        attempts = task.get("attempts") or 1
+
+        document = await db.get_document(document_id)
+        if not document:
+            raise Exception("Document not found")
+        if document["status"] in ("ready", "filling", "completed"):
+            # A previous attempt finished but its outcome wasn't recorded
+            return {"success": True, "status": document["status"]}
+
+        if attempts > 1:
+            # A failed attempt may have inserted some of the fields
+            await db.delete_fields(document_id)
+
+        text_content = document.get("original_content")
+        if not text_content:
+            # Uploaded before text was stored at ingest
+            file_path = document.get("file_path") or f"{document_id}/original.docx"
+            file_data = await db.download_file(self.bucket_original, file_path)
+            text_content = await self.extract_text_from_docx(file_data)
+            await db.update_document_content(document_id, text_content)
+
+        return await self.process_document(document_id, text_content, mark_error=False)
+
+    async def mark_processing_failed(self, task: Dict):
+        """Job queue failure hook: the last processing attempt failed, whatever step it failed in"""
+        await db.update_document_status(task["document_id"], "error")
+        self.publish_status(task["document_id"], "error")
+
+    async def attach_question_bank(self, document_content: str, fields: List[Dict]):
+        """
+        Generate every field's first-attempt question in a single Gemini call and store it
+        on the field dicts under "question". Fields left without one are asked on demand.
+        """
+        contexts = [self.get_context_for_field(document_content, field["placeholder"]) for field in fields]
+        questions = await gemini_service.generate_questions_for_fields(fields, contexts)
+
+        banked = 0
+        for field, question in zip(fields, questions):
+            if question:
+                field["question"] = question
+                banked += 1
+        print(f"✓ Question bank: {banked}/{len(fields)} questions precomputed")
+
+    async def get_document_preview(self, document_id: str,
+                                   document: Optional[Dict] = None) -> Tuple[str, List[Dict]]:
         """
         Generate HTML preview of the document with current field values.
         Uses Mammoth to convert .docx to HTML with proper formatting.
+        Returns (html, fields).
+
+        Performance optimizations:
+        - Mammoth base HTML is produced once at upload and stored with the document;
+          it and its compiled template are cached per worker
+        - The rendered preview is cached per document version (bumped on every field change),
+          so repeated polls skip the field listing and re-render entirely
         """
-        document = db.get_document(document_id)
+        if document is None:
+            document = await db.get_document(document_id)
         if not document:
             raise Exception("Document not found")
 
+        version = document.get("version")
+        cached = preview_cache.get_rendered(document_id, version)
+        if cached:
+            return cached.html, cached.fields
+
         try:
-            # Get original file from storage
             file_path = document.get("file_path", "")
             if file_path:
-                file_data = db.download_file(self.bucket_original, file_path)
-
-                # Convert .docx to HTML using Mammoth
-                result = mammoth.convert_to_html(io.BytesIO(file_data))
-                html_content = result.value
-
-                # Replace placeholders with values (occurrence-aware)
-                fields = db.get_fields(document_id)
-                print(f"\n=== PREVIEW GENERATION for document {document_id} ===")
-                print(f"Total fields: {len(fields)}")
-
-                for field in fields:
-                    placeholder = field["placeholder"]
-                    value = field.get("value")
-                    occurrence_index = field.get("occurrence_index", 0)
-
-                    print(f"\n--- Field: {field['name']} ---")
-                    print(f"  Placeholder: {placeholder}")
-                    print(f"  Value: {value}")
-                    print(f"  Occurrence Index: {occurrence_index}")
-                    print(f"  Status: {'FILLED' if value else 'PENDING'}")
-
-                    if value:
-                        # Wrap filled values in a span for styling
-                        replacement = f'<span class="filled-field" style="background-color: #d1fae5; color: #047857; padding: 2px 6px; border-radius: 4px; font-weight: 500;">{value}</span>'
-                        print(f"  → Replacing occurrence {occurrence_index} with filled value")
-                        html_content = self.replace_nth_occurrence(
-                            html_content, placeholder, replacement, occurrence_index
-                        )
-                    else:
-                        # Wrap pending placeholders in a span for styling
-                        replacement = f'<span class="pending-field" style="background-color: #fef3c7; color: #92400e; padding: 2px 6px; border-radius: 4px; font-weight: 500; border: 1px solid #fbbf24;">{placeholder}</span>'
-                        print(f"  → Wrapping occurrence {occurrence_index} with pending span")
-                        html_content = self.replace_nth_occurrence(
-                            html_content, placeholder, replacement, occurrence_index
-                        )
-
-                print(f"\n=== PREVIEW GENERATION COMPLETE ===\n")
-
-                return html_content
+                entry = preview_cache.get(document_id)
+                if entry:
+                    base_html = entry.base_html
+                    # Spans already rebuilt for this version by a delta request: reuse its fields
+                    fields = entry.fields if entry.version == version else await db.get_fields(document_id)
+                else:
+                    base_html, fields = await asyncio.gather(
+                        db.get_document_preview_html(document_id),
+                        db.get_fields(document_id)
+                    )
+                    if base_html is None:
+                        # Uploaded before preview HTML was stored: convert the original with Mammoth
+                        file_data = await db.download_file(self.bucket_original, file_path)
+                        base_html = await docx_pool.run(convert_to_html, file_data)
+
+                # Recompile only if the placeholder set changed (e.g. fields were just created)
+                placeholders = {field["placeholder"] for field in fields}
+                if entry and entry.template.placeholders == placeholders:
+                    template = entry.template
+                else:
+                    template = CompiledTemplate(base_html, placeholders)
+
+                # Replace placeholders with values (occurrence-aware, single pass)
+                spans = self.build_preview_spans(fields)
+                html_content = template.render(self.build_replacements(fields, lambda field: spans[field["id"]]))
+                preview_cache.put(
+                    document_id,
+                    PreviewEntry(base_html, template, version, html_content, fields, spans, previous=entry)
+                )
+                print(f"✓ Rendered preview for {document_id} v{version} ({len(fields)} fields, {len(template.slots)} placeholder slots)")
+
+                return html_content, fields
             else:
                 # Fallback to text content if file not in storage
                 content = document.get("original_content", "")
-                fields = db.get_fields(document_id)
+                fields = await db.get_fields(document_id)
 
-                for field in fields:
-                    placeholder = field["placeholder"]
-                    value = field.get("value")
-                    occurrence_index = field.get("occurrence_index", 0)
-                    if value:
-                        content = self.replace_nth_occurrence(
-                            content, placeholder, value, occurrence_index
-                        )
+                template = CompiledTemplate(content, (field["placeholder"] for field in fields))
+                content = template.render(self.build_value_replacements(fields))
 
                 # Convert plain text to HTML
-                return f"<pre style='white-space: pre-wrap; font-family: inherit;'>{content}</pre>"
+                return f"<pre style='white-space: pre-wrap; font-family: inherit;'>{content}</pre>", fields
 
         except Exception as e:
             print(f"Error generating HTML preview: {e}")
             # Fallback to plain text
             content = document.get("original_content", "")
-            return f"<pre style='white-space: pre-wrap; font-family: inherit;'>{content}</pre>"
+            return f"<pre style='white-space: pre-wrap; font-family: inherit;'>{content}</pre>", await db.get_fields(document_id)
+
+    async def get_preview_delta(self, document_id: str, since_version: int,
+                                document: Optional[Dict] = None) -> Dict[str, any]:
+        """
+        Get the preview changes since the client's last known document version.
+
+        Returns {"version", "full", "content", "patches"}: patches maps field id to the
+        new span HTML, which replaces every element carrying that data-field-id (a field
+        may fill several occurrences). If `since_version` is older than the tracked
+        history, full is True and content holds the whole preview instead.
+
+        A version change only rebuilds the field spans (cost scales with the fields, not
+        the document); the whole document is rendered only for the full fallback.
+        """
+        if document is None:
+            document = await db.get_document(document_id)
+        if not document:
+            raise Exception("Document not found")
 
-    def get_completed_document_preview(self, document_id: str) -> str:
+        version = document.get("version")
+        entry = preview_cache.get(document_id)
+        patches = None
+        if entry is not None and version is not None and entry.version is not None:
+            if entry.version < version:
+                entry = await self._refresh_preview_spans(document_id, entry, version)
+            if entry is not None and entry.version == version:
+                patches = entry.changes_since(since_version)
+
+        if patches is None:
+            content, _ = await self.get_document_preview(document_id, document)
+            return {"version": version, "full": True, "content": content, "patches": {}}
+        return {"version": version, "full": False, "content": None, "patches": patches}
+
+    async def _refresh_preview_spans(self, document_id: str, entry: PreviewEntry,
+                                     version: int) -> Optional[PreviewEntry]:
+        """
+        Rebuild a cached preview's field spans for a newer version without rendering the
+        document. Returns None if the placeholder set changed (a full render is needed).
+        """
+        fields = await db.get_fields(document_id)
+        if {field["placeholder"] for field in fields} != entry.template.placeholders:
+            return None
+
+        refreshed = PreviewEntry(
+            entry.base_html, entry.template, version, None, fields,
+            self.build_preview_spans(fields), previous=entry
+        )
+        preview_cache.put(document_id, refreshed)
+        return refreshed
+
+    async def get_completed_document_preview(self, document_id: str) -> str:
         """
         Generate HTML preview of the completed document.
         Uses docx-parser-converter to convert the completed .docx to HTML with formatting preservation.
         """
-        document = db.get_document(document_id)
+        document = await db.get_document(document_id)
         if not document:
             raise Exception("Document not found")
 
@@ -186,20 +340,19 @@ class DocumentService:
             # Try to get completed document from storage first
             completed_file_path = f"{document_id}/completed.docx"
             try:
-                file_data = db.download_file(self.bucket_completed, completed_file_path)
+                file_data = await db.download_file(self.bucket_completed, completed_file_path)
                 print(f"✓ Using completed document from storage for preview")
             except Exception:
                 # Completed document not found, generate it on-demand
                 print(f"⚠ Completed document not in storage, generating for preview...")
-                original_file_data = db.download_file(
+                original_file_data = await db.download_file(
                     self.bucket_original,
                     f"{document_id}/original.docx"
                 )
-                file_data = self.generate_completed_document(document_id, original_file_data)
+                file_data = await self.generate_completed_document(document_id, original_file_data)
 
             # Convert .docx to HTML using docx-parser-converter (preserves formatting/indentation)
-            converter = DocxToHtmlConverter(file_data, use_default_values=True)
-            html_content = converter.convert_to_html()
+            html_content = await docx_pool.run(convert_to_formatted_html, file_data)
 
             return html_content
 
@@ -207,60 +360,22 @@ class DocumentService:
             print(f"Error generating completed document preview: {e}")
             raise Exception(f"Failed to generate preview: {str(e)}")
 
-    def generate_completed_document(self, document_id: str, original_file_data: bytes) -> bytes:
+    async def generate_completed_document(self, document_id: str, original_file_data: bytes) -> bytes:
         """
         Generate a completed .docx document with all placeholders filled in.
         Uses occurrence-aware replacement to handle duplicate placeholders correctly.
         Returns the completed document as bytes.
         """
         try:
-            # Load the original document
-            doc = Document(io.BytesIO(original_file_data))
-            fields = db.get_fields(document_id)
-
-            # Build list of replacements with occurrence tracking
-            replacements = []  # List of (placeholder, value, occurrence_index) tuples
-            for field in fields:
-                if field.get("value"):
-                    replacements.append({
-                        "placeholder": field["placeholder"],
-                        "value": field["value"],
-                        "occurrence_index": field.get("occurrence_index", 0)
-                    })
-
-            # Replace placeholders in paragraphs (occurrence-aware)
-            for paragraph in doc.paragraphs:
-                for replacement in replacements:
-                    placeholder = replacement["placeholder"]
-                    value = replacement["value"]
-                    occurrence_index = replacement["occurrence_index"]
-
-                    if placeholder in paragraph.text:
-                        # Replace only the Nth occurrence of this placeholder
-                        paragraph.text = self.replace_nth_occurrence(
-                            paragraph.text, placeholder, value, occurrence_index
-                        )
-
-            # Replace placeholders in tables (occurrence-aware)
-            for table in doc.tables:
-                for row in table.rows:
-                    for cell in row.cells:
-                        for paragraph in cell.paragraphs:
-                            for replacement in replacements:
-                                placeholder = replacement["placeholder"]
-                                value = replacement["value"]
-                                occurrence_index = replacement["occurrence_index"]
-
-                                if placeholder in paragraph.text:
-                                    paragraph.text = self.replace_nth_occurrence(
-                                        paragraph.text, placeholder, value, occurrence_index
-                                    )
-
-            # Save to bytes
-            output = io.BytesIO()
-            doc.save(output)
-            output.seek(0)
-            return output.getvalue()
+            fields = await db.get_fields(document_id)
+
+            # Parse, fill and save in the docx process pool
+            return await docx_pool.run(
+                render_completed_docx,
+                original_file_data,
+                [field["placeholder"] for field in fields],
+                self.build_value_replacements(fields),
+            )
 
         except Exception as e:
             raise Exception(f"Failed to generate completed document: {str(e)}")
@@ -287,19 +402,25 @@ class DocumentService:
     async def upload_original_document(self, document_id: str, file_data: bytes) -> str:
         """Upload original document to Supabase Storage"""
         file_path = f"{document_id}/original.docx"
-        db.upload_file(self.bucket_original, file_path, file_data)
+        await db.upload_file(self.bucket_original, file_path, file_data)
         return file_path
 
     async def upload_completed_document(self, document_id: str, file_data: bytes) -> str:
         """Upload completed document to Supabase Storage"""
         file_path = f"{document_id}/completed.docx"
-        db.upload_file(self.bucket_completed, file_path, file_data)
+        await db.upload_file(self.bucket_completed, file_path, file_data)
         return file_path
 
-    def get_completion_summary(self, document_id: str) -> Dict[str, any]:
+    async def get_completion_summary(self, document_id: str,
+                                     document: Optional[Dict] = None) -> Dict[str, any]:
         """Generate completion summary for a document"""
-        document = db.get_document(document_id)
-        fields = db.get_fields(document_id)
+        if document is None:
+            document, fields = await asyncio.gather(
+                db.get_document(document_id),
+                db.get_fields(document_id)
+            )
+        else:
+            fields = await db.get_fields(document_id)
 
         if not document:
             raise Exception("Document not found")
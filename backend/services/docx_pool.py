@@ -0,0 +1,97 @@
+"""
+Process pool for CPU-bound .docx parsing and rendering
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+from config import settings
+from docx_engine.conversions import ping, warm_up
+from utils.metrics import metrics
+import asyncio
+import functools
+import multiprocessing
+import os
+import time
+
+
+# How long start() waits for every worker to spawn and import the docx libraries
+STARTUP_TIMEOUT_SECONDS = 60
+
+
+class DocxPool:
+    """
+    Runs docx_engine.conversions functions in a pool of worker processes, off the event loop thread.
+
+    - Sized to the CPU count by default (DOCX_POOL_WORKERS)
+    - Workers are spawned and import python-docx, Mammoth and docx-parser-converter at
+      startup (start() returns once every worker has), so the first conversion doesn't
+      pay for process start or imports
+    - A pool broken by a crashed worker is replaced (once, however many calls saw it
+      break) and the call retried once
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # Spawned workers don't inherit the server's event loop, sockets or locks
+        context = multiprocessing.get_context("spawn")
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=context,
+            initializer=warm_up,
+            initargs=(context.Barrier(self.max_workers, timeout=STARTUP_TIMEOUT_SECONDS),),
+        )
+
+    async def start(self):
+        """Spawn and warm up every worker (call from the app's startup event)"""
+        if self._executor is None:
+            self._executor = self._create_executor()
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        # Each ping waits at the workers' barrier until every worker holds one, so the pool
+        # has to spawn (and warm up) all of them before any ping returns
+        try:
+            pids = await asyncio.gather(*(
+                loop.run_in_executor(self._executor, ping) for _ in range(self.max_workers)
+            ))
+        except Exception as e:
+            print(f"⚠ Docx process pool did not start all {self.max_workers} workers: {e}")
+            return
+        print(f"✓ Docx process pool ready: {len(set(pids))} workers in {time.monotonic() - started:.1f}s")
+
+    async def run(self, function: Callable[..., Any], *args) -> Any:
+        """Run a module-level conversion function in the pool and return its result"""
+        if self._executor is None:
+            # Used outside the app (scripts): start lazily
+            self._executor = self._create_executor()
+
+        loop = asyncio.get_running_loop()
+        call = functools.partial(function, *args)
+        started = time.monotonic()
+        executor = self._executor
+        try:
+            result = await loop.run_in_executor(executor, call)
+        except BrokenProcessPool:
+            # Concurrent callers all see the same broken pool; only the first replaces it,
+            # so a replacement (and the retries running on it) is never shut down
+            if self._executor is executor:
+                print(f"⚠ Docx process pool broke during {function.__name__}, restarting it")
+                metrics.increment("docx_pool.restarts")
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._create_executor()
+            result = await loop.run_in_executor(self._executor, call)
+        metrics.observe(f"docx_pool.{function.__name__}", time.monotonic() - started)
+        return result
+
+    async def close(self):
+        """Shut the workers down (call from the app's shutdown event)"""
+        if self._executor is None:
+            return
+        executor, self._executor = self._executor, None
+        await asyncio.get_running_loop().run_in_executor(None, functools.partial(executor.shutdown, wait=True))
+
+
+# Singleton instance
+docx_pool = DocxPool(settings.DOCX_POOL_WORKERS)
@@ -0,0 +1,219 @@
+"""
+Extraction prompt assembly, sliced per field type.
+
+Only the rule sections relevant to the field are sent. The prompt is ordered so
+everything that doesn't depend on the request (instructions, the selected rules,
+output format) comes first and the field, conversation and user response come
+last, which keeps the prefix identical across calls for provider-side context caching.
+"""
+from typing import Dict, List, Tuple
+from services.fast_extraction import is_amount_name
+import re
+
+
+PROMPT_HEADER = """You are an intelligent field extraction and validation system for legal documents.
+
+---
+
+EXTRACTION AND VALIDATION RULES BY FIELD TYPE:
+"""
+
+RULE_SECTIONS: Dict[str, str] = {
+    "amount": """## AMOUNTS (Purchase Amount, Valuation Cap, currency fields):
+- Convert shorthand: "500k" → "$500,000", "10m" → "$10,000,000", "2.5M" → "$2,500,000"
+- Convert words: "one million" → "$1,000,000", "five hundred thousand" → "$500,000"
+- Convert currency notations: "₹5 lakh" → INVALID: Please provide the amount in USD
+- Default currency is USD unless user specifies otherwise
+- Remove extra spaces, periods (except decimal), commas in input
+- Final format MUST be: $X,XXX,XXX (comma-separated with dollar sign)
+- If meaning is unclear (e.g., "about 200k", "roughly 1M"), return: INVALID: Please provide the exact amount (e.g., Is it exactly $200,000?)
+""",
+    "percentage": """## PERCENTAGES (Discount Rate, ownership, interest rates):
+- Convert words: "eighty percent" → "80%", "twelve and a half percent" → "12.5%"
+- Output format: the number followed by % (e.g., "20%"), never a dollar amount
+- If a bare decimal is ambiguous (e.g., "0.2"), return: INVALID: Did you mean 20% or 0.2%?
+""",
+    "number": """## NUMBERS / COUNTS (shares, days, quantities):
+- Convert words and shorthand: "1 million" → "1,000,000", "ten" → "10", "5k" → "5,000"
+- Output the plain number with comma separators (e.g., "1,000,000")
+- No currency symbol unless the field is a monetary amount (see AMOUNTS)
+""",
+    "date": """## DATES:
+- Convert natural language:
+  * "second week of June" → "June 10, 2025" (use Monday of that week, or ask if year unclear)
+  * "mid-July" → "July 15, 2025"
+  * "early March" → "March 1, 2025"
+  * "end of December" → "December 31, 2025"
+- Normalize formats: "10th June", "June 10 2025", "10/06/25", "6-10-25" → "June 10, 2025"
+- Strict output format: Month DD, YYYY (e.g., "January 15, 2025")
+- If vague ("sometime in October", "Q2 2025"), return: INVALID: Please provide a specific date
+""",
+    "jurisdiction": """## JURISDICTION / STATE OF INCORPORATION:
+- Correct misspellings: "Texes" → "Texas, USA", "Californya" → "California, USA"
+- Add default country: "Delaware" → "Delaware, USA"
+- If ambiguous location, return: INVALID: Do you mean [Location], USA or [Location] (the country)?
+  Example: "Georgia" → INVALID: Do you mean Georgia, USA or Georgia (the country)?
+- Output format: [State/Province], [Country]
+""",
+    "address": """## ADDRESSES:
+- Expand abbreviations: "sf" → "San Francisco", "NYC" → "New York City"
+- Fix capitalization: "123 main st" → "123 Main St"
+- Remove emojis or irrelevant text
+- Ensure complete format: Street, City, State/Province, Country, ZIP
+- If missing key parts (city, state, zip), return: INVALID: Please provide the complete address including [missing part]
+""",
+    "company": """## COMPANY NAME:
+- Capitalize properly: "acme inc" → "Acme Inc.", "google llc" → "Google LLC"
+- Fix spacing: "Test  Company" → "Test Company"
+- If user provides only partial name (e.g., "Acme"), return: INVALID: Is the legal entity name "Acme, Inc.", "Acme LLC", or something else?
+- Keep legal suffixes: Inc., LLC, Corp., Ltd., etc.
+""",
+    "investor": """## INVESTOR NAME:
+- Capitalize properly: "john smith" → "John Smith"
+- Remove unnecessary punctuation and emojis
+- If company investor, apply company name rules
+- Format: First Last for individuals, Legal Name for entities
+""",
+    "email": """## EMAIL:
+- Extract email address
+- Validate format (must have @ and domain)
+- Convert to lowercase: "John@Example.COM" → "john@example.com"
+""",
+    "phone": """## PHONE:
+- Extract digits and formatting
+- Accept various formats: (555) 123-4567, 555-123-4567, 5551234567
+- Preserve formatting user provides
+- Must have at least 10 digits
+""",
+    "text": """## TEXT / GENERAL:
+- Extract relevant information
+- Fix capitalization if appropriate
+- Remove extra spaces and line breaks
+- Minimum 2 characters
+""",
+}
+
+# Rule sections always included (the general rules apply to every field)
+SHARED_SECTIONS = ("text",)
+
+# Sections selected by field type
+TYPE_SECTIONS: Dict[str, Tuple[str, ...]] = {
+    "currency": ("amount",),
+    "number": ("number",),
+    "percentage": ("percentage",),
+    "date": ("date",),
+    "address": ("address", "jurisdiction"),
+    "company": ("company",),
+    "name": ("investor", "company"),
+    "email": ("email",),
+    "phone": ("phone",),
+}
+
+# Sections selected by words in the field name (types are often just "text").
+# Matched against whole words, optionally plural ("Dates" matches "date", "Statement" doesn't match "state").
+# Money names get the amount rules through fast_extraction's AMOUNT_KEYWORDS, so both paths agree
+NAME_KEYWORD_SECTIONS: Dict[str, Tuple[str, ...]] = {
+    "percent": ("percentage",),
+    "percentage": ("percentage",),
+    "rate": ("percentage",),
+    "discount": ("percentage",),
+    "shares": ("number",),
+    "date": ("date",),
+    "jurisdiction": ("jurisdiction",),
+    "state": ("jurisdiction",),
+    "country": ("jurisdiction",),
+    "incorporation": ("jurisdiction",),
+    "address": ("address",),
+    "company": ("company",),
+    "entity": ("company",),
+    "investor": ("investor", "company"),
+    "email": ("email",),
+    "phone": ("phone",),
+}
+
+PROMPT_FOOTER = """---
+
+SPECIAL BEHAVIOR RULES:
+
+1. Extract from full sentences:
+   User: "We invested around 500k last year" → Extract: "$500,000"
+
+2. Auto-fix spelling (unless ambiguous):
+   User: "Californya" → Extract: "California, USA"
+
+3. If multiple interpretations possible, ALWAYS ask for clarification:
+   User: "200k" for a date field → INVALID: Did you mean $200,000 or a date?
+
+4. NEVER return both clarification AND value - it's one or the other
+
+5. Detect refusals and deferrals - return INVALID (using the field name below):
+   - "I don't know" → INVALID: Please provide the <field> when you have it
+   - "Skip this" → INVALID: This field is required, please provide the <field>
+   - "TBD" / "N/A" / "Unknown" → INVALID: Please provide an actual value for <field>
+   - "I'll get back to you" → INVALID: Please provide the <field> to continue
+
+6. Extract ONLY the relevant variable from the response, ignore surrounding text
+
+---
+
+OUTPUT INSTRUCTIONS:
+
+Return ONLY one of these two formats:
+1. The extracted and normalized value (following field type rules above)
+2. INVALID: <your clarification question to the user>
+
+Do NOT include explanations, do NOT return both value and question.
+
+---
+"""
+
+# Canonical order, so the same section set always produces the same prefix
+SECTION_ORDER: List[str] = list(RULE_SECTIONS)
+
+FULL_RULES_CHARS = sum(len(section) for section in RULE_SECTIONS.values())
+
+
+def select_rule_sections(field_type: str, field_name: str) -> List[str]:
+    """Return the rule section keys relevant to a field, in canonical order"""
+    selected = set(SHARED_SECTIONS)
+    selected.update(TYPE_SECTIONS.get((field_type or "").lower(), ()))
+    if is_amount_name(field_name):
+        selected.add("amount")
+
+    for word in re.findall(r"[a-z]+", (field_name or "").lower()):
+        sections = NAME_KEYWORD_SECTIONS.get(word) or NAME_KEYWORD_SECTIONS.get(word[:-1] if word.endswith("s") else "")
+        if sections:
+            selected.update(sections)
+
+    return [key for key in SECTION_ORDER if key in selected]
+
+
+def build_extraction_prompt(
+    field_name: str,
+    field_type: str,
+    placeholder: str,
+    chat_history: str,
+    user_response: str
+) -> Tuple[str, int]:
+    """
+    Build the extraction prompt for a field.
+    Returns (prompt, estimated input tokens saved versus sending every rule section).
+    """
+    sections = select_rule_sections(field_type, field_name)
+    rules = "\n".join(RULE_SECTIONS[key] for key in sections)
+
+    prompt = f"""{PROMPT_HEADER}
+{rules}
+{PROMPT_FOOTER}
+Field to extract: {field_name}
+Field Type: {field_type}
+Placeholder: {placeholder}
+
+Previous conversation:
+{chat_history}
+
+User's response: "{user_response}\""""
+
+    # ~4 characters per token is close enough for reporting
+    tokens_saved = (FULL_RULES_CHARS - sum(len(RULE_SECTIONS[key]) for key in sections)) // 4
+    return prompt, tokens_saved
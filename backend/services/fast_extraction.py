@@ -0,0 +1,147 @@
+"""
+Deterministic fast path for field extraction.
+
+Answers that are already a clean, unambiguous value for the field type (an email
+address, an ISO date, "$250,000", ...) are canonicalized locally in the same format
+the extraction prompt asks Gemini for. Anything else returns None and goes to the model.
+"""
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Callable, Dict, Optional
+import re
+
+
+EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+PHONE_RE = re.compile(r'^\+?[\d\s().-]+$')
+ISO_DATE_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})$')
+ORDINAL_RE = re.compile(r'(\d{1,2})(st|nd|rd|th)\b', re.IGNORECASE)
+NUMBER_RE = re.compile(r'^-?(\d{1,3}(,\d{3})+|\d+)(\.\d+)?$')
+CURRENCY_RE = re.compile(r'^(usd\s*)?\$?\s*(\d{1,3}(,\d{3})+|\d+)(\.\d+)?\s*([kmb])?(\s*usd)?$', re.IGNORECASE)
+PERCENTAGE_RE = re.compile(r'^(\d+(\.\d+)?)\s*(%|percent)?$', re.IGNORECASE)
+
+# Day/month order is only unambiguous when the month is spelled out
+DATE_FORMATS = ("%B %d %Y", "%b %d %Y", "%d %B %Y", "%d %b %Y")
+
+SUFFIX_MULTIPLIERS = {"k": 1_000, "m": 1_000_000, "b": 1_000_000_000}
+
+# "number" fields with one of these words in their name hold money and are formatted as
+# currency. Whole words, in the forms that mean money: "Legal Fees" and "Total Cost" are
+# money; "Escape Period Days", "Cap Table Shares" and "Installment Payments" are not
+AMOUNT_KEYWORDS = ("amount", "price", "valuation", "salary", "fee", "fees", "cost", "costs", "payment")
+AMOUNT_NAME_RE = re.compile(r'\b(' + '|'.join(AMOUNT_KEYWORDS) + r')\b', re.IGNORECASE)
+# Names that count something are never money ("Number of Payments", "# of Installments")
+COUNT_NAME_RE = re.compile(r'^\s*(number\s+of|no\.?\s+of|#\s*of|count)\b', re.IGNORECASE)
+
+
+def normalize_email(value: str) -> Optional[str]:
+    if not EMAIL_RE.match(value):
+        return None
+    return value.lower()
+
+
+def normalize_phone(value: str) -> Optional[str]:
+    # The extraction rules preserve the user's formatting, so only the digit count is checked
+    if not PHONE_RE.match(value):
+        return None
+    digits = re.sub(r'\D', '', value)
+    if not 10 <= len(digits) <= 15:
+        return None
+    return value
+
+
+def normalize_date(value: str) -> Optional[str]:
+    match = ISO_DATE_RE.match(value)
+    if match:
+        try:
+            parsed = datetime(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+        except ValueError:
+            return None
+    else:
+        cleaned = ORDINAL_RE.sub(r'\1', value).replace(",", " ").replace(".", " ")
+        cleaned = " ".join(cleaned.split())
+        parsed = None
+        for date_format in DATE_FORMATS:
+            try:
+                parsed = datetime.strptime(cleaned, date_format)
+                break
+            except ValueError:
+                continue
+        if parsed is None:
+            return None
+
+    return f"{parsed:%B} {parsed.day}, {parsed.year}"
+
+
+def normalize_currency(value: str) -> Optional[str]:
+    match = CURRENCY_RE.match(value)
+    if not match:
+        return None
+
+    try:
+        amount = Decimal(match.group(2).replace(",", "") + (match.group(4) or ""))
+    except InvalidOperation:
+        return None
+
+    suffix = (match.group(5) or "").lower()
+    if suffix:
+        amount *= SUFFIX_MULTIPLIERS[suffix]
+
+    if amount == amount.to_integral_value():
+        return f"${int(amount):,}"
+    if amount.as_tuple().exponent >= -2:
+        return f"${amount:,.2f}"
+    # Fractions of a cent need a human decision
+    return None
+
+
+def normalize_percentage(value: str) -> Optional[str]:
+    match = PERCENTAGE_RE.match(value)
+    if not match:
+        return None
+    # A bare fraction ("0.2") may mean 20% rather than 0.2%: let the model ask
+    if not match.group(3) and Decimal(match.group(1)) < 1:
+        return None
+    return f"{match.group(1)}%"
+
+
+def normalize_number(value: str) -> Optional[str]:
+    if not NUMBER_RE.match(value):
+        return None
+    return value
+
+
+NORMALIZERS: Dict[str, Callable[[str], Optional[str]]] = {
+    "email": normalize_email,
+    "phone": normalize_phone,
+    "date": normalize_date,
+    "currency": normalize_currency,
+    "percentage": normalize_percentage,
+    "number": normalize_number,
+}
+
+
+def is_amount_name(field_name: str) -> bool:
+    """True if a field's name says it holds money"""
+    field_name = field_name or ""
+    return bool(AMOUNT_NAME_RE.search(field_name)) and not COUNT_NAME_RE.match(field_name)
+
+
+def fast_extract(user_response: str, field_type: str, field_name: str = "") -> Optional[str]:
+    """
+    Return the canonical value if the whole response is an unambiguous value for the
+    field type, or None when the model has to interpret it.
+    """
+    field_type = (field_type or "").lower()
+    if field_type == "number" and is_amount_name(field_name):
+        field_type = "currency"
+
+    normalizer = NORMALIZERS.get(field_type)
+    if normalizer is None:
+        return None
+
+    # Tolerate a sentence-ending period ("jane@acme.com.")
+    value = user_response.strip().rstrip(".").strip()
+    if not value or len(value) > 100:
+        return None
+
+    return normalizer(value)
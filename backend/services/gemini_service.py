@@ -1,5 +1,6 @@
-import google.generativeai as genai
 from config import settings
+from services.llm_client import llm_client
+from services.template_cache import template_cache
 from typing import List, Dict, Optional, Tuple
 import json
 import re
@@ -7,14 +8,21 @@ import re
 
 class GeminiService:
     def __init__(self):
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
+        self.model = 'gemini-2.5-flash'
 
-    def extract_placeholders(self, document_content: str) -> List[Dict[str, any]]:
+    async def extract_placeholders(self, document_content: str) -> List[Dict[str, any]]:
         """
         Extract placeholders from document content using Gemini.
         Returns list of fields with name, placeholder, type, suggested order, and occurrence_index.
+
+        Results are cached by template fingerprint, so known templates skip the Gemini call.
         """
+        fingerprint = template_cache.fingerprint(document_content)
+        cached_fields = await template_cache.get(fingerprint)
+        if cached_fields:
+            print(f"✓ Template cache hit ({len(cached_fields)} fields)")
+            return cached_fields
+
         prompt = f"""You are an expert legal document analyzer. Analyze the following document and identify ALL placeholders that need to be filled in.
 
 Document:
@@ -45,21 +53,22 @@ IMPORTANT:
 - Use proper field types (date for dates, email for emails, etc.)
 """
 
+        response_text = ""
         try:
-            response = self.model.generate_content(prompt)
-            response_text = response.text.strip()
-
-            # Extract JSON from response (handle markdown code blocks)
-            json_match = re.search(r'```json\s*(.*?)\s*```', response_text, re.DOTALL)
-            if json_match:
-                response_text = json_match.group(1)
-            elif response_text.startswith('```'):
-                response_text = re.sub(r'```\w*\s*', '', response_text)
-                response_text = response_text.rstrip('`').strip()
-
-            fields = json.loads(response_text)
+            response_text = await llm_client.generate(
+                self.model,
+                prompt,
+                timeout=settings.PLACEHOLDER_EXTRACTION_TIMEOUT_SECONDS
+            )
+
+            fields = self._parse_json_response(response_text)
             # Add occurrence tracking for duplicate placeholders
-            return self._add_occurrence_indices(fields)
+            fields = self._add_occurrence_indices(fields)
+
+            # Only cache model results; regex fallbacks are retried on the next upload
+            if fields:
+                await template_cache.put(fingerprint, fields)
+            return fields
 
         except json.JSONDecodeError as e:
             print(f"Error parsing Gemini response: {e}")
@@ -70,6 +79,17 @@ IMPORTANT:
             print(f"Error extracting placeholders: {e}")
             return self._fallback_placeholder_extraction(document_content)
 
+    def _parse_json_response(self, response_text: str):
+        """Parse JSON from a model response (handles markdown code blocks)"""
+        json_match = re.search(r'```json\s*(.*?)\s*```', response_text, re.DOTALL)
+        if json_match:
+            response_text = json_match.group(1)
+        elif response_text.startswith('```'):
+            response_text = re.sub(r'```\w*\s*', '', response_text)
+            response_text = response_text.rstrip('`').strip()
+
+        return json.loads(response_text)
+
     def _fallback_placeholder_extraction(self, document_content: str) -> List[Dict[str, any]]:
         """Fallback method to extract placeholders using regex"""
         placeholders = []
@@ -137,7 +157,7 @@ IMPORTANT:
 
         return fields
 
-    def generate_question_for_field(self, field_name: str, field_type: str,
+    async def generate_question_for_field(self, field_name: str, field_type: str,
                                     placeholder: str, document_context: str = "") -> str:
         """
         Generate a conversational question to ask the user for a field value.
@@ -161,8 +181,7 @@ Return ONLY the question text, nothing else.
 """
 
         try:
-            response = self.model.generate_content(prompt)
-            question = response.text.strip()
+            question = await llm_client.generate(self.model, prompt)
             # Remove quotes if present
             question = question.strip('"\'')
             return question
@@ -171,6 +190,72 @@ Return ONLY the question text, nothing else.
             # Fallback to simple question
             return self._fallback_question(field_name, field_type)
 
+    async def generate_questions_for_fields(self, fields: List[Dict[str, any]],
+                                            contexts: List[str]) -> List[Optional[str]]:
+        """
+        Generate first-attempt questions for all fields in one batched call.
+        Returns one question per field (None where the model gave no usable question);
+        an empty list if the call fails, so callers fall back to on-demand generation.
+        """
+        if not fields:
+            return []
+
+        entries = [
+            {
+                "index": index,
+                "name": field["name"],
+                "type": field.get("type", "text"),
+                "placeholder": field["placeholder"],
+                "context": context[:300],
+            }
+            for index, (field, context) in enumerate(zip(fields, contexts))
+        ]
+
+        prompt = f"""You are a friendly AI assistant helping someone fill out a legal document.
+
+For EACH field below, write the question you would ask the user to get its value.
+
+Fields (with nearby text from the document as context):
+{json.dumps(entries, indent=2)}
+
+Each question should:
+1. Be friendly and natural (like a helpful assistant, not a form)
+2. Clearly explain what information is needed
+3. Include format hints if relevant (e.g., "MM/DD/YYYY" for dates)
+4. Be concise (1-2 sentences maximum)
+
+Return your response as a JSON array with exactly one entry per field:
+[
+  {{"index": 0, "question": "..."}}
+]
+
+IMPORTANT:
+- Only return valid JSON, no additional text
+- Use the same index values as the input
+"""
+
+        response_text = ""
+        try:
+            response_text = await llm_client.generate(
+                self.model,
+                prompt,
+                timeout=settings.PLACEHOLDER_EXTRACTION_TIMEOUT_SECONDS
+            )
+            items = self._parse_json_response(response_text)
+        except Exception as e:
+            print(f"⚠ Question bank generation failed: {e}")
+            return []
+
+        questions: List[Optional[str]] = [None] * len(fields)
+        for item in items if isinstance(items, list) else []:
+            if not isinstance(item, dict):
+                continue
+            index = item.get("index")
+            question = item.get("question")
+            if isinstance(index, int) and 0 <= index < len(fields) and isinstance(question, str):
+                questions[index] = question.strip().strip('"\'') or None
+        return questions
+
     def _fallback_question(self, field_name: str, field_type: str) -> str:
         """Fallback method to generate a simple question"""
         type_hints = {
@@ -0,0 +1,209 @@
+"""
+Persistent job queue for document processing, backed by the processing_tasks table
+"""
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+from config import settings
+from utils.database import db
+from utils.metrics import metrics
+from services.document_service import document_service
+import asyncio
+import os
+import socket
+import time
+import uuid
+
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+class JobQueue:
+    """
+    Runs processing_tasks rows with a bounded pool of workers per process.
+
+    - enqueue() only inserts a pending task, so uploads return immediately and bursts
+      wait in the table instead of piling onto the event loop
+    - At most `concurrency` tasks run at once per process, leaving headroom for chat requests
+    - Tasks are leased atomically (lease_processing_tasks RPC), so several processes can
+      share the queue; a running task renews its lease every lease_seconds / 3, and is
+      cancelled if the lease was lost (outcomes are only recorded while holding it)
+    - A task whose worker crashed is leased again once its lease expires
+    - Failed tasks are retried with exponential backoff until max_attempts is reached; then
+      the task type's on_failure hook runs (e.g. to mark the document as errored)
+    """
+
+    def __init__(self, concurrency: int, poll_interval_seconds: float, lease_seconds: int,
+                 retry_base_seconds: float):
+        self.concurrency = max(1, concurrency)
+        self.poll_interval_seconds = poll_interval_seconds
+        self.lease_seconds = lease_seconds
+        self.retry_base_seconds = retry_base_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._handlers: Dict[str, JobHandler] = {}
+        self._failure_hooks: Dict[str, JobHandler] = {}
+        self._running: Set[asyncio.Task] = set()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, task_type: str, handler: JobHandler, on_failure: Optional[JobHandler] = None):
+        """
+        Set the coroutine function that runs tasks of `task_type` (it receives the task row),
+        and optionally one called with the task row once it has failed for the last time
+        """
+        self._handlers[task_type] = handler
+        if on_failure is not None:
+            self._failure_hooks[task_type] = on_failure
+
+    async def enqueue(self, document_id: str, task_type: str) -> Dict[str, Any]:
+        """Queue a task for a document; it starts as soon as a worker slot is free"""
+        task = await db.create_processing_task(document_id, task_type)
+        metrics.increment("jobs.enqueued")
+        self._wakeup.set()
+        return task
+
+    def start(self):
+        """Start leasing tasks (call from the app's startup event)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            print(f"✓ Job queue worker {self.worker_id} started ({self.concurrency} slots)")
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            free_slots = self.concurrency - len(self._running)
+            if free_slots > 0:
+                try:
+                    leased = await db.lease_processing_tasks(self.worker_id, free_slots, self.lease_seconds)
+                except Exception as e:
+                    print(f"⚠ Failed to lease processing tasks: {e}")
+                    leased = []
+
+                for task in leased:
+                    runner = asyncio.create_task(self._execute(task))
+                    self._running.add(runner)
+                    runner.add_done_callback(self._on_task_done)
+
+            # Woken early by enqueue() or by a finished task freeing a slot
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    def _on_task_done(self, runner: asyncio.Task):
+        self._running.discard(runner)
+        self._wakeup.set()
+
+    async def _heartbeat(self, task_id: str, work: asyncio.Task):
+        """Renew the lease while the task runs; stop the work if another worker has taken it over"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                renewed = await db.renew_processing_task_lease(task_id, self.worker_id, self.lease_seconds)
+            except Exception as e:
+                print(f"⚠ Failed to renew lease on processing task {task_id}: {e}")
+                continue
+            if not renewed:
+                metrics.increment("jobs.lease_lost")
+                print(f"⚠ Lost the lease on processing task {task_id}, stopping it")
+                work.cancel()
+                return
+
+    async def _execute(self, task: Dict[str, Any]):
+        task_id = task["id"]
+        task_type = task["task_type"]
+        attempts = task.get("attempts") or 1
+        max_attempts = task.get("max_attempts") or settings.JOB_MAX_ATTEMPTS
+
+        async def run_handler():
+            handler = self._handlers.get(task_type)
+            if handler is None:
+                raise Exception(f"No handler registered for task type '{task_type}'")
+            await handler(task)
+
+        # The handler runs as its own task so the heartbeat can cancel it on losing the lease
+        work = asyncio.create_task(run_handler())
+        heartbeat = asyncio.create_task(self._heartbeat(task_id, work))
+        started = time.monotonic()
+        try:
+            await work
+
+        except asyncio.CancelledError:
+            if heartbeat.done() and not heartbeat.cancelled():
+                # The lease expired and the task was leased again: its new worker records the outcome
+                return
+            # Shutting down: hand the task back right away instead of waiting for the lease to expire
+            try:
+                await db.retry_processing_task(task_id, self.worker_id, datetime.utcnow(), "Worker shut down")
+            except Exception as e:
+                print(f"⚠ Failed to release processing task {task_id}: {e}")
+            raise
+
+        except Exception as e:
+            if attempts >= max_attempts:
+                metrics.increment("jobs.failed")
+                print(f"⚠ Processing task {task_id} ({task_type}) failed after {attempts} attempts: {e}")
+                recorded = await self._record(
+                    db.update_processing_task(task_id, self.worker_id, "failed", str(e)), task_id
+                )
+                on_failure = self._failure_hooks.get(task_type)
+                if recorded and on_failure is not None:
+                    await self._record(on_failure(task), task_id)
+            else:
+                delay = self.retry_base_seconds * 2 ** (attempts - 1)
+                metrics.increment("jobs.retried")
+                print(f"⚠ Processing task {task_id} ({task_type}) attempt {attempts} failed, retrying in {delay:.0f}s: {e}")
+                run_after = datetime.utcnow() + timedelta(seconds=delay)
+                await self._record(db.retry_processing_task(task_id, self.worker_id, run_after, str(e)), task_id)
+
+        else:
+            metrics.increment("jobs.completed")
+            await self._record(db.update_processing_task(task_id, self.worker_id, "completed"), task_id)
+
+        finally:
+            heartbeat.cancel()
+            metrics.observe(f"jobs.{task_type}.duration", time.monotonic() - started)
+
+    @staticmethod
+    async def _record(update: Awaitable, task_id: str) -> Any:
+        """
+        Persist a task outcome and return the result; None if this fails (the lease expires and
+        the task is picked up again). Task updates also return None once the lease is lost.
+        """
+        try:
+            return await update
+        except Exception as e:
+            print(f"⚠ Failed to record outcome of processing task {task_id}: {e}")
+            return None
+
+    async def close(self):
+        """Stop leasing and release the tasks still running (call from the app's shutdown event)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        running = list(self._running)
+        for runner in running:
+            runner.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """Worker state for monitoring"""
+        return {"worker_id": self.worker_id, "running": len(self._running), "concurrency": self.concurrency}
+
+
+# Singleton instance
+job_queue = JobQueue(
+    concurrency=settings.JOB_WORKER_CONCURRENCY,
+    poll_interval_seconds=settings.JOB_POLL_INTERVAL_SECONDS,
+    lease_seconds=settings.JOB_LEASE_SECONDS,
+    retry_base_seconds=settings.JOB_RETRY_BASE_SECONDS,
+)
+job_queue.register(
+    "process_document",
+    document_service.run_processing_task,
+    on_failure=document_service.mark_processing_failed,
+)
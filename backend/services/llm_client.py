@@ -0,0 +1,107 @@
+"""
+Async Gemini client shared by every LLM call on the request path
+"""
+import asyncio
+import time
+from typing import AsyncIterator, Dict, Optional
+import google.generativeai as genai
+from config import settings
+from utils.metrics import metrics
+
+
+class LLMClient:
+    """
+    Thin async layer over google.generativeai.
+
+    - Uses the SDK's native async API so a slow Gemini round trip never blocks the event loop
+    - Bounds the number of in-flight calls per worker with a semaphore
+    - Enforces a per-call deadline (raises asyncio.TimeoutError when exceeded)
+    - Streams completions chunk by chunk, recording time-to-first-token in metrics
+    """
+
+    def __init__(self):
+        genai.configure(api_key=settings.GEMINI_API_KEY)
+        self._models: Dict[str, genai.GenerativeModel] = {}
+        self._semaphore = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+
+    def get_model(self, model_name: str) -> genai.GenerativeModel:
+        """Return a cached GenerativeModel instance for the given model name"""
+        model = self._models.get(model_name)
+        if model is None:
+            model = genai.GenerativeModel(model_name)
+            self._models[model_name] = model
+        return model
+
+    async def generate(
+        self,
+        model_name: str,
+        prompt: str,
+        generation_config: Optional[genai.types.GenerationConfig] = None,
+        timeout: Optional[float] = None
+    ) -> str:
+        """Generate a completion and return its stripped text, failing after `timeout` seconds"""
+        timeout = timeout or settings.LLM_TIMEOUT_SECONDS
+        model = self.get_model(model_name)
+
+        async with self._semaphore:
+            started = time.monotonic()
+            response = await asyncio.wait_for(
+                model.generate_content_async(
+                    prompt,
+                    generation_config=generation_config,
+                    request_options={"timeout": timeout}
+                ),
+                timeout=timeout
+            )
+            metrics.observe(f"llm.{model_name}.latency", time.monotonic() - started)
+        return response.text.strip()
+
+    async def stream(
+        self,
+        model_name: str,
+        prompt: str,
+        generation_config: Optional[genai.types.GenerationConfig] = None,
+        timeout: Optional[float] = None
+    ) -> AsyncIterator[str]:
+        """Yield text chunks as Gemini produces them; the deadline covers the whole stream"""
+        timeout = timeout or settings.LLM_TIMEOUT_SECONDS
+        model = self.get_model(model_name)
+
+        async with self._semaphore:
+            started = time.monotonic()
+            deadline = started + timeout
+            response = await asyncio.wait_for(
+                model.generate_content_async(
+                    prompt,
+                    generation_config=generation_config,
+                    stream=True,
+                    request_options={"timeout": timeout}
+                ),
+                timeout=timeout
+            )
+
+            chunks = response.__aiter__()
+            first_token = True
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout=deadline - time.monotonic())
+                except StopAsyncIteration:
+                    break
+
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks without text parts (e.g. the final finish_reason chunk)
+                    continue
+                if not text:
+                    continue
+                if first_token:
+                    metrics.observe(f"llm.{model_name}.time_to_first_token", time.monotonic() - started)
+                    first_token = False
+                yield text
+
+            metrics.observe(f"llm.{model_name}.stream_duration", time.monotonic() - started)
+
+
+# Singleton instance
+llm_client = LLMClient()
@@ -0,0 +1,132 @@
+"""
+Per-document HTML preview cache with version-based invalidation
+"""
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+from docx_engine.compiled_template import CompiledTemplate
+from config import settings
+import threading
+
+
+class PreviewEntry:
+    """
+    Cached preview state for one document (treated as immutable; re-renders create a new entry).
+
+    base_html/template never change for a document (the original .docx is immutable);
+    fields/spans (and html, once rendered) are valid only while `version` matches the
+    document's current version. html is None when only the spans were rebuilt
+    (incremental delta requests); the full render is produced when a preview needs it.
+
+    For incremental updates, `span_versions` records the version at which each field's
+    span (field id -> span HTML) last changed. Changes are known for every version since
+    `base_version`, the first render made with this template.
+    """
+
+    __slots__ = ("base_html", "template", "version", "html", "fields",
+                 "spans", "span_versions", "base_version")
+
+    def __init__(self, base_html: str, template: CompiledTemplate, version: Optional[int],
+                 html: Optional[str], fields: List[Dict[str, Any]], spans: Dict[str, str],
+                 previous: Optional["PreviewEntry"] = None):
+        self.base_html = base_html
+        self.template = template
+        self.version = version
+        self.html = html
+        self.fields = fields
+        self.spans = spans
+
+        if previous is not None and previous.template is template and previous.base_version is not None:
+            # Same template: carry the change history forward and stamp spans that differ
+            self.base_version = previous.base_version
+            self.span_versions = {
+                field_id: previous.span_versions.get(field_id, version)
+                if previous.spans.get(field_id) == span else version
+                for field_id, span in spans.items()
+            }
+        else:
+            self.base_version = version
+            self.span_versions = {field_id: version for field_id in spans}
+
+    def changes_since(self, version: int) -> Optional[Dict[str, str]]:
+        """Spans changed after `version`, or None if that version predates the tracked history"""
+        if self.base_version is None or self.version is None:
+            return None
+        if version < self.base_version or version > self.version:
+            return None
+        return {
+            field_id: self.spans[field_id]
+            for field_id, changed_at in self.span_versions.items()
+            if changed_at > version
+        }
+
+    @property
+    def size(self) -> int:
+        """Approximate memory footprint in characters"""
+        return len(self.base_html) + len(self.html or "") + sum(len(span) for span in self.spans.values())
+
+
+class PreviewCache:
+    """LRU of PreviewEntry objects bounded by total size (PREVIEW_CACHE_MAX_BYTES)"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, PreviewEntry]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, document_id: str) -> Optional[PreviewEntry]:
+        """Return the cached entry (may hold a stale render; callers compare versions)"""
+        with self._lock:
+            entry = self._entries.get(document_id)
+            if entry is not None:
+                self._entries.move_to_end(document_id)
+            return entry
+
+    def get_rendered(self, document_id: str, version: Optional[int]) -> Optional[PreviewEntry]:
+        """Return the entry only if it holds a full render current for `version`; counts hits/misses"""
+        entry = self.get(document_id)
+        with self._lock:
+            if entry is not None and entry.html is not None and version is not None and entry.version == version:
+                self.hits += 1
+                return entry
+            self.misses += 1
+            return None
+
+    def put(self, document_id: str, entry: PreviewEntry):
+        """Insert or replace an entry, evicting least recently used entries over the size bound"""
+        with self._lock:
+            previous = self._entries.pop(document_id, None)
+            if previous is not None:
+                self._size -= previous.size
+            self._entries[document_id] = entry
+            self._size += entry.size
+
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.size
+                self.evictions += 1
+
+    def invalidate(self, document_id: str):
+        """Drop a document's cached preview"""
+        with self._lock:
+            entry = self._entries.pop(document_id, None)
+            if entry is not None:
+                self._size -= entry.size
+
+    def stats(self) -> Dict[str, int]:
+        """Cache counters for monitoring"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# Singleton instance
+preview_cache = PreviewCache(settings.PREVIEW_CACHE_MAX_BYTES)
@@ -0,0 +1,94 @@
+"""
+Content-addressed cache of placeholder extraction results for known templates
+"""
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+from utils.database import db
+from config import settings
+import copy
+import hashlib
+import re
+import threading
+
+
+class TemplateCache:
+    """
+    Two-tier cache mapping a template fingerprint to its extracted field list.
+
+    - Memory tier: LRU bounded by TEMPLATE_CACHE_MAX_ENTRIES (least recently used evicted first)
+    - Persistent tier: the template_cache table, so hits survive restarts and are shared by workers
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def fingerprint(text_content: str) -> str:
+        """Hash of the document text with whitespace normalized (so re-saved copies still match)"""
+        normalized = "\n".join(
+            re.sub(r"\s+", " ", line).strip()
+            for line in text_content.splitlines()
+            if line.strip()
+        )
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    def _remember(self, fingerprint: str, fields: List[Dict[str, Any]]):
+        """Insert into the memory tier, evicting the least recently used entries (called with lock held)"""
+        self._entries[fingerprint] = fields
+        self._entries.move_to_end(fingerprint)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, fingerprint: str) -> Optional[List[Dict[str, Any]]]:
+        """Return a copy of the cached field list, or None on a miss"""
+        with self._lock:
+            fields = self._entries.get(fingerprint)
+            if fields is not None:
+                self._entries.move_to_end(fingerprint)
+                self.hits += 1
+                return copy.deepcopy(fields)
+
+        try:
+            fields = await db.get_cached_template(fingerprint)
+        except Exception as e:
+            print(f"⚠ Template cache lookup failed: {e}")
+            fields = None
+
+        with self._lock:
+            if fields is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(fingerprint, fields)
+        return copy.deepcopy(fields)
+
+    async def put(self, fingerprint: str, fields: List[Dict[str, Any]]):
+        """Store a field list in both tiers"""
+        fields = copy.deepcopy(fields)
+        with self._lock:
+            self._remember(fingerprint, fields)
+
+        try:
+            await db.save_cached_template(fingerprint, fields)
+        except Exception as e:
+            print(f"⚠ Failed to persist template cache entry: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        """Cache counters for monitoring"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# Singleton instance
+template_cache = TemplateCache(settings.TEMPLATE_CACHE_MAX_ENTRIES)
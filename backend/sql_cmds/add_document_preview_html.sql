@@ -0,0 +1,10 @@
+-- Migration: Add preview_html column to documents table
+-- The preview base HTML (Mammoth conversion of the original .docx) is produced at upload,
+-- in the same pass that extracts the text, and stored with the document so previews
+-- never download and re-convert the original file.
+-- Run this SQL in your Supabase SQL Editor
+
+ALTER TABLE documents
+ADD COLUMN IF NOT EXISTS preview_html TEXT;
+
+COMMENT ON COLUMN documents.preview_html IS 'Base HTML of the original document (placeholders not yet filled)';
@@ -0,0 +1,63 @@
+-- Migration: Add version column to documents table
+-- The version is bumped whenever a field of the document is created, filled or removed,
+-- so caches (HTML preview, ETags) can tell whether anything user-visible changed.
+-- Run this SQL in your Supabase SQL Editor
+
+ALTER TABLE documents
+ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0;
+
+COMMENT ON COLUMN documents.version IS 'Incremented on every field value/status change (cache validator)';
+
+-- Statement-level triggers: a bulk insert of N fields (create_fields) bumps each affected
+-- document once, not N times. Transition tables can't be combined with several events or
+-- a column list, so there is one trigger per event and updates compare old/new rows.
+CREATE OR REPLACE FUNCTION bump_document_versions()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE documents
+        SET version = version + 1
+        WHERE id IN (SELECT document_id FROM new_fields);
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE documents
+        SET version = version + 1
+        WHERE id IN (SELECT document_id FROM old_fields);
+    ELSE
+        UPDATE documents
+        SET version = version + 1
+        WHERE id IN (
+            SELECT new_fields.document_id
+            FROM new_fields
+            JOIN old_fields ON old_fields.id = new_fields.id
+            WHERE new_fields.value IS DISTINCT FROM old_fields.value
+               OR new_fields.status IS DISTINCT FROM old_fields.status
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Replaces the earlier per-row trigger
+DROP TRIGGER IF EXISTS bump_document_version_on_field_change ON fields;
+DROP FUNCTION IF EXISTS bump_document_version();
+
+DROP TRIGGER IF EXISTS bump_document_version_on_field_insert ON fields;
+CREATE TRIGGER bump_document_version_on_field_insert
+    AFTER INSERT ON fields
+    REFERENCING NEW TABLE AS new_fields
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION bump_document_versions();
+
+DROP TRIGGER IF EXISTS bump_document_version_on_field_update ON fields;
+CREATE TRIGGER bump_document_version_on_field_update
+    AFTER UPDATE ON fields
+    REFERENCING OLD TABLE AS old_fields NEW TABLE AS new_fields
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION bump_document_versions();
+
+DROP TRIGGER IF EXISTS bump_document_version_on_field_delete ON fields;
+CREATE TRIGGER bump_document_version_on_field_delete
+    AFTER DELETE ON fields
+    REFERENCING OLD TABLE AS old_fields
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION bump_document_versions();
@@ -0,0 +1,7 @@
+-- Add question column to fields table
+-- Holds the first-attempt question generated in one batch at ingest (question bank)
+ALTER TABLE fields
+ADD COLUMN IF NOT EXISTS question TEXT;
+
+-- Add comment
+COMMENT ON COLUMN fields.question IS 'Precomputed first-attempt question (NULL = generate on demand)';
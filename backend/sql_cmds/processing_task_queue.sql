@@ -0,0 +1,69 @@
+-- Migration: turn processing_tasks into a persistent job queue
+-- Workers lease runnable tasks with lease_processing_tasks(), renew the lease while they
+-- work, and mark tasks completed, failed, or pending again (with a backoff) for a retry.
+-- A task whose worker crashed is picked up again once its lease expires.
+-- Run this SQL in your Supabase SQL Editor
+
+ALTER TABLE processing_tasks
+ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0,
+ADD COLUMN IF NOT EXISTS max_attempts INTEGER NOT NULL DEFAULT 3,
+ADD COLUMN IF NOT EXISTS run_after TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP WITH TIME ZONE,
+ADD COLUMN IF NOT EXISTS worker_id TEXT;
+
+COMMENT ON COLUMN processing_tasks.attempts IS 'Number of times the task has been leased';
+COMMENT ON COLUMN processing_tasks.run_after IS 'Earliest time the task may run (retry backoff)';
+COMMENT ON COLUMN processing_tasks.lease_expires_at IS 'Running task is considered abandoned after this time';
+COMMENT ON COLUMN processing_tasks.worker_id IS 'Worker currently holding the lease';
+
+CREATE INDEX IF NOT EXISTS idx_processing_tasks_runnable ON processing_tasks(status, run_after);
+
+-- Function: lease_processing_tasks
+-- Atomically claims up to p_limit runnable tasks for a worker:
+--   - pending tasks whose run_after has passed
+--   - running tasks whose lease expired (the worker died) and that have attempts left
+-- Abandoned tasks without attempts left are marked failed, and so is their document.
+-- FOR UPDATE SKIP LOCKED lets any number of workers poll concurrently without
+-- claiming the same task twice.
+CREATE OR REPLACE FUNCTION lease_processing_tasks(
+    p_worker_id TEXT,
+    p_limit INTEGER,
+    p_lease_seconds INTEGER
+)
+RETURNS SETOF processing_tasks AS $$
+BEGIN
+    WITH abandoned AS (
+        UPDATE processing_tasks
+        SET status = 'failed',
+            error_message = COALESCE(error_message, 'Worker lease expired'),
+            lease_expires_at = NULL,
+            completed_at = NOW()
+        WHERE status = 'running'
+          AND lease_expires_at < NOW()
+          AND attempts >= max_attempts
+        RETURNING document_id
+    )
+    UPDATE documents
+    SET status = 'error', updated_at = NOW()
+    WHERE id IN (SELECT document_id FROM abandoned);
+
+    RETURN QUERY
+    UPDATE processing_tasks AS t
+    SET status = 'running',
+        attempts = t.attempts + 1,
+        worker_id = p_worker_id,
+        lease_expires_at = NOW() + make_interval(secs => p_lease_seconds)
+    WHERE t.id IN (
+        SELECT id
+        FROM processing_tasks
+        WHERE (status = 'pending' AND run_after <= NOW())
+           OR (status = 'running' AND lease_expires_at < NOW() AND attempts < max_attempts)
+        ORDER BY run_after
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING t.*;
+END;
+$$ LANGUAGE plpgsql;
+
+GRANT EXECUTE ON FUNCTION lease_processing_tasks(TEXT, INTEGER, INTEGER) TO anon, authenticated, service_role;
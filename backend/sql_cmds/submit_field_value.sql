@@ -0,0 +1,68 @@
+-- Function: submit_field_value
+-- Records a validated field value and advances the document in a single round trip:
+--   1. Stores the value, marks the field filled and resets validation_attempts
+--   2. Moves the document from 'ready' to 'filling', or to 'completed' when no pending fields remain
+--   3. Returns the updated field, the next pending field (or null), the new document status
+--      and filled/total field counts (for progress events)
+-- Run this SQL in your Supabase SQL Editor
+
+CREATE OR REPLACE FUNCTION submit_field_value(
+    p_document_id UUID,
+    p_field_id UUID,
+    p_value TEXT
+)
+RETURNS JSONB AS $$
+DECLARE
+    v_field fields%ROWTYPE;
+    v_next_field fields%ROWTYPE;
+    v_status VARCHAR(50);
+    v_filled INTEGER;
+    v_total INTEGER;
+BEGIN
+    UPDATE fields
+    SET value = p_value,
+        status = 'filled',
+        validation_attempts = 0,
+        updated_at = NOW()
+    WHERE id = p_field_id AND document_id = p_document_id
+    RETURNING * INTO v_field;
+
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Field % not found for document %', p_field_id, p_document_id;
+    END IF;
+
+    SELECT * INTO v_next_field
+    FROM fields
+    WHERE document_id = p_document_id AND status = 'pending'
+    ORDER BY "order"
+    LIMIT 1;
+
+    IF v_next_field.id IS NULL THEN
+        UPDATE documents
+        SET status = 'completed', completed_at = NOW(), updated_at = NOW()
+        WHERE id = p_document_id
+        RETURNING status INTO v_status;
+    ELSE
+        UPDATE documents
+        SET status = CASE WHEN status = 'ready' THEN 'filling' ELSE status END,
+            updated_at = NOW()
+        WHERE id = p_document_id
+        RETURNING status INTO v_status;
+    END IF;
+
+    SELECT COUNT(*) FILTER (WHERE status = 'filled'), COUNT(*)
+    INTO v_filled, v_total
+    FROM fields
+    WHERE document_id = p_document_id;
+
+    RETURN jsonb_build_object(
+        'field', to_jsonb(v_field),
+        'next_field', CASE WHEN v_next_field.id IS NULL THEN NULL ELSE to_jsonb(v_next_field) END,
+        'document_status', v_status,
+        'filled_fields', v_filled,
+        'total_fields', v_total
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+GRANT EXECUTE ON FUNCTION submit_field_value(UUID, UUID, TEXT) TO anon, authenticated, service_role;
@@ -0,0 +1,21 @@
+-- Template cache table
+-- Stores placeholder extraction results keyed by a fingerprint of the document text,
+-- so re-uploads of a known template (SAFE, NDA, ...) skip the Gemini extraction call.
+-- Run this SQL in your Supabase SQL Editor
+
+CREATE TABLE IF NOT EXISTS template_cache (
+    fingerprint CHAR(64) PRIMARY KEY,
+    fields JSONB NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+DROP TRIGGER IF EXISTS update_template_cache_updated_at ON template_cache;
+CREATE TRIGGER update_template_cache_updated_at
+    BEFORE UPDATE ON template_cache
+    FOR EACH ROW
+    EXECUTE FUNCTION update_updated_at_column();
+
+COMMENT ON TABLE template_cache IS 'Placeholder extraction results keyed by normalized document text hash';
+COMMENT ON COLUMN template_cache.fingerprint IS 'SHA-256 of the whitespace-normalized extracted text';
+COMMENT ON COLUMN template_cache.fields IS 'Field list as returned by GeminiService.extract_placeholders';
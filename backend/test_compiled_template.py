@@ -0,0 +1,79 @@
+from docx import Document
+import io
+from docx_engine.compiled_template import CompiledDocx, CompiledTemplate
+from docx_engine.conversions import render_completed_docx
+from services.document_service import document_service
+
+
+def make_template() -> bytes:
+    """[COMPANY] in two body paragraphs and a table cell, [DATE] in a paragraph and a cell"""
+    doc = Document()
+    doc.add_paragraph("[COMPANY] shall pay the Purchase Amount on [DATE].")
+    doc.add_paragraph("Signed: [COMPANY]")
+    table = doc.add_table(rows=1, cols=2)
+    table.cell(0, 0).text = "[COMPANY]"
+    table.cell(0, 1).text = "Dated [DATE]"
+    output = io.BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+
+def field(placeholder, occurrence_index, value):
+    return {"id": f"{placeholder}{occurrence_index}", "placeholder": placeholder,
+            "occurrence_index": occurrence_index, "value": value}
+
+
+def render(fields) -> list:
+    output = render_completed_docx(
+        make_template(),
+        [f["placeholder"] for f in fields],
+        document_service.build_value_replacements(fields),
+    )
+    doc = Document(io.BytesIO(output))
+    cells = [cell.text for row in doc.tables[0].rows for cell in row.cells]
+    return [paragraph.text for paragraph in doc.paragraphs] + cells
+
+
+def test_occurrences_are_counted_across_paragraphs_and_cells():
+    doc = Document(io.BytesIO(make_template()))
+    compiled = CompiledDocx(doc, ["[COMPANY]", "[DATE]"])
+    slots = [(placeholder, index) for _, template in compiled.paragraphs for placeholder, index, _, _ in template.slots]
+    assert slots == [("[COMPANY]", 0), ("[DATE]", 0), ("[COMPANY]", 1), ("[COMPANY]", 2), ("[DATE]", 1)]
+
+
+def test_single_field_fills_every_occurrence():
+    # One field per distinct placeholder, as the regex fallback extraction produces
+    fields = [field("[COMPANY]", 0, "Acme Inc."), field("[DATE]", 0, "June 10, 2025")]
+    assert render(fields) == [
+        "Acme Inc. shall pay the Purchase Amount on June 10, 2025.",
+        "Signed: Acme Inc.",
+        "Acme Inc.",
+        "Dated June 10, 2025",
+    ]
+
+
+def test_one_field_per_occurrence_fills_its_own_slot():
+    fields = [
+        field("[COMPANY]", 0, "Acme Inc."),
+        field("[COMPANY]", 1, "Jane Doe"),
+        field("[COMPANY]", 2, "Acme Holdings LLC"),
+        field("[DATE]", 0, "June 10, 2025"),
+        field("[DATE]", 1, None),
+    ]
+    assert render(fields) == [
+        "Acme Inc. shall pay the Purchase Amount on June 10, 2025.",
+        "Signed: Jane Doe",
+        "Acme Holdings LLC",
+        "Dated [DATE]",
+    ]
+
+
+def test_unfilled_single_field_leaves_every_occurrence():
+    fields = [field("[COMPANY]", 0, None), field("[DATE]", 0, "June 10, 2025")]
+    assert render(fields)[1:3] == ["Signed: [COMPANY]", "[COMPANY]"]
+
+
+def test_text_template_fills_all_occurrences_of_a_single_field():
+    template = CompiledTemplate("[A] and [A], then [B]", ["[A]", "[B]"])
+    assert template.render({("[A]", None): "x", ("[B]", 0): "y"}) == "x and x, then y"
+    assert template.render({("[A]", None): "x", ("[A]", 1): "z"}) == "x and z, then [B]"
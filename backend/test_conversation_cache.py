@@ -0,0 +1,249 @@
+import asyncio
+import time
+import pytest
+from services.conversation_cache import (
+    ConversationCacheBackend, InProcessConversationCache, RedisConversationCache
+)
+from services.conversation_memory import ConversationMemory
+from services.conversation_service import conversation_service
+from services.llm_client import llm_client
+import services.conversation_service as conversation_service_module
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+needs_fakeredis = pytest.mark.skipif(fakeredis is None, reason="fakeredis not installed")
+
+
+TOKEN_BUDGET = 1000
+
+
+def make_memory(*turns) -> ConversationMemory:
+    memory = ConversationMemory(TOKEN_BUDGET)
+    for index, (role, content) in enumerate(turns):
+        memory.add_message(role, content, f"2025-01-01T00:00:{index:02d}")
+    return memory
+
+
+def in_process_cache(**overrides) -> InProcessConversationCache:
+    options = {"max_entries": 100, "max_bytes": 1024 * 1024, "ttl_seconds": 60, "shards": 4}
+    options.update(overrides)
+    return InProcessConversationCache(**options)
+
+
+def redis_cache(server, token_budget: int = TOKEN_BUDGET) -> RedisConversationCache:
+    client = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+    return RedisConversationCache("redis://unused", ttl_seconds=60, token_budget=token_budget, client=client)
+
+
+def backends():
+    """One fresh instance of every available backend"""
+    available = [in_process_cache()]
+    if fakeredis is not None:
+        available.append(redis_cache(fakeredis.FakeServer()))
+    return available
+
+
+def history(memory: ConversationMemory):
+    return [(message.role, message.content) for message in memory.messages]
+
+
+# Behaviour every backend must provide
+
+def test_backend_interface_is_abstract():
+    class Incomplete(ConversationCacheBackend):
+        async def get(self, document_id):
+            return None
+
+    try:
+        Incomplete()
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("a backend missing methods must not be instantiable")
+
+
+def test_miss_put_get_roundtrip():
+    async def run(cache):
+        assert await cache.get("doc") is None
+        memory = make_memory(("ai", "What is the company name?"), ("human", "Acme Inc."))
+        memory.summary = "Earlier: the user is the founder."
+        memory.summary_until = "2024-12-31T00:00:00"
+        await cache.put("doc", memory)
+
+        cached = await cache.get("doc")
+        assert history(cached) == [("ai", "What is the company name?"), ("human", "Acme Inc.")]
+        assert cached.summary == "Earlier: the user is the founder."
+        assert cached.summary_until == "2024-12-31T00:00:00"
+
+    for cache in backends():
+        asyncio.run(run(cache))
+
+
+def test_append_save_summary_and_invalidate():
+    async def run(cache):
+        memory = make_memory(("ai", "Question one?"))
+        await cache.put("doc", memory)
+
+        memory.add_message("human", "Answer one", "2025-01-01T00:01:00")
+        await cache.append("doc", memory, "human", "Answer one", "2025-01-01T00:01:00")
+        assert history(await cache.get("doc")) == [("ai", "Question one?"), ("human", "Answer one")]
+
+        memory.summary = "Summary so far"
+        await cache.save_summary("doc", memory)
+        assert (await cache.get("doc")).summary == "Summary so far"
+
+        await cache.invalidate("doc")
+        assert await cache.get("doc") is None
+        assert (await cache.stats())["misses"] == 1
+
+    for cache in backends():
+        asyncio.run(run(cache))
+
+
+# In-process backend
+
+def test_in_process_evicts_least_recently_used():
+    async def run():
+        cache = in_process_cache(max_entries=2, shards=1)
+        await cache.put("a", make_memory(("ai", "a")))
+        await cache.put("b", make_memory(("ai", "b")))
+        await cache.get("a")
+        await cache.put("c", make_memory(("ai", "c")))
+
+        assert await cache.get("b") is None
+        assert await cache.get("a") is not None
+        assert (await cache.stats())["evictions"] == 1
+
+    asyncio.run(run())
+
+
+def test_in_process_expiry_and_sweep():
+    async def run():
+        cache = in_process_cache(ttl_seconds=0.01)
+        await cache.put("a", make_memory(("ai", "a")))
+        await cache.put("b", make_memory(("ai", "b")))
+        time.sleep(0.02)
+
+        assert await cache.get("a") is None
+        assert cache.sweep() == 1
+        assert (await cache.stats())["size"] == 0
+
+    asyncio.run(run())
+
+
+# Redis backend
+
+@needs_fakeredis
+def test_redis_workers_share_appends():
+    async def run():
+        server = fakeredis.FakeServer()
+        worker_a, worker_b = redis_cache(server), redis_cache(server)
+
+        memory = make_memory(("ai", "Question one?"))
+        await worker_a.put("doc", memory)
+        # Each worker appends to its own copy; neither overwrites the other's turn
+        memory.add_message("human", "Answer one", "2025-01-01T00:01:00")
+        await worker_a.append("doc", memory, "human", "Answer one", "2025-01-01T00:01:00")
+        other = await worker_b.get("doc")
+        other.add_message("ai", "Question two?", "2025-01-01T00:02:00")
+        await worker_b.append("doc", other, "ai", "Question two?", "2025-01-01T00:02:00")
+
+        assert history(await worker_a.get("doc")) == [
+            ("ai", "Question one?"), ("human", "Answer one"), ("ai", "Question two?")
+        ]
+
+    asyncio.run(run())
+
+
+@needs_fakeredis
+def test_redis_trims_to_capacity_and_skips_summarized_messages():
+    async def run():
+        cache = redis_cache(fakeredis.FakeServer())
+        memory = ConversationMemory(TOKEN_BUDGET, capacity=3)
+        await cache.put("doc", memory)
+        for index in range(5):
+            created_at = f"2025-01-01T00:00:{index:02d}"
+            memory.add_message("human", f"message {index}", created_at)
+            await cache.append("doc", memory, "human", f"message {index}", created_at)
+
+        assert [content for _, content in history(await cache.get("doc"))] == ["message 2", "message 3", "message 4"]
+
+        memory.summary = "Messages 0-3 summarized"
+        memory.summary_until = "2025-01-01T00:00:03"
+        await cache.save_summary("doc", memory)
+        assert [content for _, content in history(await cache.get("doc"))] == ["message 4"]
+
+    asyncio.run(run())
+
+
+@needs_fakeredis
+def test_redis_errors_are_misses():
+    async def run():
+        server = fakeredis.FakeServer()
+        cache = redis_cache(server)
+        await cache.put("doc", make_memory(("ai", "Question?")))
+        server.connected = False
+
+        assert await cache.get("doc") is None
+        assert (await cache.stats())["errors"] == 1
+
+    asyncio.run(run())
+
+
+@needs_fakeredis
+def test_redis_fold_claim_is_shared_by_workers():
+    async def run():
+        server = fakeredis.FakeServer()
+        worker_a, worker_b = redis_cache(server), redis_cache(server)
+        await worker_a.put("doc", make_memory(("ai", "Question?")))
+        memory_a, memory_b = await worker_a.get("doc"), await worker_b.get("doc")
+
+        assert await worker_a.claim_fold("doc", memory_a)
+        assert not await worker_b.claim_fold("doc", memory_b)
+        assert 0 < await worker_a._client.ttl("conversation:doc:fold") <= worker_a.fold_lock_seconds
+
+        # Worker a's fold lands; b's copy was read before it and must not fold the same turns
+        memory_a.summary, memory_a.summary_until = "Summary", "2025-01-01T00:00:00"
+        await worker_a.save_summary("doc", memory_a)
+        await worker_a.release_fold("doc")
+        assert not await worker_b.claim_fold("doc", memory_b)
+        assert await worker_b.claim_fold("doc", await worker_b.get("doc"))
+
+    asyncio.run(run())
+
+
+@needs_fakeredis
+def test_redis_concurrent_requests_fold_once(monkeypatch):
+    prompts, inserted = [], []
+
+    async def generate(model, prompt, generation_config=None):
+        prompts.append(prompt)
+        await asyncio.sleep(0.05)
+        return "The user is the founder of Acme Inc."
+
+    class FakeDatabase:
+        async def insert_conversation_message(self, document_id, message_type, content, metadata=None):
+            inserted.append((message_type, content))
+
+    async def run():
+        # A small budget, so most of the turns no longer fit and have to be folded
+        cache = redis_cache(fakeredis.FakeServer(), token_budget=20)
+        monkeypatch.setattr(conversation_service_module, "conversation_cache", cache)
+        await cache.put("doc", make_memory(*[("human", f"Answer number {index} to the question") for index in range(6)]))
+
+        # Two requests (on any workers) each build their own copy of the memory
+        first, second = await cache.get("doc"), await cache.get("doc")
+        assert first.needs_fold() and second.needs_fold()
+        await asyncio.gather(
+            conversation_service._fold_into_summary(FakeDatabase(), "doc", first),
+            conversation_service._fold_into_summary(FakeDatabase(), "doc", second),
+        )
+        assert (await cache.get("doc")).summary == "The user is the founder of Acme Inc."
+
+    monkeypatch.setattr(llm_client, "generate", generate)
+    asyncio.run(run())
+    assert len(prompts) == 1
+    assert inserted == [("system", "The user is the founder of Acme Inc.")]
@@ -0,0 +1,36 @@
+from services.extraction_prompt import build_extraction_prompt, select_rule_sections
+from services.fast_extraction import fast_extract
+
+
+def test_percentages_and_numbers_are_not_sent_the_currency_rules():
+    assert select_rule_sections("percentage", "Discount Rate") == ["percentage", "text"]
+    assert select_rule_sections("number", "Number of Shares") == ["number", "text"]
+
+
+def test_money_named_number_fields_get_amount_rules():
+    assert select_rule_sections("number", "Purchase Amount") == ["amount", "number", "text"]
+    assert select_rule_sections("text", "Legal Fees") == ["amount", "text"]
+    assert select_rule_sections("number", "Total Cost") == ["amount", "number", "text"]
+    assert select_rule_sections("number", "Number of Payments") == ["number", "text"]
+
+
+def test_name_keywords_match_whole_words_only():
+    assert select_rule_sections("text", "Bank Statement") == ["text"]
+    assert select_rule_sections("text", "Candidate Name") == ["text"]
+    assert select_rule_sections("text", "Real Estate Address") == ["address", "text"]
+    assert select_rule_sections("text", "State of Incorporation") == ["jurisdiction", "text"]
+    assert select_rule_sections("text", "Effective Date") == ["date", "text"]
+
+
+def test_prompt_keeps_the_static_prefix_first():
+    prompt, tokens_saved = build_extraction_prompt("Discount Rate", "percentage", "[RATE]", "", "eighty percent")
+    assert "## PERCENTAGES" in prompt
+    assert "$X,XXX,XXX" not in prompt
+    assert prompt.index("OUTPUT INSTRUCTIONS") < prompt.index("Field to extract: Discount Rate")
+    assert tokens_saved > 0
+
+
+def test_fast_path_and_prompt_agree_on_money_fields():
+    for field_name in ("Total Cost", "Legal Fees", "Purchase Price", "Number of Payments", "Cap Table Shares"):
+        is_money = fast_extract("12", "number", field_name) == "$12"
+        assert ("amount" in select_rule_sections("number", field_name)) == is_money, field_name
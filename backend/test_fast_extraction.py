@@ -0,0 +1,76 @@
+from services.fast_extraction import fast_extract, normalize_percentage
+
+
+def test_email_is_lowercased():
+    assert fast_extract("Jane.Doe@Example.COM", "email") == "jane.doe@example.com"
+    assert fast_extract("jane@acme.com.", "email") == "jane@acme.com"
+    assert fast_extract("my email is jane@acme.com", "email") is None
+
+
+def test_phone_keeps_user_formatting():
+    assert fast_extract("(555) 123-4567", "phone") == "(555) 123-4567"
+    assert fast_extract("123-4567", "phone") is None
+
+
+def test_dates_with_spelled_out_month():
+    assert fast_extract("2025-06-10", "date") == "June 10, 2025"
+    assert fast_extract("10th June 2025", "date") == "June 10, 2025"
+    assert fast_extract("June 10, 2025", "date") == "June 10, 2025"
+    # Day/month order is ambiguous without a month name
+    assert fast_extract("10/06/25", "date") is None
+    assert fast_extract("2025-02-30", "date") is None
+
+
+def test_currency():
+    assert fast_extract("$250,000", "currency") == "$250,000"
+    assert fast_extract("500k", "currency") == "$500,000"
+    assert fast_extract("2.5M", "currency") == "$2,500,000"
+    assert fast_extract("1234.5", "currency") == "$1,234.50"
+    assert fast_extract("about 200k", "currency") is None
+
+
+def test_number_fields_named_like_money_are_currency():
+    assert fast_extract("100000", "number", "Purchase Amount") == "$100,000"
+    assert fast_extract("10m", "number", "Post-Money Valuation Cap") == "$10,000,000"
+    assert fast_extract("5000", "number", "Legal Fees") == "$5,000"
+    assert fast_extract("2500", "number", "Total Cost") == "$2,500"
+    assert fast_extract("800", "number", "Monthly Payment") == "$800"
+
+
+def test_amount_keywords_match_whole_words_only():
+    # "cap" inside "Escape", "fee" inside "Feedback", "cost" inside "Costume"
+    assert fast_extract("100", "number", "Escape Period Days") == "100"
+    assert fast_extract("3", "number", "Feedback Rounds") == "3"
+    assert fast_extract("12", "number", "Costume Count") == "12"
+
+
+def test_counts_are_not_money():
+    assert fast_extract("12", "number", "Number of Payments") == "12"
+    assert fast_extract("12", "number", "Number of Installment Payments") == "12"
+    assert fast_extract("12", "number", "# of Payments") == "12"
+    assert fast_extract("3", "number", "Count of Fee Waivers") == "3"
+    assert fast_extract("12", "number", "Cap Table Shares") == "12"
+
+
+def test_numbers():
+    assert fast_extract("1,000,000", "number", "Number of Shares") == "1,000,000"
+    assert fast_extract("1 million", "number", "Number of Shares") is None
+
+
+def test_percentages():
+    assert fast_extract("20%", "percentage") == "20%"
+    assert fast_extract("12.5 percent", "percentage") == "12.5%"
+    assert fast_extract("20", "percentage") == "20%"
+    assert fast_extract("0.5%", "percentage") == "0.5%"
+    # "0.2" may mean 20%: ambiguous, left to the model
+    assert normalize_percentage("0.2") is None
+    assert fast_extract("0.2", "percentage") is None
+    assert fast_extract("eighty percent", "percentage") is None
+
+
+def test_unsupported_types_and_long_answers_go_to_the_model():
+    assert fast_extract("Acme Inc.", "company") is None
+    assert fast_extract("Delaware", "text") is None
+    assert fast_extract("1" * 101, "number") is None
+    assert fast_extract("   ", "email") is None
+
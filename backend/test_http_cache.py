@@ -0,0 +1,88 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from routers import documents_router
+from utils.database import db
+from utils.http_cache import document_etag
+
+
+class FakeDocuments:
+    """The document row and fields the status endpoint reads"""
+
+    def __init__(self):
+        self.document = {"id": "doc", "filename": "safe.docx", "status": "ready", "version": 1}
+        self.field_reads = 0
+
+    def install(self, monkeypatch):
+        monkeypatch.setattr(db, "get_document", self.get_document)
+        monkeypatch.setattr(db, "get_fields", self.get_fields)
+
+    async def get_document(self, document_id):
+        return dict(self.document)
+
+    async def get_fields(self, document_id):
+        self.field_reads += 1
+        return [{"id": "f1", "status": "filled"}, {"id": "f2", "status": "pending"}]
+
+
+def client_for(monkeypatch) -> tuple:
+    documents = FakeDocuments()
+    documents.install(monkeypatch)
+    app = FastAPI()
+    app.include_router(documents_router)
+    return TestClient(app), documents
+
+
+def get_status(client: TestClient, if_none_match=None):
+    headers = {"If-None-Match": if_none_match} if if_none_match is not None else {}
+    return client.get("/api/documents/doc/status", headers=headers)
+
+
+def test_matching_if_none_match_returns_304(monkeypatch):
+    client, documents = client_for(monkeypatch)
+    first = get_status(client)
+    etag = first.headers["ETag"]
+    assert first.status_code == 200
+    assert first.headers["Cache-Control"] == "no-cache"
+
+    second = get_status(client, etag)
+    assert second.status_code == 304
+    assert second.content == b""
+    assert second.headers["ETag"] == etag
+    # The 304 is answered from the document row alone
+    assert documents.field_reads == 1
+
+
+def test_weak_tags_and_tag_lists_match(monkeypatch):
+    client, _ = client_for(monkeypatch)
+    etag = get_status(client).headers["ETag"]
+
+    assert get_status(client, f"W/{etag}").status_code == 304
+    assert get_status(client, f'"stale", W/{etag}').status_code == 304
+    assert get_status(client, '"stale", W/"older"').status_code == 200
+
+
+def test_star_matches_any_representation(monkeypatch):
+    client, _ = client_for(monkeypatch)
+    assert get_status(client, "*").status_code == 304
+
+
+def test_etag_changes_with_the_document_version(monkeypatch):
+    client, documents = client_for(monkeypatch)
+    etag = get_status(client).headers["ETag"]
+
+    documents.document["version"] = 2
+    response = get_status(client, etag)
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json()["status"] == "ready"
+
+
+def test_etag_depends_on_kind_version_status_and_extra_inputs():
+    document = {"id": "doc", "status": "ready", "version": 3}
+    etag = document_etag("fields", document, "safe.docx")
+    assert etag.startswith('"') and etag.endswith('"')
+    assert etag == document_etag("fields", dict(document), "safe.docx")
+    assert etag != document_etag("preview", document, "safe.docx")
+    assert etag != document_etag("fields", {**document, "version": 4}, "safe.docx")
+    assert etag != document_etag("fields", {**document, "status": "completed"}, "safe.docx")
+    assert etag != document_etag("fields", document, "renamed.docx")
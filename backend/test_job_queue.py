@@ -0,0 +1,174 @@
+from datetime import datetime
+import asyncio
+import uuid
+from utils.database import db
+from services.job_queue import JobQueue
+
+
+OTHER_WORKER = "other-host:1:worker"
+
+
+class FakeTaskTable:
+    """processing_tasks rows plus the Database methods the job queue uses"""
+
+    def __init__(self, max_attempts: int):
+        self.max_attempts = max_attempts
+        self.tasks = {}
+
+    def install(self, monkeypatch):
+        monkeypatch.setattr(db, "create_processing_task", self.create)
+        monkeypatch.setattr(db, "lease_processing_tasks", self.lease)
+        monkeypatch.setattr(db, "update_processing_task", self.update)
+        monkeypatch.setattr(db, "retry_processing_task", self.retry)
+        monkeypatch.setattr(db, "renew_processing_task_lease", self.renew)
+
+    async def create(self, document_id, task_type, max_attempts=None):
+        task = {
+            "id": str(uuid.uuid4()), "document_id": document_id, "task_type": task_type,
+            "status": "pending", "attempts": 0, "max_attempts": self.max_attempts,
+            "run_after": datetime.utcnow(),
+        }
+        self.tasks[task["id"]] = task
+        return task
+
+    async def lease(self, worker_id, limit, lease_seconds):
+        leased = []
+        for task in self.tasks.values():
+            if len(leased) < limit and task["status"] == "pending" and task["run_after"] <= datetime.utcnow():
+                task.update(status="running", attempts=task["attempts"] + 1, worker_id=worker_id)
+                leased.append(dict(task))
+        return leased
+
+    def take_over(self, task_id):
+        """The lease expired and another worker leased the task again"""
+        task = self.tasks[task_id]
+        task.update(attempts=task["attempts"] + 1, worker_id=OTHER_WORKER)
+
+    def held_by(self, task_id, worker_id):
+        task = self.tasks[task_id]
+        return task["status"] == "running" and task["worker_id"] == worker_id
+
+    async def update(self, task_id, worker_id, status, error_message=None):
+        if not self.held_by(task_id, worker_id):
+            return None
+        self.tasks[task_id]["status"] = status
+        return dict(self.tasks[task_id])
+
+    async def retry(self, task_id, worker_id, run_after, error_message):
+        if not self.held_by(task_id, worker_id):
+            return None
+        self.tasks[task_id].update(status="pending", run_after=run_after, worker_id=None)
+        return dict(self.tasks[task_id])
+
+    async def renew(self, task_id, worker_id, lease_seconds):
+        return self.held_by(task_id, worker_id)
+
+    def outcomes(self):
+        return {task["document_id"]: (task["status"], task["attempts"]) for task in self.tasks.values()}
+
+
+def run_queue(monkeypatch, table: FakeTaskTable, document_ids, handler, on_failure=None, concurrency=2,
+              seconds=1.0, lease_seconds=3):
+    async def run():
+        queue = JobQueue(concurrency=concurrency, poll_interval_seconds=0.02, lease_seconds=lease_seconds,
+                         retry_base_seconds=0.01)
+        queue.register("process_document", handler, on_failure=on_failure)
+        queue.start()
+        for document_id in document_ids:
+            await queue.enqueue(document_id, "process_document")
+        await asyncio.sleep(seconds)
+        await queue.close()
+
+    table.install(monkeypatch)
+    asyncio.run(run())
+
+
+def test_concurrency_is_bounded(monkeypatch):
+    table = FakeTaskTable(max_attempts=3)
+    running = {"now": 0, "peak": 0}
+
+    async def handler(task):
+        running["now"] += 1
+        running["peak"] = max(running["peak"], running["now"])
+        await asyncio.sleep(0.03)
+        running["now"] -= 1
+
+    run_queue(monkeypatch, table, [f"doc{i}" for i in range(6)], handler, concurrency=2)
+    assert running["peak"] == 2
+    assert all(outcome == ("completed", 1) for outcome in table.outcomes().values())
+
+
+def test_failures_are_retried_then_marked_failed(monkeypatch):
+    table = FakeTaskTable(max_attempts=3)
+    failed = []
+
+    async def handler(task):
+        if task["document_id"] == "flaky" and task["attempts"] < 2:
+            raise Exception("temporary")
+        if task["document_id"] == "broken":
+            raise Exception("permanent")
+
+    async def on_failure(task):
+        failed.append(task["document_id"])
+
+    run_queue(monkeypatch, table, ["flaky", "broken"], handler, on_failure=on_failure)
+    assert table.outcomes() == {"flaky": ("completed", 2), "broken": ("failed", 3)}
+    # The failure hook runs once, after the last attempt only
+    assert failed == ["broken"]
+
+
+def test_failure_hook_runs_for_errors_outside_the_pipeline(monkeypatch):
+    table = FakeTaskTable(max_attempts=2)
+    failed = []
+
+    async def handler(task):
+        raise Exception("could not load the document")
+
+    async def on_failure(task):
+        failed.append(task["document_id"])
+
+    run_queue(monkeypatch, table, ["doc"], handler, on_failure=on_failure)
+    assert table.outcomes() == {"doc": ("failed", 2)}
+    assert failed == ["doc"]
+
+
+def test_losing_the_lease_cancels_the_handler(monkeypatch):
+    table = FakeTaskTable(max_attempts=3)
+    cancelled, failed = [], []
+
+    async def handler(task):
+        table.take_over(task["id"])
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(task["document_id"])
+            raise
+
+    async def on_failure(task):
+        failed.append(task["document_id"])
+
+    # Renewals every 0.1s: the first one finds the task leased by another worker
+    run_queue(monkeypatch, table, ["doc"], handler, on_failure=on_failure, seconds=0.5, lease_seconds=0.3)
+    assert cancelled == ["doc"]
+    # Neither released nor failed: the new owner keeps running it
+    assert table.outcomes() == {"doc": ("running", 2)}
+    assert all(task["worker_id"] == OTHER_WORKER for task in table.tasks.values())
+    assert failed == []
+
+
+def test_stale_worker_does_not_overwrite_the_new_owners_outcome(monkeypatch):
+    table = FakeTaskTable(max_attempts=1)
+    failed = []
+
+    async def handler(task):
+        # Taken over before the next renewal noticed, then finishes or fails anyway
+        table.take_over(task["id"])
+        if task["document_id"] == "fails":
+            raise Exception("permanent")
+
+    async def on_failure(task):
+        failed.append(task["document_id"])
+
+    run_queue(monkeypatch, table, ["finishes", "fails"], handler, on_failure=on_failure, seconds=0.3)
+    assert table.outcomes() == {"finishes": ("running", 2), "fails": ("running", 2)}
+    assert failed == []
@@ -0,0 +1,90 @@
+import asyncio
+import httpx
+from utils.database import db
+from utils.message_writer import MessageWriter
+
+
+def http_error(status_code: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "http://supabase.test/rest/v1/conversation_memory")
+    return httpx.HTTPStatusError("error", request=request, response=httpx.Response(status_code, request=request))
+
+
+class FakeMessageTable:
+    """conversation_memory inserts that fail as told: `reject` rows get a 409, `outages` whole calls a 503"""
+
+    def __init__(self, reject=(), outages=0):
+        self.reject = set(reject)
+        self.outages = outages
+        self.calls = 0
+        self.rows = []
+
+    async def insert(self, rows):
+        self.calls += 1
+        if self.outages:
+            self.outages -= 1
+            raise http_error(503)
+        if any(row["id"] in self.reject for row in rows):
+            raise http_error(409)
+        self.rows.extend(rows)
+
+    def written(self):
+        return [row["id"] for row in self.rows]
+
+
+def row(message_id: str):
+    return {"id": message_id, "document_id": "doc", "message_type": "human", "content": message_id}
+
+
+def run_writer(monkeypatch, table: FakeMessageTable, ids, flushes=1, **options):
+    """Queue rows and flush `flushes` times; returns the rows still queued"""
+    monkeypatch.setattr(db, "insert_conversation_messages", table.insert)
+
+    async def run():
+        # A long interval and large batch keep the background loop out of the way
+        writer = MessageWriter(max_batch=100, interval_seconds=60, **options)
+        for message_id in ids:
+            writer.enqueue(row(message_id))
+        for _ in range(flushes):
+            await writer.flush()
+        pending = [queued["id"] for queued in writer._pending]
+        writer._pending.clear()
+        await writer.close()
+        return pending
+
+    return asyncio.run(run())
+
+
+def test_rejected_row_is_dropped_and_the_rest_written(monkeypatch):
+    table = FakeMessageTable(reject={"m3"})
+    pending = run_writer(monkeypatch, table, ["m1", "m2", "m3", "m4", "m5"])
+    assert pending == []
+    assert sorted(table.written()) == ["m1", "m2", "m4", "m5"]
+
+
+def test_server_error_is_retried_not_dropped(monkeypatch):
+    table = FakeMessageTable(outages=1)
+    pending = run_writer(monkeypatch, table, ["m1", "m2", "m3"])
+    # The failed batch stays queued, in order, for the next flush
+    assert pending == ["m1", "m2", "m3"]
+    assert table.written() == []
+
+    table = FakeMessageTable(outages=1)
+    pending = run_writer(monkeypatch, table, ["m1", "m2", "m3"], flushes=2)
+    assert pending == []
+    assert table.written() == ["m1", "m2", "m3"]
+    assert table.calls == 2
+
+
+def test_batch_out_of_retries_is_split_and_written(monkeypatch):
+    # Fails max_retries times in a row, then the isolating pass writes it
+    table = FakeMessageTable(outages=3)
+    pending = run_writer(monkeypatch, table, ["m1", "m2", "m3", "m4"], flushes=3, max_retries=3)
+    assert pending == []
+    assert sorted(table.written()) == ["m1", "m2", "m3", "m4"]
+
+
+def test_full_queue_drops_new_messages(monkeypatch):
+    table = FakeMessageTable()
+    pending = run_writer(monkeypatch, table, ["m1", "m2", "m3", "m4", "m5"], flushes=0, max_pending=3)
+    # The oldest messages are kept; the ones arriving on a full queue are dropped
+    assert pending == ["m1", "m2", "m3"]
@@ -0,0 +1,117 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from docx_engine.compiled_template import CompiledTemplate
+from routers import documents_router
+from services.preview_cache import PreviewCache, PreviewEntry
+from utils.database import db
+import importlib
+
+# services/__init__ re-exports the document_service singleton under the module's name
+document_service_module = importlib.import_module("services.document_service")
+
+
+BASE_HTML = "<p>[COMPANY] shall pay the Purchase Amount on [DATE].</p><p>Signed: [COMPANY]</p>"
+
+
+def field(field_id: str, placeholder: str, order: int) -> dict:
+    return {"id": field_id, "document_id": "doc", "name": field_id.title(), "placeholder": placeholder,
+            "order": order, "occurrence_index": 0, "value": None, "status": "pending",
+            "created_at": "2025-06-10T00:00:00Z"}
+
+
+class FakeDocument:
+    """A processed document whose fields are filled one at a time (each fill bumps the version)"""
+
+    def __init__(self):
+        self.document = {"id": "doc", "filename": "safe.docx", "status": "ready", "version": 1,
+                         "file_path": "doc/original.docx"}
+        self.fields = [field("company", "[COMPANY]", 0), field("date", "[DATE]", 1)]
+
+    def install(self, monkeypatch):
+        monkeypatch.setattr(db, "get_document", self.get_document)
+        monkeypatch.setattr(db, "get_fields", self.get_fields)
+        monkeypatch.setattr(db, "get_document_preview_html", self.get_document_preview_html)
+        monkeypatch.setattr(document_service_module, "preview_cache", PreviewCache(1024 * 1024))
+
+    def fill(self, field_id, value):
+        for field in self.fields:
+            if field["id"] == field_id:
+                field.update(value=value, status="filled")
+        self.document["version"] += 1
+
+    async def get_document(self, document_id):
+        return dict(self.document)
+
+    async def get_fields(self, document_id):
+        return [dict(field) for field in self.fields]
+
+    async def get_document_preview_html(self, document_id):
+        return BASE_HTML
+
+
+def client_for(monkeypatch) -> tuple:
+    document = FakeDocument()
+    document.install(monkeypatch)
+    app = FastAPI()
+    app.include_router(documents_router)
+    return TestClient(app), document
+
+
+def get_delta(client: TestClient, since: int) -> dict:
+    response = client.get("/api/documents/doc/preview/delta", params={"since": since})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_changes_since_reports_spans_changed_after_a_version():
+    template = CompiledTemplate(BASE_HTML, ["[COMPANY]", "[DATE]"])
+    first = PreviewEntry(BASE_HTML, template, 1, None, [], {"company": "<span>a</span>", "date": "<span>d</span>"})
+    second = PreviewEntry(BASE_HTML, template, 2, None, [], {"company": "<span>b</span>", "date": "<span>d</span>"},
+                          previous=first)
+    third = PreviewEntry(BASE_HTML, template, 3, None, [], {"company": "<span>b</span>", "date": "<span>e</span>"},
+                         previous=second)
+
+    assert third.changes_since(1) == {"company": "<span>b</span>", "date": "<span>e</span>"}
+    assert third.changes_since(2) == {"date": "<span>e</span>"}
+    assert third.changes_since(3) == {}
+    # Before the tracked history, or ahead of it: unknown
+    assert third.changes_since(0) is None
+    assert third.changes_since(4) is None
+
+
+def test_delta_contains_only_the_changed_field_spans(monkeypatch):
+    client, document = client_for(monkeypatch)
+    preview = client.get("/api/documents/doc/preview").json()["content"]
+    assert preview.count('data-field-id="company"') == 2
+
+    document.fill("company", "Acme Inc.")
+    delta = get_delta(client, since=1)
+    assert delta["version"] == 2
+    assert delta["full"] is False
+    assert delta["content"] is None
+    assert list(delta["patches"]) == ["company"]
+    assert 'data-field-id="company"' in delta["patches"]["company"]
+    assert "Acme Inc." in delta["patches"]["company"]
+
+    document.fill("date", "June 10, 2025")
+    assert list(get_delta(client, since=2)["patches"]) == ["date"]
+    assert sorted(get_delta(client, since=1)["patches"]) == ["company", "date"]
+    assert get_delta(client, since=3) == {"version": 3, "full": False, "content": None, "patches": {}}
+
+
+def test_delta_falls_back_to_the_full_preview(monkeypatch):
+    client, document = client_for(monkeypatch)
+    client.get("/api/documents/doc/preview")
+    document.fill("company", "Acme Inc.")
+
+    # Client ahead of the server (e.g. a version from another deployment)
+    ahead = get_delta(client, since=5)
+    assert ahead["full"] is True
+    assert ahead["patches"] == {}
+    assert "Signed: " in ahead["content"] and "Acme Inc." in ahead["content"]
+
+    # Client's version evicted from the history: the cache starts over at the current version
+    document_service_module.preview_cache.invalidate("doc")
+    evicted = get_delta(client, since=1)
+    assert evicted["full"] is True
+    assert evicted["content"].count("Acme Inc.") == 2
@@ -1,3 +1,5 @@
 from .database import db, Database
+from .event_bus import event_bus, EventBus
+from .message_writer import message_writer, MessageWriter
 
-__all__ = ["db", "Database"]
+__all__ = ["db", "Database", "event_bus", "EventBus", "message_writer", "MessageWriter"]
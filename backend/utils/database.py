@@ -1,38 +1,129 @@
-from supabase import create_client, Client
+import httpx
 from config import settings
 from typing import Optional, List, Dict, Any
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
+
+
+# Document columns returned by default: everything except the (large) preview base HTML.
+# version and preview_html come from sql_cmds/ migrations, which must be applied (see README)
+DOCUMENT_COLUMNS = "id,filename,status,file_path,original_content,version,created_at,updated_at,completed_at"
 
 
 class Database:
+    """
+    Async data-access layer over Supabase's REST (PostgREST) and Storage APIs.
+
+    All requests share one keep-alive HTTP/2 connection pool, so DB round trips
+    from concurrent requests overlap instead of blocking the event loop.
+    """
+
     def __init__(self):
-        self.client: Client = create_client(
-            settings.SUPABASE_URL,
-            settings.SUPABASE_KEY
+        self.base_url = settings.SUPABASE_URL.rstrip("/")
+        self.headers = {
+            "apikey": settings.SUPABASE_KEY,
+            "Authorization": f"Bearer {settings.SUPABASE_KEY}",
+        }
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared pooled HTTP client (created lazily on first use)"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.headers,
+                http2=settings.DB_HTTP2,
+                timeout=settings.DB_TIMEOUT_SECONDS,
+                limits=httpx.Limits(
+                    max_connections=settings.DB_POOL_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.DB_POOL_MAX_KEEPALIVE,
+                    keepalive_expiry=settings.DB_POOL_KEEPALIVE_EXPIRY_SECONDS,
+                ),
+            )
+        return self._client
+
+    async def close(self):
+        """Close the connection pool (called on application shutdown)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # Low-level PostgREST helpers
+    async def _select(self, table: str, filters: Dict[str, str], order: Optional[str] = None,
+                      limit: Optional[int] = None, columns: str = "*") -> List[Dict[str, Any]]:
+        params = {"select": columns, **filters}
+        if order:
+            params["order"] = order
+        if limit is not None:
+            params["limit"] = str(limit)
+        response = await self.client.get(f"/rest/v1/{table}", params=params)
+        response.raise_for_status()
+        return response.json()
+
+    async def _insert(self, table: str, rows: Any, upsert: bool = False,
+                      columns: str = "*") -> List[Dict[str, Any]]:
+        prefer = "return=representation"
+        if upsert:
+            prefer += ",resolution=merge-duplicates"
+        response = await self.client.post(
+            f"/rest/v1/{table}",
+            params={"select": columns},
+            json=rows,
+            headers={"Prefer": prefer},
+        )
+        response.raise_for_status()
+        return response.json()
+
+    async def _update(self, table: str, filters: Dict[str, str], data: Dict[str, Any],
+                      columns: str = "*") -> List[Dict[str, Any]]:
+        response = await self.client.patch(
+            f"/rest/v1/{table}",
+            params={"select": columns, **filters},
+            json=data,
+            headers={"Prefer": "return=representation"},
         )
+        response.raise_for_status()
+        return response.json()
+
+    async def _delete(self, table: str, filters: Dict[str, str]):
+        response = await self.client.delete(f"/rest/v1/{table}", params=filters)
+        response.raise_for_status()
+
+    async def _rpc(self, function: str, params: Dict[str, Any]) -> Any:
+        response = await self.client.post(f"/rest/v1/rpc/{function}", json=params)
+        response.raise_for_status()
+        return response.json()
 
     # Document operations
-    def create_document(self, filename: str, file_path: str, original_content: str) -> Dict[str, Any]:
-        """Create a new document record"""
-        document_id = str(uuid.uuid4())
+    async def create_document(self, filename: str, file_path: str, original_content: str,
+                              preview_html: Optional[str] = None,
+                              document_id: Optional[str] = None) -> Dict[str, Any]:
+        """Create a new document record (pass document_id when the file was stored under it already)"""
         data = {
-            "id": document_id,
+            "id": document_id or str(uuid.uuid4()),
             "filename": filename,
             "status": "processing",
             "file_path": file_path,
             "original_content": original_content,
             "created_at": datetime.utcnow().isoformat(),
         }
-        result = self.client.table("documents").insert(data).execute()
-        return result.data[0] if result.data else None
+        if preview_html is not None:
+            data["preview_html"] = preview_html
+        result = await self._insert("documents", data, columns=DOCUMENT_COLUMNS)
+        return result[0] if result else None
 
-    def get_document(self, document_id: str) -> Optional[Dict[str, Any]]:
-        """Get document by ID"""
-        result = self.client.table("documents").select("*").eq("id", document_id).execute()
-        return result.data[0] if result.data else None
+    async def get_document(self, document_id: str) -> Optional[Dict[str, Any]]:
+        """Get document by ID (without preview_html)"""
+        result = await self._select("documents", {"id": f"eq.{document_id}"}, columns=DOCUMENT_COLUMNS)
+        return result[0] if result else None
 
-    def update_document_status(self, document_id: str, status: str) -> Dict[str, Any]:
+    async def get_document_preview_html(self, document_id: str) -> Optional[str]:
+        """Get the preview base HTML stored at upload (None for documents uploaded before it existed)"""
+        result = await self._select("documents", {"id": f"eq.{document_id}"}, columns="preview_html")
+        return result[0]["preview_html"] if result else None
+
+    async def update_document_status(self, document_id: str, status: str) -> Dict[str, Any]:
         """Update document status"""
         data = {
             "status": status,
@@ -41,21 +132,21 @@ class Database:
         if status == "completed":
             data["completed_at"] = datetime.utcnow().isoformat()
 
-        result = self.client.table("documents").update(data).eq("id", document_id).execute()
-        return result.data[0] if result.data else None
+        result = await self._update("documents", {"id": f"eq.{document_id}"}, data, columns=DOCUMENT_COLUMNS)
+        return result[0] if result else None
 
-    def update_document_content(self, document_id: str, content: str) -> Dict[str, Any]:
+    async def update_document_content(self, document_id: str, content: str) -> Dict[str, Any]:
         """Update document content"""
         data = {
             "original_content": content,
             "updated_at": datetime.utcnow().isoformat(),
         }
-        result = self.client.table("documents").update(data).eq("id", document_id).execute()
-        return result.data[0] if result.data else None
+        result = await self._update("documents", {"id": f"eq.{document_id}"}, data, columns=DOCUMENT_COLUMNS)
+        return result[0] if result else None
 
     # Field operations
-    def create_field(self, document_id: str, name: str, placeholder: str,
-                    field_type: str, order: int, occurrence_index: int = 0) -> Dict[str, Any]:
+    async def create_field(self, document_id: str, name: str, placeholder: str,
+                           field_type: str, order: int, occurrence_index: int = 0) -> Dict[str, Any]:
         """Create a new field with occurrence tracking for duplicate placeholders"""
         field_id = str(uuid.uuid4())
         data = {
@@ -69,46 +160,170 @@ class Database:
             "status": "pending",
             "created_at": datetime.utcnow().isoformat(),
         }
-        result = self.client.table("fields").insert(data).execute()
-        return result.data[0] if result.data else None
+        result = await self._insert("fields", data)
+        return result[0] if result else None
+
+    async def create_fields(self, document_id: str, fields: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Bulk-create fields for a document.
+
+        Each entry needs name, placeholder and order (type, occurrence_index and the
+        precomputed question are optional).
+        Rows are sent as one insert per FIELD_INSERT_CHUNK_SIZE fields.
+        """
+        created_at = datetime.utcnow().isoformat()
+        # Bulk inserts need identical keys on every row, so only send the column when it's used
+        with_questions = any(field.get("question") for field in fields)
+        rows = [
+            {
+                "id": str(uuid.uuid4()),
+                "document_id": document_id,
+                "name": field["name"],
+                "placeholder": field["placeholder"],
+                "type": field.get("type", "text"),
+                "order": field["order"],
+                "occurrence_index": field.get("occurrence_index", 0),
+                "status": "pending",
+                "created_at": created_at,
+            }
+            for field in fields
+        ]
+        if with_questions:
+            for row, field in zip(rows, fields):
+                row["question"] = field.get("question")
+
+        created = []
+        chunk_size = settings.FIELD_INSERT_CHUNK_SIZE
+        for start in range(0, len(rows), chunk_size):
+            created.extend(await self._insert("fields", rows[start:start + chunk_size]))
+        return created
 
-    def get_fields(self, document_id: str) -> List[Dict[str, Any]]:
+    async def get_fields(self, document_id: str) -> List[Dict[str, Any]]:
         """Get all fields for a document"""
-        result = self.client.table("fields").select("*").eq("document_id", document_id).order("order").execute()
-        return result.data if result.data else []
+        return await self._select("fields", {"document_id": f"eq.{document_id}"}, order="order.asc")
 
-    def get_field(self, field_id: str) -> Optional[Dict[str, Any]]:
+    async def delete_fields(self, document_id: str):
+        """Delete all fields of a document (e.g. left behind by a failed processing attempt)"""
+        await self._delete("fields", {"document_id": f"eq.{document_id}"})
+
+    async def get_field(self, field_id: str) -> Optional[Dict[str, Any]]:
         """Get field by ID"""
-        result = self.client.table("fields").select("*").eq("id", field_id).execute()
-        return result.data[0] if result.data else None
+        result = await self._select("fields", {"id": f"eq.{field_id}"})
+        return result[0] if result else None
 
-    def update_field_value(self, field_id: str, value: str) -> Dict[str, Any]:
+    async def update_field_value(self, field_id: str, value: str) -> Dict[str, Any]:
         """Update field value"""
         data = {
             "value": value,
             "status": "filled",
             "updated_at": datetime.utcnow().isoformat(),
         }
-        result = self.client.table("fields").update(data).eq("id", field_id).execute()
-        return result.data[0] if result.data else None
+        result = await self._update("fields", {"id": f"eq.{field_id}"}, data)
+        return result[0] if result else None
+
+    async def update_field_validation_attempts(self, field_id: str, validation_attempts: int) -> Dict[str, Any]:
+        """Update the number of validation attempts for a field"""
+        result = await self._update(
+            "fields", {"id": f"eq.{field_id}"}, {"validation_attempts": validation_attempts}
+        )
+        return result[0] if result else None
 
-    def get_next_pending_field(self, document_id: str) -> Optional[Dict[str, Any]]:
-        """Get the next pending field"""
-        result = self.client.table("fields").select("*").eq("document_id", document_id).eq("status", "pending").order("order").limit(1).execute()
-        return result.data[0] if result.data else None
+    async def get_next_pending_field(
+        self,
+        document_id: str,
+        exclude_field_id: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Get the next pending field, optionally skipping one (e.g. the field being submitted)"""
+        filters = {"document_id": f"eq.{document_id}", "status": "eq.pending"}
+        if exclude_field_id:
+            filters["id"] = f"neq.{exclude_field_id}"
+        result = await self._select(
+            "fields",
+            filters,
+            order="order.asc",
+            limit=1,
+        )
+        return result[0] if result else None
+
+    async def submit_field_value(self, document_id: str, field_id: str, value: str) -> Dict[str, Any]:
+        """
+        Record a field value in one round trip (see sql_cmds/submit_field_value.sql).
+
+        Fills the field, resets its validation attempts and advances the document
+        status server-side. Returns {"field", "next_field", "document_status",
+        "filled_fields", "total_fields"}; next_field is None once every field has been filled.
+        """
+        return await self._rpc("submit_field_value", {
+            "p_document_id": document_id,
+            "p_field_id": field_id,
+            "p_value": value,
+        })
+
+    # Conversation memory operations
+    @staticmethod
+    def build_conversation_message(document_id: str, message_type: str, content: str,
+                                   field_id: Optional[str] = None,
+                                   metadata: Optional[Dict[str, Any]] = None,
+                                   created_at: Optional[str] = None) -> Dict[str, Any]:
+        """Build a conversation_memory row (id and created_at generated client-side)"""
+        return {
+            "id": str(uuid.uuid4()),
+            "document_id": document_id,
+            "session_id": document_id,
+            "message_type": message_type,
+            "content": content,
+            "field_id": field_id,
+            "metadata": metadata or {},
+            "created_at": created_at or datetime.utcnow().isoformat(),
+        }
+
+    async def insert_conversation_message(self, document_id: str, message_type: str, content: str,
+                                          field_id: Optional[str] = None,
+                                          metadata: Optional[Dict[str, Any]] = None,
+                                          created_at: Optional[str] = None) -> Dict[str, Any]:
+        """Insert a single message into conversation_memory"""
+        data = self.build_conversation_message(document_id, message_type, content, field_id, metadata, created_at)
+        result = await self._insert("conversation_memory", data)
+        return result[0] if result else None
+
+    async def insert_conversation_messages(self, rows: List[Dict[str, Any]]):
+        """
+        Bulk-insert rows built with build_conversation_message.
+        Upserts on id, so retrying a batch whose response was lost doesn't duplicate messages.
+        """
+        await self._insert("conversation_memory", rows, upsert=True)
+
+    async def get_recent_conversation_messages(self, document_id: str, limit: int) -> List[Dict[str, Any]]:
+        """Get the last `limit` chat messages (no summaries), newest first"""
+        return await self._select(
+            "conversation_memory",
+            {"document_id": f"eq.{document_id}", "message_type": "neq.system"},
+            order="created_at.desc",
+            limit=limit,
+        )
+
+    async def get_latest_conversation_summary(self, document_id: str) -> Optional[Dict[str, Any]]:
+        """Get the newest rolling summary ('system' record) for a document"""
+        result = await self._select(
+            "conversation_memory",
+            {"document_id": f"eq.{document_id}", "message_type": "eq.system"},
+            order="created_at.desc",
+            limit=1,
+        )
+        return result[0] if result else None
 
     # Chat message operations (now using conversation_memory)
-    def get_chat_messages(self, document_id: str) -> List[Dict[str, Any]]:
-        """Get all chat messages for a document from conversation_memory"""
-        result = self.client.table("conversation_memory")\
-            .select("*")\
-            .eq("document_id", document_id)\
-            .order("created_at")\
-            .execute()
-        
+    async def get_chat_messages(self, document_id: str) -> List[Dict[str, Any]]:
+        """Get all chat messages for a document from conversation_memory (summaries excluded)"""
+        records = await self._select(
+            "conversation_memory",
+            {"document_id": f"eq.{document_id}", "message_type": "neq.system"},
+            order="created_at.asc",
+        )
+
         # Map message_type to role for frontend compatibility
         messages = []
-        for record in (result.data if result.data else []):
+        for record in records:
             messages.append({
                 "id": record["id"],
                 "document_id": record["document_id"],
@@ -117,26 +332,46 @@ class Database:
                 "field_id": record.get("field_id"),
                 "timestamp": record["created_at"]  # Use created_at as timestamp
             })
-        
+
         return messages
 
+    # Template cache operations
+    async def get_cached_template(self, fingerprint: str) -> Optional[List[Dict[str, Any]]]:
+        """Get the cached field list for a template fingerprint"""
+        result = await self._select("template_cache", {"fingerprint": f"eq.{fingerprint}"}, columns="fields")
+        return result[0]["fields"] if result else None
+
+    async def save_cached_template(self, fingerprint: str, fields: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Insert or replace the cached field list for a template fingerprint"""
+        data = {
+            "fingerprint": fingerprint,
+            "fields": fields,
+            "updated_at": datetime.utcnow().isoformat(),
+        }
+        result = await self._insert("template_cache", data, upsert=True)
+        return result[0] if result else None
+
     # Processing task operations
-    def create_processing_task(self, document_id: str, task_type: str) -> Dict[str, Any]:
-        """Create a new processing task"""
+    async def create_processing_task(self, document_id: str, task_type: str,
+                                     max_attempts: Optional[int] = None) -> Dict[str, Any]:
+        """Create a new processing task (queued to run immediately)"""
         task_id = str(uuid.uuid4())
+        now = datetime.utcnow().isoformat()
         data = {
             "id": task_id,
             "document_id": document_id,
             "task_type": task_type,
             "status": "pending",
-            "created_at": datetime.utcnow().isoformat(),
+            "max_attempts": max_attempts or settings.JOB_MAX_ATTEMPTS,
+            "run_after": now,
+            "created_at": now,
         }
-        result = self.client.table("processing_tasks").insert(data).execute()
-        return result.data[0] if result.data else None
+        result = await self._insert("processing_tasks", data)
+        return result[0] if result else None
 
-    def update_processing_task(self, task_id: str, status: str,
-                              error_message: Optional[str] = None) -> Dict[str, Any]:
-        """Update processing task status"""
+    async def update_processing_task(self, task_id: str, worker_id: str, status: str,
+                                     error_message: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Record a running task's outcome; None if the worker no longer holds its lease"""
         data = {
             "status": status,
             "updated_at": datetime.utcnow().isoformat(),
@@ -146,24 +381,72 @@ class Database:
         if error_message:
             data["error_message"] = error_message
 
-        result = self.client.table("processing_tasks").update(data).eq("id", task_id).execute()
-        return result.data[0] if result.data else None
+        result = await self._update("processing_tasks", self._leased_task_filters(task_id, worker_id), data)
+        return result[0] if result else None
+
+    async def lease_processing_tasks(self, worker_id: str, limit: int, lease_seconds: int) -> List[Dict[str, Any]]:
+        """Claim up to `limit` runnable tasks for a worker (see sql_cmds/processing_task_queue.sql)"""
+        return await self._rpc("lease_processing_tasks", {
+            "p_worker_id": worker_id,
+            "p_limit": limit,
+            "p_lease_seconds": lease_seconds,
+        })
+
+    async def renew_processing_task_lease(self, task_id: str, worker_id: str, lease_seconds: int) -> bool:
+        """Extend a running task's lease; False if the worker no longer holds it"""
+        lease_expires_at = (datetime.utcnow() + timedelta(seconds=lease_seconds)).isoformat()
+        result = await self._update(
+            "processing_tasks",
+            self._leased_task_filters(task_id, worker_id),
+            {"lease_expires_at": lease_expires_at, "updated_at": datetime.utcnow().isoformat()},
+        )
+        return bool(result)
+
+    async def retry_processing_task(self, task_id: str, worker_id: str, run_after: datetime,
+                                    error_message: str) -> Optional[Dict[str, Any]]:
+        """
+        Release a running task back to the queue, runnable again at `run_after` (UTC);
+        None if the worker no longer holds its lease
+        """
+        data = {
+            "status": "pending",
+            "run_after": run_after.isoformat(),
+            "lease_expires_at": None,
+            "worker_id": None,
+            "error_message": error_message,
+            "updated_at": datetime.utcnow().isoformat(),
+        }
+        result = await self._update("processing_tasks", self._leased_task_filters(task_id, worker_id), data)
+        return result[0] if result else None
+
+    @staticmethod
+    def _leased_task_filters(task_id: str, worker_id: str) -> Dict[str, str]:
+        """Match the task only while `worker_id` holds its lease (another worker may have taken it over)"""
+        return {"id": f"eq.{task_id}", "worker_id": f"eq.{worker_id}", "status": "eq.running"}
 
     # Storage operations
-    def upload_file(self, bucket: str, file_path: str, file_data: bytes) -> str:
+    async def upload_file(self, bucket: str, file_path: str, file_data: bytes, upsert: bool = False) -> str:
         """Upload file to Supabase Storage"""
-        result = self.client.storage.from_(bucket).upload(file_path, file_data)
+        response = await self.client.post(
+            f"/storage/v1/object/{bucket}/{file_path}",
+            content=file_data,
+            headers={
+                "Content-Type": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                "x-upsert": "true" if upsert else "false",
+            },
+        )
+        response.raise_for_status()
         return file_path
 
-    def download_file(self, bucket: str, file_path: str) -> bytes:
+    async def download_file(self, bucket: str, file_path: str) -> bytes:
         """Download file from Supabase Storage"""
-        result = self.client.storage.from_(bucket).download(file_path)
-        return result
+        response = await self.client.get(f"/storage/v1/object/{bucket}/{file_path}")
+        response.raise_for_status()
+        return response.content
 
     def get_public_url(self, bucket: str, file_path: str) -> str:
         """Get public URL for a file"""
-        result = self.client.storage.from_(bucket).get_public_url(file_path)
-        return result
+        return f"{self.base_url}/storage/v1/object/public/{bucket}/{file_path}"
 
 
 # Singleton instance
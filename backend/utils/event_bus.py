@@ -0,0 +1,47 @@
+"""
+In-process publish/subscribe of per-document events (drives the SSE endpoints)
+"""
+from collections import defaultdict
+from typing import Any, Dict, Set
+import asyncio
+
+
+class EventBus:
+    """
+    Fan-out of document events to subscribed asyncio queues.
+
+    Publishing never blocks: if a slow subscriber's queue is full, its oldest event
+    is dropped (status events are snapshots, so the latest one is what matters).
+    Must be used from the event loop thread.
+    """
+
+    def __init__(self, max_queue_size: int = 100):
+        self.max_queue_size = max_queue_size
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+
+    def subscribe(self, document_id: str) -> asyncio.Queue:
+        """Register a new queue that receives every event published for the document"""
+        queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._subscribers[document_id].add(queue)
+        return queue
+
+    def unsubscribe(self, document_id: str, queue: asyncio.Queue):
+        """Remove a queue registered with subscribe()"""
+        subscribers = self._subscribers.get(document_id)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[document_id]
+
+    def publish(self, document_id: str, event: str, data: Dict[str, Any]):
+        """Deliver an event to all current subscribers of the document"""
+        message = {"event": event, "data": data}
+        for queue in list(self._subscribers.get(document_id, ())):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+
+# Singleton instance
+event_bus = EventBus()
@@ -0,0 +1,40 @@
+"""
+ETag helpers for conditional GET on document endpoints
+"""
+from fastapi import Request, Response
+from typing import Any, Dict
+import hashlib
+
+
+def document_etag(kind: str, document: Dict[str, Any], *extra: Any) -> str:
+    """
+    Strong ETag for a representation derived from a document.
+
+    Built from the document id, its version (bumped on every field change) and status,
+    plus any extra inputs the representation depends on.
+    """
+    key = "|".join(str(part) for part in (kind, document["id"], document["version"], document.get("status"), *extra))
+    return '"' + hashlib.sha1(key.encode("utf-8")).hexdigest() + '"'
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    """True if the request's If-None-Match header matches `etag`"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison, so ignore any W/ prefix
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return etag in candidates
+
+
+def not_modified_response(etag: str) -> Response:
+    """Empty 304 response carrying the current ETag"""
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+
+def set_etag(response: Response, etag: str):
+    """Attach the ETag to a full response (clients must revalidate before reuse)"""
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
@@ -0,0 +1,138 @@
+"""
+Write-behind queue for conversation_memory inserts
+"""
+from typing import Any, Dict, List, Optional
+from config import settings
+from utils.database import db
+from utils.metrics import metrics
+import asyncio
+import httpx
+
+
+class MessageWriter:
+    """
+    Buffers conversation messages and writes them to conversation_memory in batches.
+
+    - enqueue() is synchronous and never touches the network, so saving a message
+      costs nothing on the request path
+    - A background task flushes every `interval_seconds`, or as soon as `max_batch`
+      rows are waiting
+    - Failed batches stay at the front of the queue and are retried on the next flush.
+      A batch the database rejects (4xx, e.g. a message whose document was deleted), or
+      one that failed `max_retries` times, is split to find the offending rows, which are
+      logged and dropped so they can't block every later write
+    - At most `max_pending` rows are queued; beyond that new messages are logged and dropped
+    - flush() is awaited before reading conversation_memory (flush-on-read) and on
+      shutdown, so readers and restarts never miss acknowledged messages
+    """
+
+    def __init__(self, max_batch: int, interval_seconds: float, max_retries: int = 5,
+                 max_pending: int = 10000):
+        self.max_batch = max_batch
+        self.interval_seconds = interval_seconds
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+        self._pending: List[Dict[str, Any]] = []
+        self._failures = 0  # Consecutive failed flushes of the batch at the front
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the background flush loop (call from the app's startup event)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def enqueue(self, row: Dict[str, Any]):
+        """Queue a row built with db.build_conversation_message"""
+        if len(self._pending) >= self.max_pending:
+            metrics.increment("message_writer.dropped")
+            print(f"⚠ Conversation message queue full ({self.max_pending}), dropping message for {row.get('document_id')}")
+            return
+        self._pending.append(row)
+        if self._task is None:
+            # Used outside the app (scripts): start flushing lazily
+            self.start()
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write everything queued so far"""
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[:self.max_batch]
+                try:
+                    await db.insert_conversation_messages(batch)
+                except Exception as e:
+                    metrics.increment("message_writer.failed_flushes")
+                    self._failures += 1
+                    if not self._is_rejection(e) and self._failures < self.max_retries:
+                        print(f"⚠ Failed to write {len(batch)} conversation messages (will retry): {e}")
+                        return
+                    print(f"⚠ Failed to write {len(batch)} conversation messages, isolating bad rows: {e}")
+                    remaining = await self._write_halves(batch)
+                    # Rows that still failed without being dropped go back to the front
+                    self._pending[:len(batch)] = remaining
+                    if remaining:
+                        return
+                    self._failures = 0
+                    continue
+                del self._pending[:len(batch)]
+                self._failures = 0
+                metrics.observe("message_writer.batch_size", len(batch))
+
+    @staticmethod
+    def _is_rejection(error: Exception) -> bool:
+        """Whether the database refused the rows themselves (retrying the same batch can't help)"""
+        return isinstance(error, httpx.HTTPStatusError) and 400 <= error.response.status_code < 500
+
+    async def _write_halves(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Write rows by halves to isolate the ones that fail. A failing single row is dropped
+        if the database rejected it or its batch is out of retries; returns the rows that
+        failed for other reasons (kept for the next flush).
+        """
+        try:
+            await db.insert_conversation_messages(rows)
+            return []
+        except Exception as e:
+            if len(rows) == 1:
+                if self._is_rejection(e) or self._failures >= self.max_retries:
+                    metrics.increment("message_writer.dropped")
+                    print(f"⚠ Dropping conversation message {rows[0].get('id')} for {rows[0].get('document_id')}: {e}")
+                    return []
+                return rows
+
+        middle = len(rows) // 2
+        return await self._write_halves(rows[:middle]) + await self._write_halves(rows[middle:])
+
+    async def close(self):
+        """Stop the flush loop and write out whatever is still queued"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._pending:
+            print(f"⚠ {len(self._pending)} conversation messages could not be written before shutdown")
+
+
+# Singleton instance
+message_writer = MessageWriter(
+    settings.MESSAGE_WRITE_BATCH_SIZE,
+    settings.MESSAGE_WRITE_INTERVAL_SECONDS,
+    max_retries=settings.MESSAGE_WRITE_MAX_RETRIES,
+    max_pending=settings.MESSAGE_WRITE_MAX_PENDING,
+)
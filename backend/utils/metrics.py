@@ -0,0 +1,68 @@
+"""
+Process-local counters and timing summaries, served by GET /metrics
+"""
+from collections import defaultdict, deque
+from typing import Any, Dict
+import threading
+
+
+class TimingStats:
+    """Count/total/max plus a window of recent samples for percentiles"""
+
+    __slots__ = ("count", "total", "max", "recent")
+
+    def __init__(self, window: int = 1000):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.recent.append(value)
+
+    def summary(self) -> Dict[str, float]:
+        ordered = sorted(self.recent)
+        if not ordered:
+            return {"count": 0}
+
+        def percentile(p: float) -> float:
+            return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+        return {
+            "count": self.count,
+            "avg": self.total / self.count,
+            "p50": percentile(0.50),
+            "p95": percentile(0.95),
+            "max": self.max,
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._timings: Dict[str, TimingStats] = defaultdict(TimingStats)
+
+    def increment(self, name: str, amount: int = 1):
+        """Add to a counter"""
+        with self._lock:
+            self._counters[name] += amount
+
+    def observe(self, name: str, value: float):
+        """Record a timing (seconds) or other sampled value"""
+        with self._lock:
+            self._timings[name].add(value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "timings": {name: stats.summary() for name, stats in self._timings.items()},
+            }
+
+
+# Singleton instance
+metrics = Metrics()
@@ -0,0 +1,20 @@
+"""
+Server-sent events helpers
+"""
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator
+import json
+
+
+def format_sse(event: str, data: dict) -> str:
+    """Serialize one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    """Wrap an async iterator of formatted events in an unbuffered text/event-stream response"""
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )